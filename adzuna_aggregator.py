@@ -7,12 +7,17 @@ GlobalJobAggregator v2.4 - С УМНЫМ КЕШИРОВАНИЕМ
 import os
 import requests
 import json
+import threading
 import time
 import hashlib
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
 from dotenv import load_dotenv
+from job_classifier import classify_job
+from job_text import ingest_description
+from job_index import query_slice, store_slice
+from base_aggregator import JobVacancy  # единый тип записи для всех источников
 import pickle
 from urllib.parse import urlparse
 import random
@@ -46,22 +51,6 @@ except ImportError:
 
 load_dotenv()
 
-@dataclass
-class JobVacancy:
-    id: str
-    title: str
-    company: str
-    location: str
-    salary: Optional[str]
-    description: str
-    apply_url: str
-    source: str
-    posted_date: str
-    country: str
-    job_type: Optional[str] = None
-    language_requirement: str = "unknown"
-    refugee_friendly: bool = False
-
 @dataclass
 class CachedResult:
     """Структура для кешированного результата"""
@@ -151,7 +140,7 @@ class CacheManager:
                     if datetime.now() < cached_result.expires_at:
                         print(f"🎯 Cache HIT (Redis): {cache_key[:8]}... ({len(cached_result.data)} jobs)")
                         return (cached_result.data if search_params.get("raw") else
-                               [JobVacancy(**job_data) for job_data in cached_result.data])
+                               [JobVacancy.from_dict(job_data) for job_data in cached_result.data])
                     else:
                         # Кеш истек, удаляем
                         self.redis_client.delete(f"job_search:{cache_key}")
@@ -173,7 +162,7 @@ class CacheManager:
                 if datetime.now() < cached_result.expires_at:
                     print(f"🎯 Cache HIT (File): {cache_key[:8]}... ({len(cached_result.data)} jobs)")
                     return (cached_result.data if search_params.get("raw") else
-                           [JobVacancy(**job_data) for job_data in cached_result.data])
+                           [JobVacancy.from_dict(job_data) for job_data in cached_result.data])
                 else:
                     # Кеш истек, удаляем файл
                     os.remove(cache_file)
@@ -197,7 +186,7 @@ class CacheManager:
         
         cached_result = CachedResult(
             data=(jobs if search_params.get("raw") else
-                  [asdict(job) for job in jobs]),
+                  [job.to_dict() for job in jobs]),
             timestamp=datetime.now(),
             search_params=search_params,
             expires_at=expires_at
@@ -262,7 +251,7 @@ class CacheManager:
                             pass
                         return None
                     if datetime.now() < cached_result.expires_at:
-                        return [JobVacancy(**job_data) for job_data in data_list]
+                        return [JobVacancy.from_dict(job_data) for job_data in data_list]
                     else:
                         self.redis_client.delete(cache_key)
                         return None
@@ -284,7 +273,7 @@ class CacheManager:
                         pass
                     return None
                 if datetime.now() < cached_result.expires_at:
-                    return [JobVacancy(**job_data) for job_data in data_list]
+                    return [JobVacancy.from_dict(job_data) for job_data in data_list]
                 else:
                     os.remove(cache_file)
             except Exception:
@@ -304,7 +293,7 @@ class CacheManager:
         cache_key = self._term_cache_key(country, location, keywords)
         expires_at = datetime.now() + self.cache_duration
         cached_result = CachedResult(
-            data=[asdict(job) for job in jobs],
+            data=[job.to_dict() for job in jobs],
             timestamp=datetime.now(),
             search_params={'c': country, 'l': location, 'k': keywords},
             expires_at=expires_at
@@ -378,6 +367,8 @@ class GlobalJobAggregator:
         TTL для Adzuna берём из ADZUNA_CACHE_HOURS или из общего CACHE_TTL_HOURS (по умолчанию 24).
         """
         self.cooldown_until = 0  # до этого времени Adzuna пропускается
+        # почему последний _search_single_term этого потока вернул [] (None — выдача пустая)
+        self._request_state = threading.local()
 
         self.app_id = os.getenv('ADZUNA_APP_ID')
         self.app_key = os.getenv('ADZUNA_APP_KEY')
@@ -1672,12 +1663,15 @@ class GlobalJobAggregator:
 
         
     
-    def search_specific_jobs(self, preferences: Dict, progress_callback=None, cancel_check=None) -> List[JobVacancy]:
+    def search_specific_jobs(self, preferences: Dict, progress_callback=None, cancel_check=None,
+                             jobs_callback=None) -> List[JobVacancy]:
         """
         Поиск конкретных профессий:
         - Если есть общий кеш по всему запросу — берём как стартовый набор (и можем отдать в progress_callback),
         НО всё равно докачиваем недостающее через суб-кеш/онлайн.
         - Никогда не «только кеш», если нет глобального cooldown.
+        - jobs_callback(jobs) получает найденное по мере поиска (после каждого терма) —
+          чтобы cancel_check мог остановить поиск, когда найденного достаточно.
         """
         # 0) Стартовый набор из общего кеша (если есть)
         job_map: Dict[str, JobVacancy] = {}
@@ -1693,6 +1687,8 @@ class GlobalJobAggregator:
                 url = getattr(j, 'apply_url', None)
                 if url:
                     job_map[url] = j
+            if jobs_callback and job_map:
+                jobs_callback(list(job_map.values()))
             # по желанию — шевельнём прогресс небольшой партией
             if progress_callback and job_map:
                 try:
@@ -1707,7 +1703,8 @@ class GlobalJobAggregator:
         # 1) Реальный поиск с суб-кешем (внутри _batch_search_jobs)
         #    ВАЖНО: progress_callback сюда не передаём — внутри он числовой,
         #    а в app.py ожидается список вакансий.
-        all_jobs = self._perform_search(preferences, progress_callback=None, cancel_check=cancel_check)
+        all_jobs = self._perform_search(preferences, progress_callback=None, cancel_check=cancel_check,
+                                        jobs_callback=jobs_callback)
 
         # 2) Склейка и финальный общий кеш
         for j in (all_jobs or []):
@@ -1723,7 +1720,8 @@ class GlobalJobAggregator:
         return final_list
 
     
-    def _perform_search(self, preferences: Dict, progress_callback=None, cancel_check=None) -> List[JobVacancy]:
+    def _perform_search(self, preferences: Dict, progress_callback=None, cancel_check=None,
+                        jobs_callback=None) -> List[JobVacancy]:
         """Выполнение поиска через API с поддержкой нескольких городов + circuit breaker + cancel_check."""
         all_jobs: List[JobVacancy] = []
 
@@ -1772,7 +1770,8 @@ class GlobalJobAggregator:
                         break
 
                     # ⚠️ прокидываем cancel_check вниз
-                    jobs = self._batch_search_jobs(terms, country, city or '', 25, cancel_check=cancel_check)
+                    jobs = self._batch_search_jobs(terms, country, city or '', 25, cancel_check=cancel_check,
+                                                   jobs_callback=jobs_callback)
                     current_search += 1
 
                     if jobs:
@@ -1854,7 +1853,8 @@ class GlobalJobAggregator:
         # Возвращаем максимум 6 терминов
         return selected_terms[:6]
     
-    def _batch_search_jobs(self, terms: List[str], country: str, location: str = '', max_results: int = 25, cancel_check=None) -> List[JobVacancy]:
+    def _batch_search_jobs(self, terms: List[str], country: str, location: str = '', max_results: int = 25,
+                           cancel_check=None, jobs_callback=None) -> List[JobVacancy]:
         """Поиск по списку терминов для одной страны/города + прерывание при 429/cancel + суб-кеш по термам."""
         if cancel_check and cancel_check():
             return []
@@ -1873,17 +1873,34 @@ class GlobalJobAggregator:
         seen_urls = set()
         location = location or ''
 
+        def add_jobs(jobs):
+            added = []
+            for j in jobs:
+                url = getattr(j, 'apply_url', None)
+                if not url or url in seen_urls:
+                    continue
+                seen_urls.add(url)
+                added.append(j)
+            all_jobs.extend(added)
+            if jobs_callback and added:
+                jobs_callback(added)
+
         # какие именно термы реально пойдут в API для страны
         localized_terms = self._get_localized_terms(terms, country)
         country_name = self.countries[country]['name']
         languages = ', '.join(self.COUNTRY_LANGUAGES.get(country, ['english']))
         print(f"\n     🌍 Страна: {country_name}, языки поиска: {languages}")
 
-        # 1) Сначала пытаемся вытащить из суб-кеша
+        # 1) Сначала — локальный индекс (свежий срез), затем суб-кеш
         terms_to_fetch: List[str] = []
         for term in localized_terms:
             if cancel_check and cancel_check():
                 break
+            indexed = query_slice('adzuna', country, location, term)
+            if indexed is not None:
+                print(f"     🗂 Index HIT для '{term}': {len(indexed)}")
+                add_jobs(indexed)
+                continue
             cached = self.cache_manager.get_term_cached_result(country, location, term)
             if cached is None:
                 # нет записи — надо реально сходить в API
@@ -1892,12 +1909,7 @@ class GlobalJobAggregator:
             # есть запись (в том числе пустая) — подмешиваем, но не идём в API
             if cached:
                 print(f"     💾 Subcache HIT для '{term}': {len(cached)}")
-                for j in cached:
-                    url = getattr(j, 'apply_url', None)
-                    if not url or url in seen_urls:
-                        continue
-                    seen_urls.add(url)
-                    all_jobs.append(j)
+                add_jobs(cached)
             else:
                 print(f"     💾 Subcache HIT для '{term}': 0 (пропускаем запрос)")
 
@@ -1912,20 +1924,20 @@ class GlobalJobAggregator:
                 # наверх — чтобы _perform_search завершил источник и включил переключение
                 raise
 
-            # Сохраняем в суб-кеш вне зависимости от результата (включая пустой список)
-            try:
-                self.cache_manager.cache_term_result(country, location, term, chunk or [])
-            except Exception:
-                pass
+            error = self.last_request_error()
+            # Сохраняем в суб-кеш и пустой ответ API, но не оборванный сбоем/отменой —
+            # иначе терм «пуст» до конца TTL
+            if not error:
+                try:
+                    self.cache_manager.cache_term_result(country, location, term, chunk or [])
+                except Exception:
+                    pass
+            # сбой/отмена — не свежий срез (store_slice только запишет last_error)
+            store_slice('adzuna', country, location, term, chunk or [], error=error)
 
             if chunk:
                 print(f"     📊 Найдено для '{term}': {len(chunk)} вакансий")
-                for j in chunk:
-                    url = getattr(j, 'apply_url', None)
-                    if not url or url in seen_urls:
-                        continue
-                    seen_urls.add(url)
-                    all_jobs.append(j)
+                add_jobs(chunk)
             else:
                 print(f"     ❌ Ничего не найдено для '{term}'")
 
@@ -2120,8 +2132,9 @@ class GlobalJobAggregator:
     cancel_check=None
 ) -> List[JobVacancy]:
         """По одному термину. При 429 — включаем cooldown и роняем RateLimitedError; поддерживаем cancel_check."""
+        self._request_state.error = None
         if cancel_check and cancel_check():
-            return []
+            return self._term_failed('cancelled')
 
         # если уже в cooldown — не ходим
         now = time.time()
@@ -2147,7 +2160,7 @@ class GlobalJobAggregator:
 
         ok = self.rate_limiter.wait_if_needed(cancel_check=cancel_check)
         if ok is False or (cancel_check and cancel_check()):
-            return []
+            return self._term_failed('cancelled')
 
         try:
             response = requests.get(url, params=params, timeout=12)
@@ -2162,6 +2175,7 @@ class GlobalJobAggregator:
                 jobs: List[JobVacancy] = []
                 for job_data in results:
                     if cancel_check and cancel_check():
+                        self._request_state.error = 'cancelled'
                         break
                     job = self._normalize_job_data(job_data, country, filter_term or keywords)
                     if job:
@@ -2185,16 +2199,24 @@ class GlobalJobAggregator:
                 print(f"⚠️ Страна '{country}' не поддерживается Adzuna API. Пропускаем…")
                 return []
             print(f"❌ API вернул {response.status_code}: {response.text[:200]}")
-            return []
+            return self._term_failed(f"HTTP {response.status_code}")
 
         except requests.Timeout:
             print("⚠️ Adzuna: таймаут запроса — пропускаем term")
-            return []
+            return self._term_failed("timeout")
         except RateLimitedError:
             raise
         except Exception as e:
             print(f"❌ Adzuna: критическая ошибка: {e}")
-            return []
+            return self._term_failed(str(e))
+
+    def _term_failed(self, reason: str) -> List[JobVacancy]:
+        self._request_state.error = reason
+        return []
+
+    def last_request_error(self) -> Optional[str]:
+        """Почему последний _search_single_term этого потока вернул неполный/пустой результат"""
+        return getattr(self._request_state, 'error', None)
 
 
 
@@ -2223,8 +2245,8 @@ class GlobalJobAggregator:
             posted_date = raw_job.get('created', 'Unknown date')
             job_type = raw_job.get('contract_type', raw_job.get('contract_time', 'Not specified'))
             
-            language_req = self._determine_language_requirement(title, description, search_term)
-            refugee_friendly = self._is_refugee_friendly(title, description, search_term)
+            full_text, description = ingest_description(job_id, description)
+            language_req, refugee_friendly = classify_job(title, full_text, search_term)
             
             return JobVacancy(
                 id=job_id,
@@ -3266,34 +3288,11 @@ class GlobalJobAggregator:
     
     def _determine_language_requirement(self, title: str, description: str, search_term: str) -> str:
         """Определение языковых требований"""
-        text = f"{title} {description}".lower()
-        
-        no_language = ['no language', 'без языка', 'driver', 'delivery', 'warehouse', 'physical']
-        if any(indicator in text for indicator in no_language):
-            return "no_language_required"
-        
-        return "unknown"
+        return classify_job(title, description, search_term)[0]
     
     def _is_refugee_friendly(self, title: str, description: str, search_term: str) -> bool:
         """Определение дружелюбности к беженцам"""
-        text = f"{title} {description} {search_term}".lower()
-        
-        refugee_indicators = [
-            # Английский
-            'refugee', 'ukrainian', 'ukraine', 'asylum', 'integration',
-            'newcomer', 'immigrant', 'migration', 'no language required',
-            # Немецкий
-            'ukrainisch willkommen', 'flüchtling willkommen', 'ohne deutschkenntnisse', 'arbeit ohne sprache',
-            # Украинский / русский
-            'українським біженцям', 'українці вітаються', 'без знання мови',
-            'для беженцев', 'украинцам рады', 'без знания языка',
-            # Польский
-            'ukraińców mile widziane', 'bez znajomości języka',
-            # Чешский
-            'ukrajinci vítáni', 'bez znalosti jazyka'
-        ]
-
-        return any(indicator in text for indicator in refugee_indicators)
+        return classify_job(title, description, search_term)[1]
     
     def _format_salary(self, job_data: Dict, country: str) -> Optional[str]:
         """Форматирование зарплаты"""
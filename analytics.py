@@ -1,13 +1,21 @@
 # analytics.py -- централизованная трекинг-логика (минимальные правки в проекте)
 import json
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timedelta
 from typing import Optional, Tuple
 from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
 import os
+import atexit
+import queue
+import threading
+import time
 import requests
+from sqlalchemy import func, insert, inspect, text
+from sqlalchemy.exc import IntegrityError
 from flask import Blueprint, current_app, request, redirect, abort, Response, render_template
 from typing import Optional
 
+import geoip
 from database import db  # используем уже сконфигурированный SQLAlchemy из проекта
 
 # --- МОДЕЛИ ------------------------------------------------------------------
@@ -50,6 +58,370 @@ class PartnerClick(db.Model):
     job_title = db.Column(db.String(256))              # если передадим из шаблона
 
 
+class AnalyticsRollup(db.Model):
+    """
+    Предагрегаты для админки: счётчик событий за час (grain='hour') и за
+    сутки (grain='day') в разрезе метрики и значения. Пополняется
+    инкрементально фоновым писателем в той же транзакции, что и сами события.
+
+    metric: search_total / search_country / search_job / search_lang,
+            partner_total / partner / partner_domain (для *_total dim = '');
+    grain='meta', metric='backfill' — отметка, что история уже пересчитана
+    """
+    __tablename__ = "analytics_rollup"
+    id = db.Column(db.Integer, primary_key=True)
+    grain = db.Column(db.String(4), nullable=False)        # hour | day
+    bucket = db.Column(db.DateTime, nullable=False)        # начало часа/суток (UTC)
+    metric = db.Column(db.String(32), nullable=False)
+    dim = db.Column(db.String(256), nullable=False, default='')
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('grain', 'bucket', 'metric', 'dim', name='uq_analytics_rollup'),
+        db.Index('ix_analytics_rollup_metric', 'metric', 'grain', 'bucket'),
+    )
+
+
+# --- ПРЕДАГРЕГАТЫ ------------------------------------------------------------
+
+ROLLUP_GRAINS = ("hour", "day")
+_ROLLUP_CHUNK = 500
+_ROLLUP_LOCK_KEY = 0x616E6C72          # advisory-блокировка пересборки (Postgres)
+_BACKFILL_MARK = {"grain": "meta", "bucket": datetime(1970, 1, 1), "metric": "backfill", "dim": ""}
+
+
+def _json_list(value):
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    try:
+        parsed = json.loads(value)
+        return parsed if isinstance(parsed, list) else [parsed]
+    except Exception:
+        return [value]
+
+
+def _rollup_dims(model, row: dict):
+    """(metric, dim) события"""
+    if model is SearchClick:
+        yield "search_total", ""
+        for c in {str(c).strip().lower() for c in _json_list(row.get("countries")) if c}:
+            yield "search_country", c
+        for j in {str(j).strip() for j in _json_list(row.get("jobs")) if j}:
+            yield "search_job", j
+        lang = (row.get("lang") or "").strip()[:2].lower()
+        if lang:
+            yield "search_lang", lang
+    elif model is PartnerClick:
+        yield "partner_total", ""
+        yield "partner", (row.get("partner") or row.get("target_domain") or "unknown").strip()
+        if row.get("target_domain"):
+            yield "partner_domain", row["target_domain"]
+
+
+def rollup_counts(events) -> "Counter":
+    """[(model, row)] → Counter{(grain, bucket, metric, dim): n}"""
+    counter = Counter()
+    for model, row in events:
+        ts = row.get("created_at") or datetime.utcnow()
+        buckets = {
+            "hour": ts.replace(minute=0, second=0, microsecond=0),
+            "day": ts.replace(hour=0, minute=0, second=0, microsecond=0),
+        }
+        for metric, dim in _rollup_dims(model, row):
+            for grain in ROLLUP_GRAINS:
+                counter[(grain, buckets[grain], metric, (dim or "")[:256])] += 1
+    return counter
+
+
+def apply_rollups(counter) -> None:
+    """UPSERT счётчиков (count = count + n) в текущей сессии; коммит — у вызывающего"""
+    if not counter:
+        return
+    rows = [{"grain": g, "bucket": b, "metric": m, "dim": d, "count": n}
+            for (g, b, m, d), n in counter.items()]
+    dialect = db.engine.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        for i in range(0, len(rows), _ROLLUP_CHUNK):
+            stmt = dialect_insert(AnalyticsRollup).values(rows[i:i + _ROLLUP_CHUNK])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["grain", "bucket", "metric", "dim"],
+                set_={"count": AnalyticsRollup.count + stmt.excluded.count},
+            )
+            db.session.execute(stmt)
+        return
+    # прочие СУБД: построчно
+    for r in rows:
+        updated = AnalyticsRollup.query.filter_by(
+            grain=r["grain"], bucket=r["bucket"], metric=r["metric"], dim=r["dim"]
+        ).update({AnalyticsRollup.count: AnalyticsRollup.count + r["count"]})
+        if not updated:
+            db.session.add(AnalyticsRollup(**r))
+
+
+def rollup_total(metric: str, since: Optional[datetime] = None) -> int:
+    q = db.session.query(func.coalesce(func.sum(AnalyticsRollup.count), 0)).filter(
+        AnalyticsRollup.grain == "day", AnalyticsRollup.metric == metric)
+    if since:
+        q = q.filter(AnalyticsRollup.bucket >= since)
+    return int(q.scalar() or 0)
+
+
+def rollup_breakdown(metric: str, days: int = 30, limit: int = 20, grain: str = "day"):
+    """[(dim, count)] по убыванию за последние days суток"""
+    since = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+    total = func.sum(AnalyticsRollup.count)
+    rows = (db.session.query(AnalyticsRollup.dim, total)
+            .filter(AnalyticsRollup.grain == grain, AnalyticsRollup.metric == metric,
+                    AnalyticsRollup.bucket >= since)
+            .group_by(AnalyticsRollup.dim)
+            .order_by(total.desc())
+            .limit(limit).all())
+    return [(dim, int(n or 0)) for dim, n in rows]
+
+
+def _rollup_lock(days, shared: bool = False) -> None:
+    """
+    Advisory-блокировки по суткам до конца транзакции (только Postgres):
+    фоновый писатель берёт разделяемые на сутки своей пачки, пересборка —
+    исключительную на одни пересобираемые сутки. Остальные сутки (и
+    сегодняшние записи, пока пересобирается история) не ждут.
+    Сутки берутся по возрастанию — без взаимных блокировок.
+    """
+    if db.engine.dialect.name == "postgresql":
+        fn = "pg_advisory_xact_lock_shared" if shared else "pg_advisory_xact_lock"
+        for day in sorted(set(days)):
+            db.session.execute(text(f"SELECT {fn}(:k, :d)"), {"k": _ROLLUP_LOCK_KEY, "d": day.toordinal()})
+
+
+def _backfilled() -> bool:
+    return db.session.query(AnalyticsRollup.id).filter_by(
+        grain=_BACKFILL_MARK["grain"], metric=_BACKFILL_MARK["metric"]).first() is not None
+
+
+def _as_dt(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value   # SQLite отдаёт строкой
+
+
+def _rebuild_day(day: datetime, chunk: int) -> int:
+    """
+    Пересобрать предагрегаты одних суток: короткая транзакция под
+    исключительной блокировкой этих суток — DELETE их бакетов и пересчёт по
+    сырым событиям за сутки. Сбой откатывает только эти сутки.
+    """
+    next_day = day + timedelta(days=1)
+    processed = 0
+    try:
+        _rollup_lock([day.date()])
+        for model, prefix in ((SearchClick, "search_"), (PartnerClick, "partner_")):
+            AnalyticsRollup.query.filter(
+                AnalyticsRollup.grain.in_(ROLLUP_GRAINS),
+                AnalyticsRollup.metric.like(f"{prefix}%"),
+                AnalyticsRollup.bucket >= day,
+                AnalyticsRollup.bucket < next_day,
+            ).delete(synchronize_session=False)
+
+            columns = [c.name for c in model.__table__.columns if c.name != "id"]
+            pending = []
+            events = (model.query
+                      .filter(model.created_at >= day, model.created_at < next_day)
+                      .order_by(model.id).yield_per(chunk))
+            for obj in events:
+                pending.append((model, {c: getattr(obj, c) for c in columns}))
+                if len(pending) >= chunk:
+                    apply_rollups(rollup_counts(pending))
+                    processed += len(pending)
+                    pending = []
+            if pending:
+                apply_rollups(rollup_counts(pending))
+                processed += len(pending)
+        db.session.commit()
+        return processed
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def rebuild_rollups(chunk: int = 2000, force: bool = True) -> Optional[int]:
+    """
+    Пересобрать предагрегаты по сырым таблицам — посуточно, от самого
+    старого сырого события до сегодня, каждые сутки своей транзакцией
+    (_rebuild_day): писатель блокируется только на пересобираемые сутки и
+    только на время их пересчёта. Повторный или параллельный запуск даёт
+    тот же результат. Отметка о заполнении пишется после последних суток —
+    оборванное заполнение при следующем старте пройдёт заново.
+    Бакеты раньше самого старого сырого события (архивированные месяцы —
+    analytics_partitions) не трогаются. force=False — только если
+    заполнения ещё не было (возвращает None, если было).
+    Вызывать в app_context.
+    """
+    if not force and _backfilled():
+        db.session.rollback()
+        return None
+    oldest = [_as_dt(db.session.query(func.min(model.created_at)).scalar())
+              for model in (SearchClick, PartnerClick)]
+    oldest = [ts for ts in oldest if ts is not None]
+    db.session.rollback()
+    processed = 0
+    if oldest:
+        day = min(oldest).replace(hour=0, minute=0, second=0, microsecond=0)
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        while day <= today:
+            processed += _rebuild_day(day, chunk)
+            day += timedelta(days=1)
+    try:
+        if not _backfilled():
+            db.session.add(AnalyticsRollup(count=1, **_BACKFILL_MARK))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()       # отметку уже записал параллельный процесс
+    return processed
+
+
+def init_rollups(app):
+    """
+    Создать таблицу предагрегатов (если нет) и один раз заполнить её по
+    истории в фоновом потоке. «Один раз» — по отметке, которая пишется после
+    последних суток: оборванное заполнение повторится при следующем старте,
+    а одновременный старт web/воркеров пересчитает сутки повторно, но с тем
+    же результатом (каждые сутки — DELETE + пересчёт под блокировкой).
+    """
+    try:
+        with app.app_context():
+            AnalyticsRollup.__table__.create(bind=db.engine, checkfirst=True)
+            insp = inspect(db.engine)
+            if not (insp.has_table("search_click") and insp.has_table("partner_click")):
+                return
+            done = _backfilled()
+            db.session.remove()
+        if done:
+            return
+
+        def _backfill():
+            with app.app_context():
+                try:
+                    n = rebuild_rollups(force=False)
+                    if n is not None:
+                        print(f"✅ Analytics: предагрегаты заполнены по {n} событиям", flush=True)
+                except Exception as e:
+                    print(f"⚠️ Analytics: не удалось заполнить предагрегаты: {e}", flush=True)
+                finally:
+                    db.session.remove()
+
+        threading.Thread(target=_backfill, name="analytics-rollup-backfill", daemon=True).start()
+    except Exception as e:
+        print(f"⚠️ Analytics: init_rollups: {e}", flush=True)
+
+
+# --- ФОНОВЫЙ ПИСАТЕЛЬ --------------------------------------------------------
+
+ANALYTICS_FLUSH_BATCH = int(os.getenv("ANALYTICS_FLUSH_BATCH", "100"))
+ANALYTICS_FLUSH_SECONDS = float(os.getenv("ANALYTICS_FLUSH_SECONDS", "2"))
+ANALYTICS_QUEUE_MAX = int(os.getenv("ANALYTICS_QUEUE_MAX", "10000"))
+
+
+class AnalyticsWriter:
+    """
+    Клики не пишутся в БД внутри запроса: событие (модель + поля) кладётся
+    в очередь процесса, а фоновый поток раз в ANALYTICS_FLUSH_SECONDS или по
+    набору ANALYTICS_FLUSH_BATCH событий дополняет их гео (один запрос на
+    уникальный IP пачки), пишет bulk INSERT-ом и в той же транзакции
+    пополняет предагрегаты (AnalyticsRollup). Переполнение очереди —
+    событие теряется, но запрос не ждёт.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=ANALYTICS_QUEUE_MAX)
+        self._app = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def enqueue(self, model, row: dict):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((model, row))
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_started(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._app = current_app._get_current_object()
+            self._thread = threading.Thread(target=self._run, name="analytics-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _take_batch(self, wait: bool):
+        batch = []
+        deadline = time.monotonic() + ANALYTICS_FLUSH_SECONDS
+        while len(batch) < ANALYTICS_FLUSH_BATCH:
+            timeout = deadline - time.monotonic()
+            try:
+                if wait and timeout > 0:
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        with self._app.app_context():
+            geo_cache = {}
+            by_model = {}
+            for model, row in batch:
+                ip = row.get("ip")
+                if ip not in geo_cache:
+                    geo_cache[ip] = _geolocate_ip(ip) or {}
+                geo = geo_cache[ip]
+                row.setdefault("country", geo.get("country"))
+                row.setdefault("city", geo.get("city"))
+                row.setdefault("lat", geo.get("lat"))
+                row.setdefault("lon", geo.get("lon"))
+                by_model.setdefault(model, []).append(row)
+            try:
+                # не пересекаемся с пересборкой тех же суток (rebuild_rollups)
+                _rollup_lock([(row.get("created_at") or datetime.utcnow()).date() for _, row in batch],
+                             shared=True)
+                for model, rows in by_model.items():
+                    db.session.execute(insert(model), rows)
+                apply_rollups(rollup_counts(batch))
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ Analytics: не удалось записать {len(batch)} событий: {e}", flush=True)
+            finally:
+                db.session.remove()
+
+    def _run(self):
+        while True:
+            batch = self._take_batch(wait=True)
+            if batch:
+                self._write(batch)
+
+    def flush(self):
+        """Дописать всё, что осталось в очереди (при остановке процесса)"""
+        if not self._app:
+            return
+        while True:
+            batch = self._take_batch(wait=False)
+            if not batch:
+                return
+            self._write(batch)
+
+
+analytics_writer = AnalyticsWriter()
+
+
 # --- BLUEPRINT ---------------------------------------------------------------
 analytics_bp = Blueprint("analytics", __name__)
 
@@ -141,27 +513,22 @@ def outbound():
                         headers={'Cache-Control': 'no-store'})
 
 
-    # логирование (не блокируем редирект)
+    # логирование: только постановка в буфер — гео и запись в БД делает фоновый писатель
     try:
         ip, ua, lang = _extract_request_meta(request)
-        geo = _geolocate_ip(ip)
-        pc = PartnerClick(
+        partner_final = partner or _guess_partner_from_host(parsed.netloc)
+        analytics_writer.enqueue(PartnerClick, dict(
+            created_at=datetime.utcnow(),
             ip=ip,
             user_agent=ua,
             lang=lang,
-            country=(geo or {}).get("country"),
-            city=(geo or {}).get("city"),
-            lat=(geo or {}).get("lat"),
-            lon=(geo or {}).get("lon"),
-            partner=partner or _guess_partner_from_host(parsed.netloc),
+            partner=partner_final,
             target_domain=parsed.netloc.lower(),
             target_url=target_url,
             job_id=job_id,
             job_title=title,
-        )
-        db.session.add(pc)
-        db.session.commit()
-        print("PARTNER_CLICK =>", (partner or _guess_partner_from_host(parsed.netloc) or "Unknown"), target_url, flush=True)
+        ))
+        print("PARTNER_CLICK =>", (partner_final or "Unknown"), target_url, flush=True)
     except Exception as e:
         current_app.logger.exception("PartnerClick log failed: %s", e)
 
@@ -178,7 +545,6 @@ def log_search_click(preferences: dict):
     """
     try:
         ip, ua, lang = _extract_request_meta(request)
-        geo = _geolocate_ip(ip)
 
         # --- нормализация стран ---
         raw_countries = preferences.get("countries") or []
@@ -204,17 +570,14 @@ def log_search_click(preferences: dict):
         else:
             city_q = preferences.get("city")
 
-        sc = SearchClick(
+        analytics_writer.enqueue(SearchClick, dict(
+            created_at=datetime.utcnow(),
             ip=ip, user_agent=ua, lang=lang,
-            country=(geo or {}).get("country"), city=(geo or {}).get("city"),
-            lat=(geo or {}).get("lat"), lon=(geo or {}).get("lon"),
             is_refugee=bool(preferences.get("is_refugee")),
             countries=countries_json,
             jobs=jobs_json,
             city_query=city_q,
-        )
-        db.session.add(sc)
-        db.session.commit()
+        ))
     except Exception as e:
         current_app.logger.exception("SearchClick log failed: %s", e)
 
@@ -249,15 +612,23 @@ def _extract_request_meta(req) -> Tuple[str, str, str]:
 
 def _geolocate_ip(ip: str) -> Optional[dict]:
     """
-    Бюджетная геолокация. Работает «по возможности»:
-    - RFC1918/локальные IP — пропускаем
+    Геолокация по локальной базе диапазонов (geoip.py: bisect + LRU по IP);
+    HTTP-сервис — только запасной вариант, см. _geolocate_ip_http.
+    """
+    try:
+        return geoip.lookup(ip, http_fallback=_geolocate_ip_http)
+    except Exception:
+        return None
+
+
+def _geolocate_ip_http(ip: str) -> Optional[dict]:
+    """
+    Бюджетная геолокация через внешний сервис. Работает «по возможности»:
     - внешний сервис читаем из конфигов:
       GEOIP_URL (напр. https://ipapi.co/{ip}/json) и GEOIP_TOKEN (опционально)
     - по умолчанию пробуем ipapi.co без ключа (мягко, с timeout)
     """
     try:
-        if not ip or ip.startswith(("10.", "192.168.", "127.", "172.")):
-            return None
         template = (current_app.config.get("GEOIP_URL") or "https://ipapi.co/{ip}/json").strip()
         url = template.format(ip=ip)
         headers = {}
@@ -281,18 +652,31 @@ def _geolocate_ip(ip: str) -> Optional[dict]:
 
 from sqlalchemy import inspect
 
-def recent_events(limit=50):
-    """Последние записи по обоим типам кликов; безопасно работает, если таблиц ещё нет."""
+RECENT_EVENTS_DAYS = int(os.getenv("RECENT_EVENTS_DAYS", "31"))
+
+
+def recent_events(limit=50, days=RECENT_EVENTS_DAYS):
+    """
+    Последние записи по обоим типам кликов; безопасно работает, если таблиц ещё нет.
+    Окно days по created_at — на секционированных таблицах читаются только свежие секции.
+    """
     insp = inspect(db.engine)
     has_sc = insp.has_table("search_click")
     has_pc = insp.has_table("partner_click")
+    since = datetime.utcnow() - timedelta(days=days) if days else None
 
     sc = []
     pc = []
     if has_sc:
-        sc = SearchClick.query.order_by(SearchClick.created_at.desc()).limit(limit).all()
+        q = SearchClick.query
+        if since:
+            q = q.filter(SearchClick.created_at >= since)
+        sc = q.order_by(SearchClick.created_at.desc()).limit(limit).all()
     if has_pc:
-        pc = PartnerClick.query.order_by(PartnerClick.created_at.desc()).limit(limit).all()
+        q = PartnerClick.query
+        if since:
+            q = q.filter(PartnerClick.created_at >= since)
+        pc = q.order_by(PartnerClick.created_at.desc()).limit(limit).all()
     return sc, pc
 
 # analytics.py (в самом верху рядом с импортами)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Помесячное хранение сырых событий аналитики (search_click, partner_click).
+
+На Postgres таблицы секционированы по created_at (миграция d5e1a9c4b702):
+по секции на месяц (search_click_y2025m01 …) плюс DEFAULT для всего, что
+не попало в диапазоны. Запросы с окном по created_at читают только свои
+секции, индексы растут в пределах месяца, а удаление старого — это
+DETACH + DROP секции вместо DELETE миллионов строк.
+
+  • ensure_partitions — заранее создаёт секции на ANALYTICS_PARTITIONS_AHEAD
+    месяцев вперёд (строки месяца, успевшие попасть в DEFAULT, переносятся);
+  • archive_old — месяцы старше ANALYTICS_RETENTION_MONTHS выгружаются в
+    ANALYTICS_ARCHIVE_DIR/<таблица>/YYYY-MM.ndjson.gz и удаляются из БД.
+    По умолчанию (0) архивирование выключено.
+
+На SQLite и на несекционированных таблицах архивирование работает по
+диапазону created_at (индекс ix_*_created_at): выгрузка месяца, затем DELETE.
+Итоги в админке считаются по analytics_rollup и после архивации не меняются.
+"""
+
+import gzip
+import json
+import os
+import re
+import threading
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import MetaData, Table, func, inspect, select, text
+
+from database import db
+
+ANALYTICS_TABLES = ('search_click', 'partner_click')
+ANALYTICS_PARTITIONS_AHEAD = int(os.getenv('ANALYTICS_PARTITIONS_AHEAD', '3'))
+ANALYTICS_RETENTION_MONTHS = int(os.getenv('ANALYTICS_RETENTION_MONTHS', '0'))
+ANALYTICS_ARCHIVE_DIR = os.getenv('ANALYTICS_ARCHIVE_DIR', os.path.join('instance', 'analytics_archive'))
+ANALYTICS_ARCHIVE_BATCH = int(os.getenv('ANALYTICS_ARCHIVE_BATCH', '5000'))
+
+_PARTITION_RE = re.compile(r'_y(\d{4})m(\d{2})$')
+_PARTITION_LOCK_KEY = 0x616E7074          # advisory-блокировка создания секций (Postgres)
+_maintenance_lock = threading.Lock()
+
+
+def _month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def _add_months(month: date, n: int) -> date:
+    y, m = divmod(month.year * 12 + month.month - 1 + n, 12)
+    return date(y, m + 1, 1)
+
+
+def _as_datetime(month: date) -> datetime:
+    return datetime(month.year, month.month, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_y{month.year:04d}m{month.month:02d}"
+
+
+def is_partitioned(conn, table: str) -> bool:
+    if conn.dialect.name != 'postgresql':
+        return False
+    return conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = :t AND pg_table_is_visible(c.oid)"
+    ), {'t': table}).first() is not None
+
+
+def list_partitions(conn, table: str) -> List[Tuple[str, date]]:
+    """Помесячные секции таблицы (без DEFAULT), по возрастанию месяца"""
+    rows = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :t AND pg_table_is_visible(p.oid)"
+    ), {'t': table}).scalars()
+    out = []
+    for name in rows:
+        m = _PARTITION_RE.search(name)
+        if m:
+            out.append((name, date(int(m.group(1)), int(m.group(2)), 1)))
+    return sorted(out, key=lambda item: item[1])
+
+
+def ensure_partitions(conn, now: Optional[datetime] = None, ahead: int = ANALYTICS_PARTITIONS_AHEAD) -> List[str]:
+    """
+    Секции текущего и следующих ahead месяцев. Новая секция создаётся
+    отдельной таблицей, в неё переносятся строки месяца из DEFAULT, и только
+    потом она подключается (ATTACH) — так не мешают строки, попавшие в DEFAULT.
+    Процессы (web, воркеры, планировщик) создают секции по очереди — под
+    advisory-блокировкой до конца транзакции, и видят секции друг друга.
+    """
+    created = []
+    current = _month_start(now or datetime.utcnow())
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {'k': _PARTITION_LOCK_KEY})
+    for table in ANALYTICS_TABLES:
+        if not is_partitioned(conn, table):
+            continue
+        existing = {name for name, _ in list_partitions(conn, table)}
+        for i in range(ahead + 1):
+            month = _add_months(current, i)
+            name = partition_name(table, month)
+            if name in existing:
+                continue
+            bounds = {'a': month, 'b': _add_months(month, 1)}
+            conn.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)"))
+            conn.execute(text(
+                f"WITH moved AS (DELETE FROM {table}_default "
+                f"WHERE created_at >= :a AND created_at < :b RETURNING *) "
+                f"INSERT INTO {name} SELECT * FROM moved"
+            ), bounds)
+            conn.execute(text(
+                f"ALTER TABLE {table} ATTACH PARTITION {name} "
+                f"FOR VALUES FROM ('{bounds['a']}') TO ('{bounds['b']}')"
+            ))
+            created.append(name)
+    if created:
+        print(f"🗂 Analytics: созданы секции {', '.join(created)}")
+    return created
+
+
+def _archive_path(table: str, month: date, archive_dir: str) -> str:
+    folder = os.path.join(archive_dir, table)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{month:%Y-%m}.ndjson.gz")
+    n = 1
+    while os.path.exists(path):       # повторный архив того же месяца не затирает прежний
+        path = os.path.join(folder, f"{month:%Y-%m}.{n}.ndjson.gz")
+        n += 1
+    return path
+
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, (datetime, date)) else str(value)
+
+
+def _export(conn, source: Table, table: str, month: date, archive_dir: str, where=None) -> Tuple[int, Optional[str]]:
+    """Выгрузить строки (потоком) в gzip NDJSON; файл появляется только целиком"""
+    stmt = select(source)
+    if where is not None:
+        stmt = stmt.where(where)
+    result = conn.execution_options(stream_results=True, yield_per=ANALYTICS_ARCHIVE_BATCH).execute(stmt)
+    path = _archive_path(table, month, archive_dir)
+    tmp = path + '.tmp'
+    count = 0
+    with gzip.open(tmp, 'wt', encoding='utf-8') as fh:
+        for row in result.mappings():
+            fh.write(json.dumps(dict(row), ensure_ascii=False, default=_json_default) + '\n')
+            count += 1
+    if not count:
+        os.remove(tmp)
+        return 0, None
+    os.replace(tmp, path)
+    return count, path
+
+
+def _reflect(conn, name: str) -> Table:
+    return Table(name, MetaData(), autoload_with=conn)
+
+
+def archive_old(retention_months: int = ANALYTICS_RETENTION_MONTHS, archive_dir: str = ANALYTICS_ARCHIVE_DIR,
+                now: Optional[datetime] = None) -> Dict[str, int]:
+    """Выгрузить и удалить месяцы старше retention_months; {таблица: строк в архиве}"""
+    stats = {t: 0 for t in ANALYTICS_TABLES}
+    if retention_months <= 0:
+        return stats
+    cutoff = _add_months(_month_start(now or datetime.utcnow()), -retention_months)
+    cutoff_dt = _as_datetime(cutoff)
+
+    for table in ANALYTICS_TABLES:
+        with db.engine.connect() as conn:
+            if not inspect(conn).has_table(table):
+                continue
+            partitioned = is_partitioned(conn, table)
+            partitions = list_partitions(conn, table) if partitioned else []
+
+        # 1) целые секции: выгрузка, затем DETACH + DROP
+        for name, month in partitions:
+            if month >= cutoff:
+                continue
+            with db.engine.begin() as conn:
+                count, path = _export(conn, _reflect(conn, name), table, month, archive_dir)
+                conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+                conn.execute(text(f"DROP TABLE {name}"))
+            stats[table] += count
+            print(f"📦 Analytics: секция {name} → {path or 'пустая'} ({count} строк), удалена")
+
+        # 2) SQLite / несекционированная таблица / остатки в DEFAULT — по диапазону дат
+        source_name = f"{table}_default" if partitioned else table
+        while True:
+            with db.engine.begin() as conn:
+                if partitioned and not inspect(conn).has_table(source_name):
+                    break
+                source = _reflect(conn, source_name)
+                oldest = conn.execute(select(func.min(source.c.created_at))
+                                      .where(source.c.created_at < cutoff_dt)).scalar()
+                if oldest is None:
+                    break
+                if isinstance(oldest, str):           # SQLite отдаёт строкой
+                    oldest = datetime.fromisoformat(oldest)
+                month = _month_start(oldest)
+                upper = min(_add_months(month, 1), cutoff)
+                window = (source.c.created_at >= _as_datetime(month)) & (source.c.created_at < _as_datetime(upper))
+                count, path = _export(conn, source, table, month, archive_dir, where=window)
+                conn.execute(source.delete().where(window))
+            stats[table] += count
+            print(f"📦 Analytics: {source_name} за {month:%Y-%m} → {path} ({count} строк), удалено")
+    return stats
+
+
+def run_maintenance(app, retention_months: int = ANALYTICS_RETENTION_MONTHS) -> Dict[str, int]:
+    """Секции вперёд + архивация старого; для планировщика и ручного запуска"""
+    if not _maintenance_lock.acquire(blocking=False):
+        return {}
+    try:
+        with app.app_context():
+            with db.engine.begin() as conn:
+                ensure_partitions(conn)
+            return archive_old(retention_months)
+    except Exception as e:
+        print(f"⚠️ Analytics: обслуживание хранилища не удалось: {e}")
+        return {}
+    finally:
+        _maintenance_lock.release()
+
+
+def init_partitions(app):
+    """
+    При старте: только проверка секции текущего месяца (если таблицы
+    секционированы); её нет — создаётся она одна. Секции вперёд —
+    дело run_maintenance по расписанию.
+    """
+    try:
+        with app.app_context():
+            current = _month_start(datetime.utcnow())
+            with db.engine.connect() as conn:
+                missing = [t for t in ANALYTICS_TABLES
+                           if is_partitioned(conn, t)
+                           and partition_name(t, current) not in {n for n, _ in list_partitions(conn, t)}]
+            if not missing:
+                return
+            with db.engine.begin() as conn:
+                ensure_partitions(conn, ahead=0)
+    except Exception as e:
+        print(f"⚠️ Analytics: не удалось подготовить секции: {e}")
+
+
+if __name__ == '__main__':
+    import argparse
+    from app import app as flask_app
+
+    parser = argparse.ArgumentParser(description="Секции и архивация сырых событий аналитики")
+    parser.add_argument('--retention-months', type=int, default=ANALYTICS_RETENTION_MONTHS,
+                        help="архивировать месяцы старше N (0 — только создать секции)")
+    args = parser.parse_args()
+    print(run_maintenance(flask_app, args.retention_months))
@@ -24,18 +24,18 @@ from datetime import datetime, timedelta  # ← ДОБАВИТЬ timedelta!
 from collections import defaultdict        # ← ДОБАВИТЬ это!
 import secrets
 import uuid
-from dataclasses import asdict
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, render_template_string,  Response
-from email_service import mail, send_welcome_email, send_preferences_update_email, send_job_notifications, run_scheduled_notifications
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, render_template_string,  Response, stream_with_context, g
+from email_service import mail, send_welcome_email, send_preferences_update_email, send_job_notifications, run_scheduled_notifications, iter_due_subscribers
 
 # Добавить эти импорты ПОСЛЕ существующих
 from flask_mail import Mail
-from database import db, Subscriber, EmailLog  
+from database import (db, Subscriber, EmailLog, SubscriberCountry, ensure_subscriber_schedule,
+                      ensure_subscriber_preferences, preference_demand, preferences_enabled)
 from email_service import mail, send_welcome_email, send_preferences_update_email
 from flask_migrate import Migrate
 from pathlib import Path
 import time
-from sqlalchemy import func
+from sqlalchemy import and_, case, func, or_
 from datetime import datetime, timezone
 import re
 EMAIL_RE = re.compile(r"^[A-Za-z0-9.!#$%&'*+/=?^_`{|}~-]+@([A-Za-z0-9-]+\.)+[A-Za-z]{2,}$")
@@ -50,11 +50,20 @@ from flask import render_template, make_response
 from adzuna_aggregator import GlobalJobAggregator, JobVacancy
 from careerjet_aggregator import CareerjetAggregator
 from remotive_aggregator import RemotiveAggregator
+from job_dedup import NearDuplicateIndex, add_to_job_map, dedupe_jobs
+from job_ranking import JobRanking, ranked_page
+from job_text import get_full_description, flush_descriptions
+from job_index import init_job_index
+from digest_log import DigestLogBuffer
+from backup import iter_backup, restore_backup
+from ip_rate_limit import SlidingWindowLimiter, client_ip as rate_limit_client_ip
+from session_store import init_session_store, compact_preferences, expand_preferences
+from analytics_partitions import init_partitions, run_maintenance as run_analytics_maintenance
+import digest_seen
 # === Live progress state (для живого прогресса/остановки) ===
 active_searches = {}  # sid -> state dict
 
 import threading, inspect
-from dataclasses import asdict
 from pathlib import Path
 import time
 from flask import redirect, request, Response
@@ -63,7 +72,7 @@ from werkzeug.middleware.proxy_fix import ProxyFix
 
 from flask import Flask, render_template
 # === трекинг-логика (минимальные правки) ===
-from analytics import analytics_bp, log_search_click, pretty_json, h as html_escape
+from analytics import analytics_bp, log_search_click, pretty_json, h as html_escape, init_rollups
 
 
 from flask import Flask
@@ -361,61 +370,23 @@ def tg_index_alias():
     return send_from_directory("static/tg", "index.html")
 
 
-# Rate limiting
-RATE_LIMIT_FILE = "rate_limits.json"
+# Rate limiting: скользящее окно по IP в Redis (в памяти — если Redis нет), см. ip_rate_limit
 MAX_SEARCHES_PER_DAY = 5
-
-def load_rate_limits():
-    """Загрузка ограничений по IP"""
-    try:
-        with open(RATE_LIMIT_FILE, 'r') as f:
-            data = json.load(f)
-            # Конвертируем строки обратно в datetime
-            for ip, searches in data.items():
-                data[ip] = [datetime.fromisoformat(dt) for dt in searches]
-            # 🔧 ИСПРАВЛЕНИЕ: всегда возвращаем defaultdict
-            return defaultdict(list, data)
-    except FileNotFoundError:
-        return defaultdict(list)
-    except Exception as e:
-        print(f"❌ Ошибка загрузки rate limits: {e}")
-        return defaultdict(list)
-
-def save_rate_limits(limits):
-   """Сохранение ограничений по IP"""
-   # Конвертируем datetime в строки для JSON
-   serializable_data = {}
-   for ip, searches in limits.items():
-       serializable_data[ip] = [dt.isoformat() for dt in searches]
-   
-   with open(RATE_LIMIT_FILE, 'w') as f:
-       json.dump(serializable_data, f)
+search_limiter = SlidingWindowLimiter(redis_client, limit=MAX_SEARCHES_PER_DAY, window_seconds=24 * 3600)
 
 def check_rate_limit(ip_address):
-    """Проверка лимита поисков для IP"""
-    limits = load_rate_limits()
-    now = datetime.now()
-    day_ago = now - timedelta(days=1)
-    
-    # 🔧 ДОБАВЛЕНА ТОЛЬКО ЭТА ПРОВЕРКА:
-    if ip_address not in limits:
-        limits[ip_address] = []
-    
-    # Очищаем старые записи (старше суток)
-    recent_searches = [dt for dt in limits[ip_address] if dt > day_ago]
-    limits[ip_address] = recent_searches
-    
-    # Проверяем лимит
-    if len(recent_searches) >= MAX_SEARCHES_PER_DAY:
-        # TEMP OFF: отключили суточный лимит
-        #return False, MAX_SEARCHES_PER_DAY - len(recent_searches)
-        pass
-    
-    # Добавляем текущий поиск
-    limits[ip_address].append(now)
-    save_rate_limits(limits)
-    
-    return True, MAX_SEARCHES_PER_DAY - len(limits[ip_address])
+    """Проверка лимита поисков для IP; заголовки X-RateLimit-* добавит after_request"""
+    result = search_limiter.hit(ip_address)
+    g.rate_limit = result
+    return result.allowed, result.remaining
+
+
+@app.after_request
+def add_rate_limit_headers(resp):
+    result = g.get('rate_limit')
+    if result is not None:
+        resp.headers.update(result.headers())
+    return resp
 
 # Импортируем дополнительные источники (опционально)
 try:
@@ -433,6 +404,23 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-change-me')
 app.config['SESSION_COOKIE_DOMAIN'] = '.globaljobhunter.vip'
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 app.config['SESSION_COOKIE_SECURE'] = True  # у тебя https на Railway
+# SESSION_BACKEND=redis — в cookie только id сессии, данные в Redis
+init_session_store(app, redis_client)
+
+
+def _session_preferences():
+    """Последние предпочтения поиска из сессии (в полном виде)"""
+    return expand_preferences(session.get('last_search_preferences'))
+
+
+def _remember_search(results_id, preferences, search_time=None):
+    """Запомнить поиск в сессии; пишем только изменившиеся значения (опросы прогресса не трогают cookie)"""
+    values = {'results_id': results_id, 'last_search_preferences': compact_preferences(preferences)}
+    if search_time is not None:
+        values['search_time'] = round(search_time, 2)
+    for key, value in values.items():
+        if session.get(key) != value:
+            session[key] = value
 
 
 # Настройки базы данных
@@ -477,6 +465,11 @@ app.config.update(
 db.init_app(app)
 mail.init_app(app)
 migrate = Migrate(app, db)
+init_job_index(app)
+ensure_subscriber_schedule(app)
+ensure_subscriber_preferences(app)
+init_rollups(app)
+init_partitions(app)
 
 # Инициализация основного агрегатора
 try:
@@ -586,7 +579,7 @@ def search_jobs():
         return jsonify({'error': 'Сервис временно недоступен'}), 500
     
     # Rate limiting
-    client_ip = (request.headers.get('X-Forwarded-For') or request.remote_addr or '0.0.0.0').split(',')[0].strip()
+    client_ip = rate_limit_client_ip(request)
     allowed, remaining = check_rate_limit(client_ip)
     if not allowed:
         app.logger.warning(f"🚫 Rate limit exceeded for IP: {client_ip}")
@@ -620,7 +613,7 @@ def search_jobs():
         }
 
         # подмерживаем прошлое, но приоритет у свежих значений из формы
-        last = session.get('last_search_preferences') or {}
+        last = _session_preferences()
         preferences = {**last, **preferences}
 
         # если город не задан, но есть список городов — берем первый
@@ -668,6 +661,10 @@ def search_jobs():
                     app.logger.warning(f"⚠️ {source_name} ошибка: {e}")
                     continue
         
+        # Схлопываем одну и ту же вакансию, пришедшую из разных источников
+        jobs = dedupe_jobs(jobs)
+        flush_descriptions()
+
         search_time = time.time() - start_time
         
         cache_stats = aggregator.get_cache_stats()
@@ -676,10 +673,9 @@ def search_jobs():
         
         if jobs:
             results_id = str(uuid.uuid4())
-            job_details_map = {job.id: asdict(job) for job in jobs}
+            job_details_map = JobRanking.from_jobs(job.to_dict() for job in jobs).ordered_map()
             aggregator.search_cache[results_id] = job_details_map
             
-            session['results_id'] = results_id
             # Сохраняем снапшот результатов в Redis (1 час)
             if redis_client:
                 try:
@@ -687,12 +683,9 @@ def search_jobs():
                                     json.dumps(job_details_map, ensure_ascii=False, default=str))
                 except Exception as e:
                     app.logger.warning(f"Redis set results:{results_id} failed: {e}")
-            session['last_search_preferences'] = preferences
-            session['search_time'] = search_time
+            _remember_search(results_id, preferences, search_time)
         else:
-            session['results_id'] = None
-            session['last_search_preferences'] = preferences
-            session['search_time'] = search_time
+            _remember_search(None, preferences, search_time)
 
         payload = {
             'success': True,
@@ -742,7 +735,7 @@ def search_start():
         return jsonify({'error': 'Сервис временно недоступен'}), 500
 
     # rate limit — как в /search
-    client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.environ.get('REMOTE_ADDR', 'unknown'))
+    client_ip = rate_limit_client_ip(request)
     allowed, remaining = check_rate_limit(client_ip)
     if not allowed:
         return jsonify({
@@ -763,7 +756,7 @@ def search_start():
         'cities': cities
     }
 
-    last = session.get('last_search_preferences') or {}
+    last = _session_preferences()
     preferences = {**last, **preferences}
 
     if not preferences.get('city') and preferences.get('cities'):
@@ -794,6 +787,8 @@ def search_start():
         'completed_sources': [],
         'sites_status': {},            # name -> pending|active|done|error
         'job_map': {},                 # id -> job dict
+        'dedup_index': NearDuplicateIndex(),  # почти-дубли между источниками
+        'ranking': JobRanking(),       # порядок выдачи, пополняется по ходу поиска
         'jobs_count': 0,
         'results_id': None,
         'status': 'running',
@@ -847,11 +842,12 @@ def _search_worker(sid: str):
                     return
                 added = 0
                 for j in batch_jobs:
-                    jid = getattr(j, 'id', None)
-                    if not jid:
+                    if not getattr(j, 'id', None) or j.id in s['job_map']:
                         continue
-                    if jid not in s['job_map']:
-                        s['job_map'][jid] = asdict(j)
+                    key = add_to_job_map(s['job_map'], s['dedup_index'], j.to_dict())
+                    if key:
+                        s['ranking'].add(s['job_map'][key])
+                    if key == j.id:
                         added += 1
                 if added:
                     s['jobs_count'] = len(s['job_map'])
@@ -888,11 +884,11 @@ def _search_worker(sid: str):
 
             if jobs:
                 for j in jobs:
-                    jid = getattr(j, 'id', None)
-                    if not jid:
+                    if not getattr(j, 'id', None) or j.id in st['job_map']:
                         continue
-                    if jid not in st['job_map']:
-                        st['job_map'][jid] = asdict(j)
+                    key = add_to_job_map(st['job_map'], st['dedup_index'], j.to_dict())
+                    if key:
+                        st['ranking'].add(st['job_map'][key])
                 st['jobs_count'] = len(st['job_map'])
 
             st['sites_status'][name] = 'done'
@@ -904,8 +900,9 @@ def _search_worker(sid: str):
             st['completed_sources'].append(name)
 
     # ФИНАЛИЗАЦИЯ БЕЗ session: просто запишем в кэш и отметим результат
+    flush_descriptions()
     st['results_id'] = st.get('results_id') or str(uuid.uuid4())
-    snapshot = st.get('job_map') or {}
+    snapshot = st['ranking'].ordered_map() if st.get('job_map') else {}
     aggregator.search_cache[st['results_id']] = snapshot
 
     if 'redis_client' in globals() and redis_client:
@@ -928,8 +925,7 @@ def search_progress():
 
     # КОГДА всё готово — теперь МОЖНО положить в session (мы в request context)
     if st['status'] == 'done' and st.get('results_id'):
-        session['results_id'] = st['results_id']
-        session['last_search_preferences'] = st['preferences']
+        _remember_search(st['results_id'], st['preferences'])
 
     payload = {
         'status': st['status'],
@@ -961,12 +957,13 @@ def search_stop():
     # Финализируем прямо здесь (даже если поток где-то ждёт rate-limit)
     if not st.get('results_id') and st['job_map']:
         st['results_id'] = str(uuid.uuid4())
-        aggregator.search_cache[st['results_id']] = st['job_map']
+        snapshot = st['ranking'].ordered_map()
+        aggregator.search_cache[st['results_id']] = snapshot
         # ← ДОБАВИТЬ: снапшот в Redis
         if 'redis_client' in globals() and redis_client:
             try:
                 redis_client.setex(f"results:{st['results_id']}", 3600,
-                                json.dumps(st['job_map'], ensure_ascii=False, default=str))
+                                json.dumps(snapshot, ensure_ascii=False, default=str))
             except Exception as e:
                 app.logger.warning(f"Redis set results:{st['results_id']} failed: {e}")
 
@@ -977,8 +974,7 @@ def search_stop():
     wants_json = 'application/json' in (request.headers.get('Accept', '') or '')
 
     if st.get('results_id'):
-        session['results_id'] = st['results_id']
-        session['last_search_preferences'] = st['preferences']
+        _remember_search(st['results_id'], st['preferences'])
 
     if is_ajax or wants_json or request.is_json:
         return jsonify({'ok': True, 'redirect_url': redirect_url})
@@ -994,7 +990,7 @@ def search_stop():
 def results():
     """Страница результатов"""
     results_id  = session.get('results_id')
-    preferences = session.get('last_search_preferences', {})
+    preferences = _session_preferences()
     search_time = session.get('search_time', 0)
 
     if not results_id:
@@ -1038,22 +1034,9 @@ def results():
         'no_language': len([j for j in jobs_data if j.get('language_requirement') == 'no_language_required']),
     }
 
-    # НОВАЯ СОРТИРОВКА: сначала страна, внутри — приоритеты
-    def sort_key(job):
-        country = job.get('country', '')
-        refugee_friendly = job.get('refugee_friendly', False)
-        no_language = job.get('language_requirement') == 'no_language_required'
-        has_salary = job.get('salary') is not None
-        posted_date = job.get('posted_date', '')
-        return (
-            country,               # группировка по стране
-            not refugee_friendly,  # сперва для беженцев
-            not no_language,       # затем без языка
-            not has_salary,        # затем с зарплатой
-            posted_date            # по дате
-        )
-
-    jobs_sorted = sorted(jobs_data, key=sort_key)
+    # Порядок: страна → для беженцев → без языка → с зарплатой → дата.
+    # Скор посчитан при добавлении (job_ranking), снапшот уже упорядочен —
+    # страница это срез, без сортировки всего списка на каждый просмотр.
 
     # Серверная пагинация
     try:
@@ -1065,13 +1048,13 @@ def results():
     except (TypeError, ValueError):
         per_page = 150
 
-    total_jobs  = len(jobs_sorted)
+    total_jobs  = len(jobs_data)
     total_pages = max(1, (total_jobs + per_page - 1) // per_page)
     page        = max(1, min(page, total_pages))
 
     start = (page - 1) * per_page
     end   = start + per_page
-    jobs_for_page = jobs_sorted[start:end]
+    jobs_for_page = ranked_page(job_details_map or {}, start, end)
 
     # Группировка по странам для разделителей
     jobs_by_country = {}
@@ -1155,7 +1138,7 @@ def subscribe():
             return jsonify({'error': 'Неверный email адрес'}), 400
         
         # Получаем предпочтения из сессии
-        preferences = session.get('last_search_preferences', {})
+        preferences = _session_preferences()
         print(f"⚙️ Предпочтения из сессии: {preferences}")
 
         # ПРОВЕРКА: Есть ли выбранные профессии?
@@ -1580,155 +1563,30 @@ def cleanup_cache():
     except Exception as e:
         return f"Ошибка: {str(e)}", 500
    
+def _subscriber_stats():
+    """Счётчики для админки: один агрегирующий запрос на таблицу вместо пяти count()"""
+    total, active = db.session.query(
+        func.count(Subscriber.id),
+        func.coalesce(func.sum(case((Subscriber.is_active.is_(True), 1), else_=0)), 0),
+    ).one()
+    by_status = dict(db.session.query(EmailLog.status, func.count(EmailLog.id))
+                     .filter(EmailLog.status.in_(('sent', 'failed')))
+                     .group_by(EmailLog.status).all())
+    return {
+        'total': total,
+        'active': int(active),
+        'inactive': total - int(active),
+        'emails_sent': by_status.get('sent', 0),
+        'emails_failed': by_status.get('failed', 0),
+    }
+
+
 @app.route('/admin/subscribers')
 def admin_subscribers():
-    """Расширенная админка для просмотра подписчиков"""
+    """Старый вход по ключу — теперь просто ведёт на защищённую страницу"""
     admin_key = request.args.get('key')
     if admin_key != os.getenv('ADMIN_KEY'):
         return "Access Denied", 403
-    
-    subscribers = Subscriber.query.order_by(Subscriber.created_at.desc()).all()
-    email_logs = EmailLog.query.order_by(EmailLog.sent_at.desc()).limit(10).all()
-    
-    stats = {
-        'total': Subscriber.query.count(),
-        'active': Subscriber.query.filter_by(is_active=True).count(),
-        'inactive': Subscriber.query.filter_by(is_active=False).count(),
-        'emails_sent': EmailLog.query.filter_by(status='sent').count(),
-        'emails_failed': EmailLog.query.filter_by(status='failed').count()
-    }
-    
-    html = f"""
-    <!DOCTYPE html>
-    <html lang="{{ request.cookies.get('lang','ru') }}"
-    <head>
-        <title>Админка подписчиков</title>
-        <meta charset="utf-8">
-        <script defer src="{{ url_for('static', filename='js/localization.js') }}"></script>
-        <style>
-            body {{ font-family: Arial, sans-serif; margin: 20px; background: #f8f9fa; }}
-            .container {{ max-width: 1200px; margin: 0 auto; }}
-            table {{ border-collapse: collapse; width: 100%; margin: 20px 0; background: white; }}
-            th, td {{ border: 1px solid #ddd; padding: 12px; text-align: left; }}
-            th {{ background-color: #007bff; color: white; }}
-            .stats {{ display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 20px; margin: 20px 0; }}
-            .stat-card {{ background: white; padding: 20px; border-radius: 8px; text-align: center; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }}
-            .stat-number {{ font-size: 2em; font-weight: bold; color: #007bff; }}
-            .email-logs {{ background: white; padding: 20px; border-radius: 8px; margin: 20px 0; }}
-            .nav {{ display: flex; gap: 20px; margin: 20px 0; }}
-            .nav a {{ background: #007bff; color: white; padding: 10px 20px; text-decoration: none; border-radius: 4px; }}
-            .job-list {{ font-size: 0.9em; color: #666; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>📧 Админка подписчиков GlobalJobHunter</h1>
-            
-            <div class="nav">
-                <a href="/">🏠 Главная</a>
-                <a href="/admin/stats?key={admin_key}">📊 Статистика кеша</a>
-                <a href="/health">💚 Здоровье системы</a>
-                <a href="/admin/cache">🧹 Кэш</a>
-            </div>
-            
-            <div class="stats">
-                <div class="stat-card">
-                    <div class="stat-number">{stats['total']}</div>
-                    <p>Всего подписчиков</p>
-                </div>
-                <div class="stat-card">
-                    <div class="stat-number">{stats['active']}</div>
-                    <p>Активных</p>
-                </div>
-                <div class="stat-card">
-                    <div class="stat-number">{stats['inactive']}</div>
-                    <p>Неактивных</p>
-                </div>
-                <div class="stat-card">
-                    <div class="stat-number">{stats['emails_sent']}</div>
-                    <p>Email отправлено</p>
-                </div>
-                <div class="stat-card">
-                    <div class="stat-number">{stats['emails_failed']}</div>
-                    <p>Email ошибок</p>
-                </div>
-            </div>
-            
-            <h2>📋 Подписчики</h2>
-            <table>
-                <tr>
-                    <th>Email</th>
-                    <th>Статус</th>
-                    <th>Беженец</th>
-                    <th>Профессии</th>
-                    <th>Страны</th>
-                    <th>Город</th>
-                    <th>Частота</th>
-                    <th>Дата регистрации</th>
-                    <th>Действия</th>
-                </tr>
-    """
-    
-    for sub in subscribers:
-        status = "✅ Активен" if sub.is_active else "❌ Неактивен"
-        refugee = "✅ Да" if sub.is_refugee else "❌ Нет"
-        created = sub.created_at.strftime('%Y-%m-%d %H:%M')
-        
-        # Получаем профессии и страны
-        jobs = ', '.join(sub.get_selected_jobs()[:3]) if sub.get_selected_jobs() else 'Не указано'
-        if len(sub.get_selected_jobs()) > 3:
-            jobs += f' (+{len(sub.get_selected_jobs())-3})'
-            
-        countries = ', '.join(sub.get_countries()) if sub.get_countries() else 'Не указано'
-        city = sub.city or 'Не указан'
-        frequency = sub.frequency or 'weekly'
-        
-        html += f"""
-            <tr>
-                <td>{sub.email}</td>
-                <td>{status}</td>
-                <td>{refugee}</td>
-                <td class="job-list">{jobs}</td>
-                <td>{countries}</td>
-                <td>{city}</td>
-                <td>{frequency}</td>
-                <td>{created}</td>
-            </tr>
-        """
-    
-    html += """
-        </table>
-        
-        <div class="email-logs">
-            <h2>📨 Последние email логи</h2>
-            <table>
-                <tr>
-                    <th>Email</th>
-                    <th>Статус</th>
-                    <th>Дата</th>
-                </tr>
-    """
-    
-    for log in email_logs:
-        status_icon = "✅" if log.status == 'sent' else "❌"
-        sent_time = log.sent_at.strftime('%Y-%m-%d %H:%M')
-        html += f"""
-            <tr>
-                <td>{log.email}</td>
-                <td>{status_icon} {log.status}</td>
-                <td>{sent_time}</td>
-            </tr>
-        """
-    
-    html += """
-            </table>
-        </div>
-        
-        </div>
-    </body>
-    </html>
-    """
-    
     return redirect(url_for('admin_subscribers_secure'))
 
 @app.route('/admin/stats')
@@ -1846,6 +1704,11 @@ def job_details(job_id):
    if not job:
        return jsonify({'error': 'Вакансия не найдена'}), 404
    
+   # В снапшоте — сниппет; полный текст отдаём из хранилища описаний
+   full_description = get_full_description(job_id)
+   if full_description:
+       job = {**job, 'description': full_description}
+   
    return jsonify(job)
 
 @app.route('/favicon.ico')
@@ -2103,7 +1966,7 @@ def update_existing_subscription():
         
         print(f"🔄 Обновляем подписку: email={email}, action={action}")  # ДОБАВЛЕНО
         
-        preferences = session.get('last_search_preferences', {})
+        preferences = _session_preferences()
         existing = Subscriber.query.filter_by(email=email).first()
         
         if not existing:
@@ -2407,8 +2270,9 @@ def admin_dashboard():
     
     # Получаем статистику для отображения
     try:
-        total_subscribers = Subscriber.query.count()
-        active_subscribers = Subscriber.query.filter_by(is_active=True).count()
+        sub_stats = _subscriber_stats()
+        total_subscribers = sub_stats['total']
+        active_subscribers = sub_stats['active']
     except:
         total_subscribers = 0
         active_subscribers = 0
@@ -2674,149 +2538,152 @@ def admin_logout():
     session.pop('admin_logged_in', None)
     return redirect(url_for('index'))
 
-@app.route('/admin/subscribers_secure')
-def admin_subscribers_secure():
-    """Защищенная страница подписчиков"""
-    if not session.get('admin_logged_in'):
-        return redirect(url_for('admin_login_page'))
-    
+ADMIN_PAGE_SIZE = int(os.getenv('ADMIN_PAGE_SIZE', '100'))
+ADMIN_PAGE_SIZE_MAX = 500
+
+
+def _admin_subscriber_filters(args):
+    """Фильтры списка подписчиков из query string (пустые — не применяются)"""
+    return {
+        'lang': (args.get('lang') or '').strip().lower()[:5],
+        'frequency': (args.get('frequency') or '').strip().lower()[:20],
+        'country': (args.get('country') or '').strip().lower()[:8],
+        'active': (args.get('active') or '').strip(),
+        'q': (args.get('q') or '').strip().lower()[:120],
+    }
+
+
+def _admin_subscribers_query(filters, after=None):
+    """
+    Страница подписчиков: новые сверху, keyset-пагинация по (created_at, id)
+    — без OFFSET и без загрузки всей таблицы.
+    """
+    q = Subscriber.query
+    if filters['lang']:
+        q = q.filter(Subscriber.lang == filters['lang'])
+    if filters['frequency']:
+        q = q.filter(Subscriber.frequency == filters['frequency'])
+    if filters['active'] in ('1', '0'):
+        q = q.filter(Subscriber.is_active.is_(filters['active'] == '1'))
+    if filters['country']:
+        if preferences_enabled():
+            q = q.filter(db.session.query(SubscriberCountry.subscriber_id).filter(
+                SubscriberCountry.subscriber_id == Subscriber.id,
+                SubscriberCountry.country == filters['country'],
+            ).exists())
+        else:
+            # таблицы предпочтений нет — ищем код в JSON-тексте
+            q = q.filter(func.lower(Subscriber.countries).like(f'%"{filters["country"]}"%'))
+    if filters['q']:
+        q = q.filter(Subscriber.email.ilike(f"%{filters['q']}%"))
+    if after:
+        after_created, after_id = after
+        q = q.filter(or_(
+            Subscriber.created_at < after_created,
+            and_(Subscriber.created_at == after_created, Subscriber.id < after_id),
+        ))
+    return q.order_by(Subscriber.created_at.desc(), Subscriber.id.desc())
+
+
+def _parse_admin_cursor(value):
+    """'2025-01-31T10:00:00.123456_42' → (datetime, id)"""
     try:
-        subscribers = Subscriber.query.order_by(Subscriber.created_at.desc()).all()
-        email_logs = EmailLog.query.order_by(EmailLog.sent_at.desc()).limit(10).all()
-        
-        stats = {
-            'total': Subscriber.query.count(),
-            'active': Subscriber.query.filter_by(is_active=True).count(),
-            'inactive': Subscriber.query.filter_by(is_active=False).count(),
-            'emails_sent': EmailLog.query.filter_by(status='sent').count(),
-            'emails_failed': EmailLog.query.filter_by(status='failed').count()
-        }
-        
-        # Создаем строки подписчиков
-        subscribers_rows = ""
-        for sub in subscribers:
-            try:
-                status = "✅ Активен" if sub.is_active else "❌ Неактивен"
-                refugee = "✅ Да" if sub.is_refugee else "❌ Нет"
-                created = sub.created_at.strftime('%Y-%m-%d %H:%M')
-                
-                # Получаем профессии и страны БЕЗОПАСНО
-                try:
-                    jobs_list = sub.get_selected_jobs()
-                    jobs = ', '.join(jobs_list[:3]) if jobs_list else 'Не указано'
-                    if len(jobs_list) > 3:
-                        jobs += f' (+{len(jobs_list)-3})'
-                except Exception as e:
-                    jobs = 'Ошибка загрузки'
-                    print(f"❌ Ошибка получения профессий для {sub.email}: {e}")
-                
-                try:
-                    countries_list = sub.get_countries()
-                    countries = ', '.join(countries_list) if countries_list else 'Не указано'
-                except Exception as e:
-                    countries = 'Ошибка загрузки'
-                    print(f"❌ Ошибка получения стран для {sub.email}: {e}")
-                
-                city = sub.city or 'Не указан'
-                
-                subscribers_rows += f"""
-                    <tr>
-                        <td>{sub.email}</td>
-                        <td>{status}</td>
-                        <td>{refugee}</td>
-                        <td class="job-list">{jobs}</td>
-                        <td>{countries}</td>
-                        <td>{city}</td>
-                        <td>{created}</td>
-                        <td>
-                            <form method="post"
-                                action="/admin/subscribers/update_email"
-                                onsubmit="return handleEditSubmit(this, '{sub.email}')"
-                                style="display:inline-block; margin-right:6px">
-                                <input type="hidden" name="id" value="{sub.id}">
-                                <input type="hidden" name="email" value="{sub.email}">
-                                <button type="submit" title="Редактировать email">✏️ Редактировать</button>
-                            </form>
-                            <form method="post" action="/admin/subscribers/delete"
-                                style="display:inline-block"
-                                onsubmit="return confirm('Удалить подписчика {sub.email}?');">
-                                <input type="hidden" name="id" value="{sub.id}">
-                                <button type="submit" title="Удалить">🗑️ Удалить</button>
-                            </form>
-                        </td>
+        created, _, sid = (value or '').rpartition('_')
+        return (datetime.fromisoformat(created), int(sid)) if created else None
+    except ValueError:
+        return None
 
-                    </tr>"""
 
+def _admin_subscriber_row(sub):
+    h = html_escape
+    status = "✅ Активен" if sub.is_active else "❌ Неактивен"
+    refugee = "✅ Да" if sub.is_refugee else "❌ Нет"
+    created = sub.created_at.strftime('%Y-%m-%d %H:%M') if sub.created_at else '-'
 
-                    
-            except Exception as e:
-                print(f"❌ Ошибка обработки подписчика {sub.id}: {e}")
-                subscribers_rows += f"""
+    # Получаем профессии и страны БЕЗОПАСНО
+    try:
+        jobs_list = sub.get_selected_jobs()
+        jobs = ', '.join(jobs_list[:3]) if jobs_list else 'Не указано'
+        if len(jobs_list) > 3:
+            jobs += f' (+{len(jobs_list)-3})'
+    except Exception as e:
+        jobs = 'Ошибка загрузки'
+        print(f"❌ Ошибка получения профессий для {sub.email}: {e}")
+
+    try:
+        countries_list = sub.get_countries()
+        countries = ', '.join(countries_list) if countries_list else 'Не указано'
+    except Exception as e:
+        countries = 'Ошибка загрузки'
+        print(f"❌ Ошибка получения стран для {sub.email}: {e}")
+
+    email = h(sub.email)
+    email_js = h(json.dumps(sub.email))
+    return f"""
                     <tr>
-                        <td>{sub.email}</td>
+                        <td>{email}</td>
                         <td>{status}</td>
                         <td>{refugee}</td>
-                        <td class="job-list">{jobs}</td>
-                        <td>{countries}</td>
-                        <td>{city}</td>
+                        <td class="job-list">{h(jobs)}</td>
+                        <td>{h(countries)}</td>
+                        <td>{h(sub.city or 'Не указан')}</td>
+                        <td>{h(sub.lang or '')} / {h(sub.frequency or 'weekly')}</td>
                         <td>{created}</td>
                         <td>
                             <form method="post"
                                 action="/admin/subscribers/update_email"
-                                onsubmit="return handleEditSubmit(this, '{sub.email}')"
+                                onsubmit="return handleEditSubmit(this, {email_js})"
                                 style="display:inline-block; margin-right:6px">
                                 <input type="hidden" name="id" value="{sub.id}">
-                                <input type="hidden" name="email" value="{sub.email}">
+                                <input type="hidden" name="email" value="{email}">
                                 <button type="submit" title="Редактировать email">✏️ Редактировать</button>
                             </form>
                             <form method="post" action="/admin/subscribers/delete"
                                 style="display:inline-block"
-                                onsubmit="return confirm('Удалить подписчика {sub.email}?');">
+                                onsubmit="return confirm('Удалить подписчика ' + {email_js} + '?');">
                                 <input type="hidden" name="id" value="{sub.id}">
                                 <button type="submit" title="Удалить">🗑️ Удалить</button>
                             </form>
                         </td>
                     </tr>"""
 
-        
-        # Создаем строки email логов БЕЗОПАСНО
-        email_logs_rows = ""
-        for log in email_logs:
-            try:
-                status_icon = "✅" if log.status == 'sent' else "❌"
-                sent_time = log.sent_at.strftime('%Y-%m-%d %H:%M')
-                
-                # ИСПРАВЛЕНИЕ: Безопасное получение email
-                if log.subscriber:
-                    email = log.subscriber.email
-                else:
-                    # Если subscriber удален, показываем ID или email из лога
-                    email = f"Удаленный подписчик (ID: {log.subscriber_id})"
-                
-                email_logs_rows += f"""
-                    <tr>
-                        <td>{email}</td>
-                        <td>{status_icon} {log.status}</td>
-                        <td>{sent_time}</td>
-                    </tr>"""
-                    
-            except Exception as e:
-                print(f"❌ Ошибка обработки лога {log.id}: {e}")
-                email_logs_rows += f"""
-                    <tr>
-                        <td>Ошибка загрузки</td>
-                        <td>❌ Ошибка</td>
-                        <td>-</td>
-                    </tr>"""
-                
-        # Теперь создаем полный HTML
-        html = f"""
+
+@app.route('/admin/subscribers_secure')
+def admin_subscribers_secure():
+    """
+    Защищенная страница подписчиков: фильтры (lang, frequency, country,
+    active, q), keyset-страницы по ADMIN_PAGE_SIZE и потоковая отдача HTML —
+    строки уходят клиенту по мере рендера.
+    """
+    if not session.get('admin_logged_in'):
+        return redirect(url_for('admin_login_page'))
+
+    h = html_escape
+    filters = _admin_subscriber_filters(request.args)
+    after = _parse_admin_cursor(request.args.get('after'))
+    try:
+        per_page = max(1, min(int(request.args.get('per_page', ADMIN_PAGE_SIZE)), ADMIN_PAGE_SIZE_MAX))
+    except ValueError:
+        per_page = ADMIN_PAGE_SIZE
+
+    try:
+        stats = _subscriber_stats()
+    except Exception as e:
+        print(f"❌ Ошибка статистики подписчиков: {e}")
+        stats = {'total': 0, 'active': 0, 'inactive': 0, 'emails_sent': 0, 'emails_failed': 0}
+
+    def _option(name, value, label):
+        selected = ' selected' if filters[name] == value else ''
+        return f'<option value="{h(value)}"{selected}>{h(label)}</option>'
+
+    def generate():
+        yield f"""
         <!DOCTYPE html>
-        <html lang="{{ request.cookies.get('lang','ru') }}"
+        <html lang="ru">
         <head>
             <title>Подписчики - Админка</title>
             <meta charset="utf-8">
-            <script defer src="{{ url_for('static', filename='js/localization.js') }}"></script>
+            <script defer src="{url_for('static', filename='js/localization.js')}"></script>
             <style>
                 body {{ font-family: Arial, sans-serif; margin: 20px; background: #f8f9fa; }}
                 .container {{ max-width: 1200px; margin: 0 auto; }}
@@ -2828,6 +2695,8 @@ def admin_subscribers_secure():
                 .stat-number {{ font-size: 2em; font-weight: bold; color: #007bff; }}
                 .nav {{ display: flex; gap: 20px; margin: 20px 0; }}
                 .nav a {{ background: #007bff; color: white; padding: 10px 20px; text-decoration: none; border-radius: 4px; }}
+                .filters {{ background: white; padding: 15px; border-radius: 8px; display: flex; gap: 10px; flex-wrap: wrap; align-items: center; }}
+                .pager a {{ background: #007bff; color: white; padding: 8px 16px; text-decoration: none; border-radius: 4px; margin-right: 10px; }}
                 .job-list {{ font-size: 0.9em; color: #666; }}
                 .error {{ color: #dc3545; font-weight: bold; }}
             </style>
@@ -2835,37 +2704,33 @@ def admin_subscribers_secure():
         <body>
             <div class="container">
                 <h1>📧 Подписчики GlobalJobHunter</h1>
-                
+
                 <div class="nav">
                     <a href="/admin/dashboard">🏠 Главная админки</a>
                     <a href="/admin/stats_secure">📊 Статистика</a>
                     <a href="/admin/cache">🧹 Кэш</a>
                     <a href="/admin/logout">🚪 Выйти</a>
                 </div>
-                
+
                 <div class="stats">
-                    <div class="stat-card">
-                        <div class="stat-number">{stats['total']}</div>
-                        <p>Всего подписчиков</p>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">{stats['active']}</div>
-                        <p>Активных</p>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">{stats['inactive']}</div>
-                        <p>Неактивных</p>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">{stats['emails_sent']}</div>
-                        <p>Email отправлено</p>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">{stats['emails_failed']}</div>
-                        <p>Email ошибок</p>
-                    </div>
+                    <div class="stat-card"><div class="stat-number">{stats['total']}</div><p>Всего подписчиков</p></div>
+                    <div class="stat-card"><div class="stat-number">{stats['active']}</div><p>Активных</p></div>
+                    <div class="stat-card"><div class="stat-number">{stats['inactive']}</div><p>Неактивных</p></div>
+                    <div class="stat-card"><div class="stat-number">{stats['emails_sent']}</div><p>Email отправлено</p></div>
+                    <div class="stat-card"><div class="stat-number">{stats['emails_failed']}</div><p>Email ошибок</p></div>
                 </div>
-                
+
+                <form method="get" class="filters">
+                    <input type="text" name="q" placeholder="email" value="{h(filters['q'])}">
+                    <select name="active">{_option('active', '', 'Все')}{_option('active', '1', 'Активные')}{_option('active', '0', 'Неактивные')}</select>
+                    <select name="lang">{_option('lang', '', 'Любой язык')}{_option('lang', 'ru', 'ru')}{_option('lang', 'uk', 'uk')}{_option('lang', 'en', 'en')}</select>
+                    <select name="frequency">{_option('frequency', '', 'Любая частота')}{_option('frequency', 'daily', 'daily')}{_option('frequency', 'weekly', 'weekly')}{_option('frequency', 'monthly', 'monthly')}</select>
+                    <input type="text" name="country" placeholder="страна (de)" size="8" value="{h(filters['country'])}">
+                    <input type="number" name="per_page" min="1" max="{ADMIN_PAGE_SIZE_MAX}" value="{per_page}" style="width:80px">
+                    <button type="submit">🔎 Показать</button>
+                    <a href="{url_for('admin_subscribers_secure')}">сбросить</a>
+                </form>
+
                 <h2>📋 Подписчики</h2>
                 <table>
                     <tr>
@@ -2875,62 +2740,101 @@ def admin_subscribers_secure():
                         <th>Профессии</th>
                         <th>Страны</th>
                         <th>Город</th>
+                        <th>Язык / частота</th>
                         <th>Дата регистрации</th>
                         <th>Действия</th>
-                    </tr>
-                    {subscribers_rows}
+                    </tr>"""
+
+        shown = 0
+        last = None
+        has_more = False
+        try:
+            for sub in _admin_subscribers_query(filters, after).limit(per_page + 1).yield_per(50):
+                if shown == per_page:
+                    has_more = True
+                    break
+                try:
+                    yield _admin_subscriber_row(sub)
+                except Exception as e:
+                    print(f"❌ Ошибка обработки подписчика {sub.id}: {e}")
+                    yield f'<tr><td colspan="9" class="error">Ошибка загрузки подписчика {sub.id}</td></tr>'
+                shown += 1
+                last = sub
+        except Exception as e:
+            print(f"❌ КРИТИЧЕСКАЯ ОШИБКА в admin_subscribers_secure: {e}")
+            yield f'<tr><td colspan="9" class="error">❌ Ошибка загрузки: {h(str(e))}</td></tr>'
+        if not shown:
+            yield '<tr><td colspan="9" style="text-align:center; color:#6c757d">нет подписчиков</td></tr>'
+
+        pager = []
+        if after:
+            pager.append(f'<a href="{url_for("admin_subscribers_secure", **{k: v for k, v in filters.items() if v}, per_page=per_page)}">⏮ В начало</a>')
+        if has_more and last is not None and last.created_at:
+            cursor = f"{last.created_at.isoformat()}_{last.id}"
+            pager.append(f'<a href="{url_for("admin_subscribers_secure", **{k: v for k, v in filters.items() if v}, per_page=per_page, after=cursor)}">Следующие ⏭</a>')
+        yield f"""
                 </table>
-                
+                <div class="pager">{''.join(pager)}</div>
+
                 <h2>📨 Последние email логи</h2>
                 <table>
                     <tr>
                         <th>Email</th>
                         <th>Статус</th>
                         <th>Дата</th>
-                    </tr>
-                    {email_logs_rows}
+                    </tr>"""
+
+        # Создаем строки email логов БЕЗОПАСНО
+        try:
+            email_logs = EmailLog.query.order_by(EmailLog.sent_at.desc()).limit(10).all()
+        except Exception as e:
+            print(f"❌ Ошибка загрузки email логов: {e}")
+            email_logs = []
+        for log in email_logs:
+            try:
+                status_icon = "✅" if log.status == 'sent' else "❌"
+                sent_time = log.sent_at.strftime('%Y-%m-%d %H:%M')
+                # email пишется в лог при отправке; для старых записей — ID подписчика
+                email = log.email or f"Удаленный подписчик (ID: {log.subscriber_id})"
+                yield f"""
+                    <tr>
+                        <td>{h(email)}</td>
+                        <td>{status_icon} {h(log.status)}</td>
+                        <td>{sent_time}</td>
+                    </tr>"""
+            except Exception as e:
+                print(f"❌ Ошибка обработки лога {log.id}: {e}")
+                yield """
+                    <tr>
+                        <td>Ошибка загрузки</td>
+                        <td>❌ Ошибка</td>
+                        <td>-</td>
+                    </tr>"""
+
+        yield """
                 </table>
             </div>
-            
+
             <script>
-            function validateEmail(email) {{
+            function validateEmail(email) {
             // Простой и надёжный паттерн
-            return /^[^\s@]+@[^\s@]+\.[^\s@]{{2,}}$/.test(email);
-            }}
-            function handleEditSubmit(form, currentEmail) {{
+            return /^[^\s@]+@[^\s@]+\.[^\s@]{2,}$/.test(email);
+            }
+            function handleEditSubmit(form, currentEmail) {
             const entered = prompt('Введите новый email', currentEmail);
             if (entered === null) return false; // отмена
             const email = (entered || '').trim().toLowerCase();
-            if (!validateEmail(email)) {{ alert('Некорректный email'); return false; }}
+            if (!validateEmail(email)) { alert('Некорректный email'); return false; }
             form.querySelector('input[name="email"]').value = email; // кладём в hidden
             return true; // обычный POST → Flask сделает redirect/flash
-            }}
+            }
             </script>
-
-
-
-
         </body>
         </html>"""
-        
-        return html
-        
-    except Exception as e:
-        print(f"❌ КРИТИЧЕСКАЯ ОШИБКА в admin_subscribers_secure: {e}")
-        import traceback
-        traceback.print_exc()
-        return f"""
-        <html lang="{{ request.cookies.get('lang','ru') }}"
-        <body style="font-family: Arial; padding: 40px;">
-            <h1 class="error">❌ Ошибка загрузки админки</h1>
-            <p>Ошибка: {str(e)}</p>
-            <a href="/admin/dashboard">🏠 Вернуться в админку</a>
-        </body>
-        </html>
-        """, 500
-    
 
-    
+    return Response(stream_with_context(generate()), mimetype='text/html; charset=utf-8')
+
+
 def _pretty_json(value):
     """Возвращает человекочитаемую строку из JSON/списка/словаря."""
     try:
@@ -3009,6 +2913,10 @@ def admin_delete_subscriber():
 
 
 
+PARTNER_PIE_DAYS = int(os.getenv('PARTNER_PIE_DAYS', '30'))
+DEMAND_TOP = int(os.getenv('DEMAND_TOP', '15'))
+
+
 @app.route('/admin/stats_secure')
 def admin_stats_secure():
     # доступ
@@ -3025,25 +2933,23 @@ def admin_stats_secure():
 
     # последние события (100) и счётчик по партнёрам для пирога
     try:
-        from analytics import recent_events, SearchClick, PartnerClick
-        from database import db
+        from analytics import recent_events, rollup_total, rollup_breakdown
         sc, pc = recent_events(limit=100)
         partner_clicks_count_last = len(pc)
 
-        # Итоги по БД (всё время)
-        total_search_clicks = db.session.query(func.count(SearchClick.id)).scalar() or 0
-        total_partner_clicks = db.session.query(func.count(PartnerClick.id)).scalar() or 0
+        # Итоги (всё время) — из предагрегатов, без count() по таблицам событий
+        total_search_clicks = rollup_total('search_total')
+        total_partner_clicks = rollup_total('partner_total')
 
         # Сейчас все исходящие клики идут на сайты-партнёры (логируются в PartnerClick),
         # поэтому итог по исходящим = итог по партнёрам
         total_out_clicks = total_partner_clicks
 
-        # распределение по партнёрам
-        from collections import Counter
-        partner_counter = Counter((p.partner or p.target_domain or 'unknown').strip() for p in pc)
+        # распределение по партнёрам за PARTNER_PIE_DAYS суток
+        partner_breakdown = rollup_breakdown('partner', days=PARTNER_PIE_DAYS)
         import json as _json
-        labels_json = _json.dumps(list(partner_counter.keys()), ensure_ascii=False)
-        values_json = _json.dumps([partner_counter[k] for k in partner_counter], ensure_ascii=False)
+        labels_json = _json.dumps([dim for dim, _ in partner_breakdown], ensure_ascii=False)
+        values_json = _json.dumps([n for _, n in partner_breakdown], ensure_ascii=False)
 
     except Exception as e:
         app.logger.exception("analytics.recent_events failed: %s", e)
@@ -3055,8 +2961,24 @@ def admin_stats_secure():
         labels_json = "[]"
         values_json = "[]"
 
+    # спрос активных подписчиков — GROUP BY по таблицам предпочтений
+    try:
+        demand_jobs = preference_demand('job', limit=DEMAND_TOP) if preferences_enabled() else []
+        demand_countries = preference_demand('country', limit=DEMAND_TOP) if preferences_enabled() else []
+    except Exception as e:
+        app.logger.exception("preference_demand failed: %s", e)
+        demand_jobs, demand_countries = [], []
+
     h = html_escape  # короткий алиас
 
+    def _demand_rows(items):
+        if not items:
+            return '<tr><td colspan="2" class="text-muted">нет данных</td></tr>'
+        return ''.join(f'<tr><td>{h(name)}</td><td class="text-end">{n}</td></tr>' for name, n in items)
+
+    demand_jobs_rows = _demand_rows(demand_jobs)
+    demand_countries_rows = _demand_rows(demand_countries)
+
     # === таблица «Найти работу» с разворотом ===
     def _details_city_query(c):
         v = getattr(c, "city_query", None)
@@ -3203,11 +3125,26 @@ def admin_stats_secure():
       <div class="p-3 chart-card">
         <div class="d-flex justify-content-between align-items-center mb-2">
           <h5 class="mb-0">Распределение переходов по партнёрам</h5>
-          <span class="text-muted">последние {partner_clicks_count_last}</span>
+          <span class="text-muted">за {PARTNER_PIE_DAYS} дн.</span>
         </div>
         <canvas id="partnersPie" height="220"></canvas>
       </div>
     </div>
+    <div class="col-12 col-lg-6">
+      <div class="p-3 chart-card">
+        <h5 class="mb-2">Спрос подписчиков (активные)</h5>
+        <div class="row">
+          <div class="col-7">
+            <table class="table table-sm mb-0"><thead><tr><th>Профессия</th><th class="text-end">Подп.</th></tr></thead>
+              <tbody>{demand_jobs_rows}</tbody></table>
+          </div>
+          <div class="col-5">
+            <table class="table table-sm mb-0"><thead><tr><th>Страна</th><th class="text-end">Подп.</th></tr></thead>
+              <tbody>{demand_countries_rows}</tbody></table>
+          </div>
+        </div>
+      </div>
+    </div>
   </div>
 
   <h4 class="mt-2 mb-2">🔎 Нажатия «Найти работу» (последние 100)</h4>
@@ -3340,8 +3277,13 @@ def email_scheduler(app, main_aggregator, additional_aggregators):
     # Передаем все агрегаторы в функцию, которую будет вызывать schedule
     job_func = lambda: run_scheduled_notifications(app, main_aggregator, additional_aggregators)
 
-    # Запускаем проверку каждый час
-    schedule.every().hour.do(job_func)
+    # Слоты подписчиков расставлены по минутам (digest_schedule) — проверяем
+    # чаще, чем раз в час; сколько брать за час, решает digest_schedule.hourly_capacity
+    schedule.every(int(os.getenv('DIGEST_SCHEDULER_MINUTES', '10'))).minutes.do(job_func)
+
+    # Секции аналитики на месяцы вперёд и архивация старых (ANALYTICS_RETENTION_MONTHS)
+    schedule.every().day.at(os.getenv('ANALYTICS_MAINTENANCE_AT', '03:30')).do(
+        lambda: run_analytics_maintenance(app))
     
     # Для тестирования - запуск каждые 5 минут. ЗАКОММЕНТИРОВАТЬ В ПРОДАКШЕНЕ!
     # schedule.every(5).minutes.do(job_func)
@@ -3350,111 +3292,45 @@ def email_scheduler(app, main_aggregator, additional_aggregators):
         schedule.run_pending()
         time.sleep(60)
 
-def send_daily_notifications():
-    """Ежедневная рассылка"""
+def _send_due_notifications(frequency, label):
+    """Рассылка подписчикам с данной частотой, у которых подошёл next_send_at"""
     try:
-        print("📧 Запуск ежедневной рассылки...")
+        print(f"📧 Запуск {label} рассылки...")
         with app.app_context():
-            subscribers = Subscriber.query.filter_by(is_active=True, frequency='daily').all()
-            print(f"👥 Найдено {len(subscribers)} подписчиков с ежедневной частотой")
-            
-            if not subscribers:
-                print("ℹ️ Нет подписчиков для ежедневной рассылки")
-                return
-            
+            total = 0
             sent_count = 0
-            for subscriber in subscribers:
-                try:
-                    # Проверяем, нужно ли отправлять (не отправляли сегодня)
-                    if subscriber.last_sent:
-                        last_sent_date = subscriber.last_sent.date()
-                        today = datetime.now().date()
-                        if last_sent_date >= today:
-                            print(f"⏭️ {subscriber.email}: уже отправлено сегодня")
-                            continue
-                    
-                    # Отправляем уведомления
-                    result = send_job_notifications_for_subscriber(app, aggregator, subscriber)
-                    if result:
-                        sent_count += 1
-                        
-                except Exception as e:
-                    print(f"❌ Ошибка отправки для {subscriber.email}: {e}")
-            
-            print(f"✅ Ежедневная рассылка завершена: {sent_count}/{len(subscribers)}")
-            
+            for batch in iter_due_subscribers(frequency=frequency):
+                total += len(batch)
+                with DigestLogBuffer() as log_buffer:
+                    for subscriber in batch:
+                        try:
+                            result = send_job_notifications_for_subscriber(app, aggregator, subscriber,
+                                                                           log_buffer=log_buffer)
+                            if result:
+                                sent_count += 1
+                        except Exception as e:
+                            print(f"❌ Ошибка отправки для {subscriber.email}: {e}")
+                db.session.expunge_all()
+
+            if not total:
+                print(f"ℹ️ Нет подписчиков для {label} рассылки")
+                return
+            print(f"✅ Рассылка ({frequency}) завершена: {sent_count}/{total}")
+
     except Exception as e:
-        print(f"❌ Ошибка ежедневной рассылки: {e}")
+        print(f"❌ Ошибка {label} рассылки: {e}")
+
+def send_daily_notifications():
+    """Ежедневная рассылка"""
+    _send_due_notifications('daily', 'ежедневной')
 
 def send_weekly_notifications():
     """Еженедельная рассылка"""
-    try:
-        print("📧 Запуск еженедельной рассылки...")
-        with app.app_context():
-            subscribers = Subscriber.query.filter_by(is_active=True, frequency='weekly').all()
-            print(f"👥 Найдено {len(subscribers)} подписчиков с еженедельной частотой")
-            
-            if not subscribers:
-                print("ℹ️ Нет подписчиков для еженедельной рассылки")
-                return
-            
-            sent_count = 0
-            for subscriber in subscribers:
-                try:
-                    # Проверяем, нужно ли отправлять (не отправляли на этой неделе)
-                    if subscriber.last_sent:
-                        days_since_last = (datetime.now() - subscriber.last_sent).days
-                        if days_since_last < 7:
-                            print(f"⏭️ {subscriber.email}: отправлено {days_since_last} дней назад")
-                            continue
-                    
-                    # Отправляем уведомления
-                    result = send_job_notifications_for_subscriber(app, aggregator, subscriber)
-                    if result:
-                        sent_count += 1
-                        
-                except Exception as e:
-                    print(f"❌ Ошибка отправки для {subscriber.email}: {e}")
-            
-            print(f"✅ Еженедельная рассылка завершена: {sent_count}/{len(subscribers)}")
-            
-    except Exception as e:
-        print(f"❌ Ошибка еженедельной рассылки: {e}")
+    _send_due_notifications('weekly', 'еженедельной')
 
 def send_monthly_notifications():
     """Ежемесячная рассылка"""
-    try:
-        print("📧 Запуск ежемесячной рассылки...")
-        with app.app_context():
-            subscribers = Subscriber.query.filter_by(is_active=True, frequency='monthly').all()
-            print(f"👥 Найдено {len(subscribers)} подписчиков с ежемесячной частотой")
-            
-            if not subscribers:
-                print("ℹ️ Нет подписчиков для ежемесячной рассылки")
-                return
-            
-            sent_count = 0
-            for subscriber in subscribers:
-                try:
-                    # Проверяем, нужно ли отправлять (не отправляли в этом месяце)
-                    if subscriber.last_sent:
-                        days_since_last = (datetime.now() - subscriber.last_sent).days
-                        if days_since_last < 30:
-                            print(f"⏭️ {subscriber.email}: отправлено {days_since_last} дней назад")
-                            continue
-                    
-                    # Отправляем уведомления
-                    result = send_job_notifications_for_subscriber(app, aggregator, subscriber)
-                    if result:
-                        sent_count += 1
-                        
-                except Exception as e:
-                    print(f"❌ Ошибка отправки для {subscriber.email}: {e}")
-            
-            print(f"✅ Ежемесячная рассылка завершена: {sent_count}/{len(subscribers)}")
-            
-    except Exception as e:
-        print(f"❌ Ошибка ежемесячной рассылки: {e}")
+    _send_due_notifications('monthly', 'ежемесячной')
 
 def send_test_notifications():
     """Тестовая рассылка (для отладки)"""
@@ -3468,8 +3344,11 @@ def send_test_notifications():
         else:
             print("ℹ️ Нет активных подписчиков для тестирования")
 
-def send_job_notifications_for_subscriber(app, aggregator, subscriber):
-    """Отправка уведомлений конкретному подписчику"""
+def send_job_notifications_for_subscriber(app, aggregator, subscriber, log_buffer=None):
+    """
+    Отправка уведомлений конкретному подписчику.
+    С log_buffer (DigestLogBuffer) лог и last_sent пишутся пачкой, без коммита на каждое письмо.
+    """
     try:
         preferences = {
             'is_refugee': subscriber.is_refugee,
@@ -3482,8 +3361,8 @@ def send_job_notifications_for_subscriber(app, aggregator, subscriber):
             print(f"⚠️ У {subscriber.email} нет профессий или стран")
             return False
         
-        # Ищем вакансии
-        jobs = aggregator.search_specific_jobs(preferences)
+        # Ищем вакансии и оставляем только те, что подписчику ещё не отправляли
+        jobs = digest_seen.filter_unseen(redis_client, subscriber.id, aggregator.search_specific_jobs(preferences))
         
         if len(jobs) > 0:
             print(f"🎯 Найдено {len(jobs)} вакансий для {subscriber.email}")
@@ -3493,8 +3372,15 @@ def send_job_notifications_for_subscriber(app, aggregator, subscriber):
             success = send_job_email(app, subscriber, jobs[:20], preferences)  # Максимум 20 вакансий
             
             if success:
-                # Обновляем время последней отправки
-                subscriber.last_sent = datetime.now()
+                digest_seen.mark_seen(redis_client, subscriber.id, jobs[:20])
+                if log_buffer is not None:
+                    log_buffer.add(subscriber, f"Найдено {len(jobs)} новых вакансий", len(jobs))
+                    print(f"✅ Email отправлен на {subscriber.email}")
+                    return True
+
+                # Обновляем время последней отправки (UTC — от него считается next_send_at)
+                sent_at = datetime.utcnow()
+                subscriber.last_sent = sent_at
                 
                 # Логируем отправку
                 log = EmailLog(
@@ -3502,7 +3388,7 @@ def send_job_notifications_for_subscriber(app, aggregator, subscriber):
                     subject=f"Найдено {len(jobs)} новых вакансий",
                     jobs_count=len(jobs),
                     status='sent',
-                    sent_at=datetime.now()
+                    sent_at=sent_at
                 )
                 db.session.add(log)
                 db.session.commit()
@@ -3562,66 +3448,17 @@ if os.getenv('RAILWAY_ENVIRONMENT') or os.getenv('DATABASE_URL'):
 
 @app.route('/admin/download_backup')
 def download_backup():
-    """Скачать бекап базы данных в JSON"""
+    """Скачать бекап базы данных: NDJSON (по умолчанию) или ?format=json — оба потоком"""
     if not session.get('admin_logged_in'):
         return redirect(url_for('admin_login_page'))
-    
-    try:
-        # Собираем всех подписчиков
-        subscribers = Subscriber.query.all()
-        subscribers_data = []
-        
-        for sub in subscribers:
-            subscribers_data.append({
-                'email': sub.email,
-                'is_active': sub.is_active,
-                'created_at': sub.created_at.isoformat() if sub.created_at else None,
-                'is_refugee': sub.is_refugee,
-                'selected_jobs': sub.get_selected_jobs(),
-                'countries': sub.get_countries(),
-                'city': sub.city,
-                'frequency': sub.frequency,
-                'last_sent': sub.last_sent.isoformat() if sub.last_sent else None
-            })
-        
-        # Собираем email логи
-        email_logs = EmailLog.query.order_by(EmailLog.sent_at.desc()).limit(1000).all()
-        logs_data = []
-        
-        for log in email_logs:
-            logs_data.append({
-                'email': log.email,
-                'subject': log.subject,
-                'jobs_count': log.jobs_count,
-                'status': log.status,
-                'sent_at': log.sent_at.isoformat() if log.sent_at else None,
-                'error_message': log.error_message
-            })
-        
-        # Формируем JSON
-        backup_data = {
-            'backup_date': datetime.now().isoformat(),
-            'subscribers': subscribers_data,
-            'email_logs': logs_data,
-            'stats': {
-                'total_subscribers': len(subscribers_data),
-                'active_subscribers': len([s for s in subscribers_data if s['is_active']]),
-                'total_logs': len(logs_data)
-            }
-        }
-        
-        # Возвращаем файл для скачивания
-        filename = f"globaljobhunter_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        
-        from flask import Response
-        return Response(
-            json.dumps(backup_data, indent=2, ensure_ascii=False),
-            mimetype='application/json',
-            headers={'Content-Disposition': f'attachment; filename={filename}'}
-        )
-        
-    except Exception as e:
-        return f"❌ Ошибка создания бекапа: {str(e)}", 500
+
+    fmt = 'json' if request.args.get('format') == 'json' else 'ndjson'
+    filename = f"globaljobhunter_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    return Response(
+        stream_with_context(iter_backup(fmt)),
+        mimetype='application/json' if fmt == 'json' else 'application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
 
 @app.route('/admin/upload_backup', methods=['GET', 'POST'])
 def upload_backup():
@@ -3659,7 +3496,7 @@ def upload_backup():
                 
                 <form method="post" enctype="multipart/form-data">
                     <label><strong>Выберите JSON файл бекапа:</strong></label>
-                    <input type="file" name="backup_file" accept=".json" required>
+                    <input type="file" name="backup_file" accept=".json,.ndjson,.jsonl" required>
                     
                     <div style="margin: 20px 0;">
                         <label>
@@ -3683,70 +3520,14 @@ def upload_backup():
                 return "❌ Файл не выбран", 400
             
             file = request.files['backup_file']
-            if file.filename == '' or not file.filename.endswith('.json'):
-                return "❌ Выберите JSON файл", 400
-            
-            # Читаем и парсим JSON
-            backup_data = json.loads(file.read().decode('utf-8'))
-            
-            # Очищаем существующие данные
-            db.session.query(EmailLog).delete()
-            db.session.query(Subscriber).delete()
-            
-            # Восстанавливаем подписчиков
-            restored_subscribers = 0
-            for sub_data in backup_data.get('subscribers', []):
-                try:
-                    subscriber = Subscriber(
-                        email=sub_data['email'],
-                        is_active=sub_data.get('is_active', True),
-                        is_refugee=sub_data.get('is_refugee', True),
-                        city=sub_data.get('city'),
-                        frequency=sub_data.get('frequency', 'weekly')
-                    )
-                    
-                    if sub_data.get('created_at'):
-                        subscriber.created_at = datetime.fromisoformat(sub_data['created_at'])
-                    
-                    if sub_data.get('last_sent'):
-                        subscriber.last_sent = datetime.fromisoformat(sub_data['last_sent'])
-                    
-                    if sub_data.get('selected_jobs'):
-                        subscriber.set_selected_jobs(sub_data['selected_jobs'])
-                    
-                    if sub_data.get('countries'):
-                        subscriber.set_countries(sub_data['countries'])
-                    
-                    db.session.add(subscriber)
-                    restored_subscribers += 1
-                    
-                except Exception as e:
-                    print(f"⚠️ Ошибка восстановления подписчика: {e}")
-            
-            # Восстанавливаем email логи
-            restored_logs = 0
-            for log_data in backup_data.get('email_logs', []):
-                try:
-                    email_log = EmailLog(
-                        email=log_data.get('email'),
-                        subject=log_data.get('subject'),
-                        jobs_count=log_data.get('jobs_count', 0),
-                        status=log_data.get('status', 'unknown'),
-                        error_message=log_data.get('error_message')
-                    )
-                    
-                    if log_data.get('sent_at'):
-                        email_log.sent_at = datetime.fromisoformat(log_data['sent_at'])
-                    
-                    db.session.add(email_log)
-                    restored_logs += 1
-                    
-                except Exception as e:
-                    print(f"⚠️ Ошибка восстановления лога: {e}")
-            
-            # Сохраняем изменения
-            db.session.commit()
+            if file.filename == '' or not file.filename.endswith(('.json', '.ndjson', '.jsonl')):
+                return "❌ Выберите JSON/NDJSON файл", 400
             
+            # Разбираем файл потоком и вставляем пачками в одной транзакции
+            restored = restore_backup(file.stream)
+            restored_subscribers = restored['subscribers']
+            restored_logs = restored['email_logs']
+
             return f"""
             <html lang="{{ request.cookies.get('lang','ru') }}"
             <head><title>Восстановление завершено</title><meta charset="utf-8"></head>
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Потоковый бекап и восстановление подписчиков и email-логов.
+
+Раньше /admin/download_backup собирал всех подписчиков в список и отдавал
+json.dumps(indent=2), а восстановление читало файл целиком и добавляло
+строки по одной через session.add. Теперь:
+  • экспорт — NDJSON (по записи на строку: meta, subscriber…, email_log…,
+    stats) или прежний JSON-формат, но оба потоком: строки читаются из БД
+    пачками (yield_per) без ORM-объектов и сразу уходят клиенту;
+  • восстановление разбирает файл инкрементально (json raw_decode по
+    буферу) — понимает и NDJSON, и старые JSON-бекапы — и вставляет
+    пачками по BACKUP_CHUNK через bulk INSERT в одной транзакции:
+    ошибка — откат, прежние данные остаются на месте.
+"""
+
+import io
+import json
+import os
+from datetime import datetime
+from typing import Dict, Iterator, Optional, Tuple
+
+from sqlalchemy import delete, insert, select, text
+
+from database import (db, Subscriber, EmailLog, SubscriberJob, SubscriberCountry, compute_next_send_at,
+                      preferences_enabled, rebuild_subscriber_preferences)
+
+BACKUP_BATCH = int(os.getenv('BACKUP_BATCH', '1000'))
+BACKUP_CHUNK = int(os.getenv('BACKUP_CHUNK', '1000'))
+# сколько последних email-логов класть в бекап (0 — все)
+BACKUP_EMAIL_LOGS = int(os.getenv('BACKUP_EMAIL_LOGS', '1000'))
+
+_READ_SIZE = 64 * 1024
+_decoder = json.JSONDecoder()
+
+
+# --- ЭКСПОРТ -----------------------------------------------------------------
+
+def _iso(value) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _json_list(value):
+    try:
+        return json.loads(value) if value else []
+    except (TypeError, ValueError):
+        return []
+
+
+def _iter_subscribers() -> Iterator[Dict]:
+    table = Subscriber.__table__
+    stmt = select(table).order_by(table.c.id).execution_options(yield_per=BACKUP_BATCH)
+    for row in db.session.execute(stmt).mappings():
+        yield {
+            'id': row['id'],
+            'email': row['email'],
+            'is_active': row['is_active'],
+            'created_at': _iso(row['created_at']),
+            'lang': row['lang'],
+            'is_refugee': row['is_refugee'],
+            'selected_jobs': _json_list(row['selected_jobs']),
+            'countries': _json_list(row['countries']),
+            'city': row['city'],
+            'frequency': row['frequency'],
+            'last_sent': _iso(row['last_sent']),
+        }
+
+
+def _iter_email_logs() -> Iterator[Dict]:
+    table = EmailLog.__table__
+    stmt = select(table).order_by(table.c.sent_at.desc())
+    if BACKUP_EMAIL_LOGS > 0:
+        stmt = stmt.limit(BACKUP_EMAIL_LOGS)
+    for row in db.session.execute(stmt.execution_options(yield_per=BACKUP_BATCH)).mappings():
+        yield {
+            'subscriber_id': row['subscriber_id'],
+            'email': row['email'],
+            'subject': row['subject'],
+            'jobs_count': row['jobs_count'],
+            'status': row['status'],
+            'sent_at': _iso(row['sent_at']),
+            'error_message': row['error_message'],
+        }
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def iter_backup(fmt: str = 'ndjson') -> Iterator[str]:
+    """Бекап кусками текста: 'ndjson' — по записи на строку, 'json' — прежняя структура"""
+    stats = {'total_subscribers': 0, 'active_subscribers': 0, 'total_logs': 0}
+    backup_date = datetime.now().isoformat()
+
+    if fmt == 'json':
+        yield f'{{"backup_date": {_dumps(backup_date)},\n"subscribers": ['
+    else:
+        yield _dumps({'type': 'meta', 'format': 'globaljobhunter-backup', 'version': 2,
+                      'backup_date': backup_date}) + '\n'
+
+    sep = '\n'
+    for sub in _iter_subscribers():
+        stats['total_subscribers'] += 1
+        stats['active_subscribers'] += 1 if sub['is_active'] else 0
+        if fmt == 'json':
+            yield sep + _dumps(sub)
+            sep = ',\n'
+        else:
+            yield _dumps(dict(type='subscriber', **sub)) + '\n'
+
+    if fmt == 'json':
+        yield '\n],\n"email_logs": ['
+    sep = '\n'
+    for log in _iter_email_logs():
+        stats['total_logs'] += 1
+        if fmt == 'json':
+            yield sep + _dumps(log)
+            sep = ',\n'
+        else:
+            yield _dumps(dict(type='email_log', **log)) + '\n'
+
+    if fmt == 'json':
+        yield f'\n],\n"stats": {_dumps(stats)}}}\n'
+    else:
+        yield _dumps(dict(type='stats', **stats)) + '\n'
+
+
+# --- ИНКРЕМЕНТАЛЬНЫЙ РАЗБОР -------------------------------------------------
+
+class _JsonReader:
+    """Последовательное чтение JSON-значений из текстового потока без загрузки файла в память"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.stream.read(_READ_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        if self.pos > _READ_SIZE:
+            self.buf, self.pos = self.buf[self.pos:], 0
+        self.buf += chunk
+        return True
+
+    def peek(self) -> str:
+        """Следующий значимый символ ('' в конце файла)"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, ch: str):
+        if self.peek() != ch:
+            raise ValueError(f"ожидался '{ch}' в позиции {self.pos}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # число могло оборваться на границе буфера — дочитываем
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return obj
+
+    def array(self) -> Iterator:
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect(']')
+            return
+
+
+def iter_backup_records(stream) -> Iterator[Tuple[str, Dict]]:
+    """
+    (тип, запись) из бекапа: NDJSON (первая запись начинается с ключа "type")
+    или старый JSON-объект {"subscribers": [...], "email_logs": [...], ...}
+    """
+    reader = _JsonReader(stream)
+    reader.expect('{')
+    first_key = reader.value() if reader.peek() == '"' else None
+
+    if first_key == 'type':
+        # NDJSON: дочитываем первую запись, дальше — значение за значением
+        reader.expect(':')
+        first = {'type': reader.value()}
+        while reader.peek() == ',':
+            reader.pos += 1
+            key = reader.value()
+            reader.expect(':')
+            first[key] = reader.value()
+        reader.expect('}')
+        record = first
+        while record is not None:
+            if isinstance(record, dict) and record.get('type') in ('subscriber', 'email_log'):
+                yield record.pop('type'), record
+            record = reader.value() if reader.peek() else None
+        return
+
+    key = first_key
+    while key is not None:
+        reader.expect(':')
+        if key in ('subscribers', 'email_logs') and reader.peek() == '[':
+            kind = 'subscriber' if key == 'subscribers' else 'email_log'
+            for item in reader.array():
+                if isinstance(item, dict):
+                    yield kind, item
+        else:
+            reader.value()
+        if reader.peek() != ',':
+            break
+        reader.pos += 1
+        key = reader.value()
+    reader.expect('}')
+
+
+# --- ВОССТАНОВЛЕНИЕ ----------------------------------------------------------
+
+def _dt(value) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def _subscriber_row(data: Dict) -> Dict:
+    email = (data.get('email') or '').strip()
+    if not email:
+        raise ValueError('нет email')
+    jobs = data.get('selected_jobs')
+    countries = data.get('countries')
+    last_sent = _dt(data.get('last_sent'))
+    frequency = data.get('frequency') or 'weekly'
+    is_active = bool(data.get('is_active', True))
+    row = {
+        'email': email,
+        'is_active': is_active,
+        'created_at': _dt(data.get('created_at')) or datetime.utcnow(),
+        'lang': (data.get('lang') or 'ru')[:5],
+        'is_refugee': bool(data.get('is_refugee', True)),
+        'selected_jobs': json.dumps(jobs) if jobs else None,
+        'countries': json.dumps(countries) if countries else None,
+        'city': data.get('city'),
+        'frequency': frequency,
+        'last_sent': last_sent,
+        # bulk INSERT не вызывает события маппера
+        'next_send_at': compute_next_send_at(frequency, last_sent, email) if is_active else None,
+    }
+    if isinstance(data.get('id'), int):
+        row['id'] = data['id']
+    return row
+
+
+def _email_log_row(data: Dict) -> Dict:
+    return {
+        'subscriber_id': data.get('subscriber_id') if isinstance(data.get('subscriber_id'), int) else None,
+        'email': data.get('email'),
+        'subject': data.get('subject'),
+        'jobs_count': data.get('jobs_count') or 0,
+        'status': data.get('status') or 'unknown',
+        'sent_at': _dt(data.get('sent_at')) or datetime.utcnow(),
+        'error_message': data.get('error_message'),
+    }
+
+
+def _reset_id_sequence(table):
+    """После вставки с явными id двигаем sequence в Postgres (SQLite справляется сам)"""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    db.session.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+        f"COALESCE((SELECT MAX(id) FROM {table.name}), 1))"
+    ))
+
+
+def restore_backup(binary_stream, chunk_size: int = BACKUP_CHUNK) -> Dict[str, int]:
+    """
+    Заменить подписчиков и логи содержимым бекапа. Всё в одной транзакции:
+    при ошибке (битый файл, дубликат email) — rollback и исключение наружу.
+    """
+    stream = io.TextIOWrapper(binary_stream, encoding='utf-8-sig')
+    chunk_size = max(1, chunk_size)
+    stats = {'subscribers': 0, 'email_logs': 0, 'skipped': 0}
+    pending = {'subscriber': [], 'email_log': []}
+    models = {'subscriber': Subscriber, 'email_log': EmailLog}
+    converters = {'subscriber': _subscriber_row, 'email_log': _email_log_row}
+    explicit_ids = False
+    known_ids = set()
+
+    def flush(kind):
+        rows = pending[kind]
+        if not rows:
+            return
+        if kind == 'email_log':
+            # ссылки на подписчиков, которых нет в бекапе, не сохраняем
+            for row in rows:
+                if row['subscriber_id'] not in known_ids:
+                    row['subscriber_id'] = None
+        db.session.execute(insert(models[kind]), rows)
+        stats['subscribers' if kind == 'subscriber' else 'email_logs'] += len(rows)
+        pending[kind] = []
+
+    try:
+        db.session.execute(delete(EmailLog))
+        if preferences_enabled():
+            db.session.execute(delete(SubscriberJob))
+            db.session.execute(delete(SubscriberCountry))
+        db.session.execute(delete(Subscriber))
+
+        for kind, data in iter_backup_records(stream):
+            try:
+                row = converters[kind](data)
+            except Exception as e:
+                stats['skipped'] += 1
+                print(f"⚠️ Бекап: пропущена запись {kind}: {e}")
+                continue
+            if kind == 'subscriber':
+                # вставки с id и без id в одной таблице не смешиваем — иначе конфликт ключей
+                if 'id' in row and (explicit_ids or not stats['subscribers'] and not pending['subscriber']):
+                    explicit_ids = True
+                    known_ids.add(row['id'])
+                else:
+                    row.pop('id', None)
+            else:
+                flush('subscriber')   # логи идут после подписчиков
+            pending[kind].append(row)
+            if len(pending[kind]) >= chunk_size:
+                flush(kind)
+
+        flush('subscriber')
+        flush('email_log')
+        if explicit_ids:
+            _reset_id_sequence(Subscriber.__table__)
+        if preferences_enabled():
+            # bulk INSERT не вызывает события маппера — таблицы предпочтений строим здесь же
+            rebuild_subscriber_preferences(db.session.connection(), chunk=chunk_size)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    print(f"✅ Бекап восстановлен: подписчиков {stats['subscribers']}, "
+          f"логов {stats['email_logs']}, пропущено {stats['skipped']}")
+    return stats
@@ -4,12 +4,20 @@
 """
 
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
-from typing import List, Dict, Optional
+import sys
+from dataclasses import dataclass, fields
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime
 
-@dataclass
+from job_classifier import classify_job
+
+@dataclass(slots=True)
 class JobVacancy:
+    """
+    Единая запись вакансии для всех источников.
+    slots — без __dict__ на экземпляр; низкокардинальные строки интернируются,
+    так что тысячи вакансий делят одни и те же объекты 'adzuna', 'Германия' и т.п.
+    """
     id: str
     title: str
     company: str
@@ -24,6 +32,25 @@ class JobVacancy:
     language_requirement: str = "unknown"
     refugee_friendly: bool = False
 
+    def __post_init__(self):
+        for name in _INTERNED_FIELDS:
+            value = getattr(self, name)
+            if type(value) is str:
+                setattr(self, name, sys.intern(value))
+
+    def to_dict(self) -> Dict:
+        """Плоский dict без глубокого копирования (в отличие от dataclasses.asdict)"""
+        return {name: getattr(self, name) for name in _FIELD_NAMES}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'JobVacancy':
+        """Обратное преобразование; лишние ключи снапшота (rank_score и т.п.) игнорируются"""
+        return cls(**{name: data[name] for name in _FIELD_NAMES if name in data})
+
+
+_FIELD_NAMES = tuple(f.name for f in fields(JobVacancy))
+_INTERNED_FIELDS = ('source', 'country', 'job_type', 'language_requirement')
+
 class BaseJobAggregator(ABC):
     """Базовый класс для всех агрегаторов вакансий"""
     
@@ -59,27 +86,14 @@ class BaseJobAggregator(ABC):
         
         return None
     
+    def classify_job(self, title: str, description: str, search_term: str = '') -> Tuple[str, bool]:
+        """(language_requirement, refugee_friendly) за один проход по тексту"""
+        return classify_job(title, description, search_term)
+
     def determine_language_requirement(self, title: str, description: str) -> str:
         """Определение языковых требований"""
-        text = f"{title} {description}".lower()
-        
-        no_language_indicators = [
-            'no language', 'без языка', 'physical work', 'manual work',
-            'driver', 'delivery', 'warehouse', 'cleaning', 'kitchen'
-        ]
-        
-        if any(indicator in text for indicator in no_language_indicators):
-            return "no_language_required"
-        
-        return "unknown"
+        return classify_job(title, description)[0]
     
     def is_refugee_friendly(self, title: str, description: str, search_term: str) -> bool:
         """Определение дружелюбности к беженцам"""
-        text = f"{title} {description} {search_term}".lower()
-        
-        refugee_indicators = [
-            'refugee', 'ukrainian', 'ukraine', 'asylum', 'integration',
-            'newcomer', 'immigrant', 'migration'
-        ]
-        
-        return any(indicator in text for indicator in refugee_indicators)
\ No newline at end of file
+        return classify_job(title, description, search_term)[1]
\ No newline at end of file
@@ -10,10 +10,10 @@ try:
     from urllib3.util.retry import Retry
 except Exception:
     Retry = None
+import threading
 import time
 from datetime import datetime
-from typing import List, Dict, Optional
-from dataclasses import asdict
+from typing import List, Dict, Optional, Tuple
 import hashlib
 from dotenv import load_dotenv
 import certifi
@@ -23,6 +23,8 @@ DEFAULT_CJ_REFERER = os.getenv("CAREERJET_REFERER", "https://globaljobhunter.vip
 
 # --- Переиспользуемые компоненты из adzuna_aggregator ---
 from adzuna_aggregator import JobVacancy, CacheManager, RateLimiter, GlobalJobAggregator
+from job_text import ingest_description
+from job_index import query_slice, store_slice
 
 # --- Базовый класс для соблюдения архитектуры ---
 from base_aggregator import BaseJobAggregator
@@ -63,6 +65,8 @@ class CareerjetAggregator(BaseJobAggregator):
         self.cache_manager = CacheManager(cache_duration_hours=cache_duration_hours)
         self.rate_limiter = RateLimiter(requests_per_minute=25)
         self.cooldown_until = 0  # глобальный кулдаун при 429
+        # итог последнего _request_page в этом потоке: ошибка (или None) и сколько пришло сырых вакансий
+        self._request_state = threading.local()
 
         # Страны и названия
         self.country_map = {
@@ -200,13 +204,6 @@ class CareerjetAggregator(BaseJobAggregator):
         if not selected_jobs or not countries:
             return []
 
-        # лимит страниц на один term
-        try:
-            max_pages = int(os.getenv("CAREERJET_MAX_PAGES_PER_TERM", "5"))
-        except Exception:
-            max_pages = 15
-        max_pages = min(max_pages, 10)
-        
         # основной цикл
         for ru_title in selected_jobs:
             if cancel_check and cancel_check():
@@ -238,6 +235,19 @@ class CareerjetAggregator(BaseJobAggregator):
                         if cancel_check and cancel_check():
                             break
 
+                        # 0) Локальный индекс: свежий срез отвечаем без API
+                        index_loc = loc if cities else ''
+                        indexed = query_slice('careerjet', cc, index_loc, term)
+                        if indexed is not None:
+                            print(f"    🗂 Index HIT Careerjet [{cc}/{loc}] term='{term}': {len(indexed)}")
+                            if indexed and progress_callback:
+                                try:
+                                    progress_callback(indexed)
+                                except Exception:
+                                    pass
+                            all_jobs.extend(indexed)
+                            continue
+
                         # 1) Попытка из субкеша (пустые мы там не храним)
                         cached = self.cache_manager.get_term_cached_result(cc, loc, term)
                         if cached is not None:
@@ -251,63 +261,12 @@ class CareerjetAggregator(BaseJobAggregator):
                             continue
 
                         print(f"    🔍 Careerjet [{cc}/{loc}] term {idx}/{len(en_terms)}: '{term}'")
-                        page = 1
-                        collected_for_term: List[JobVacancy] = []
-                        seen_urls_for_term: set[str] = set()
-
-                        while True:
-                            if cancel_check and cancel_check():
-                                break
-
-                            batch = self._request_page(
-                                term=term,
-                                location=loc,
-                                country_name=country_name,
-                                locale_code=locale_code,
-                                page=page,
-                                user_ip=user_ip,
-                                user_agent=user_agent,
-                                page_url=page_url
-                            )
-
-
-                            # None → 429/cooldown — прекращаем по этому term
-                            if batch is None:
-                                break
-
-                            # пустая страница — конец пагинации
-                            if not batch:
-                                if page == 1:
-                                    print(f"    📄 Careerjet: {loc} term='{term}' page 1: +0")
-                                break
-
-                            # фильтрация дубликатов в рамках term
-                            new_batch: List[JobVacancy] = []
-                            for j in batch:
-                                url_or_id = getattr(j, "apply_url", None) or getattr(j, "id", None)
-                                if not url_or_id or url_or_id in seen_urls_for_term:
-                                    continue
-                                seen_urls_for_term.add(url_or_id)
-                                new_batch.append(j)
-
-                            if not new_batch:
-                                print(f"🔁 Careerjet: {loc} term='{term}' page {page}: только дубликаты — стоп.")
-                                break
-
-                            # прогресс наружу
-                            if progress_callback:
-                                try:
-                                    progress_callback(new_batch)
-                                except Exception:
-                                    pass
-
-                            collected_for_term.extend(new_batch)
-                            all_jobs.extend(new_batch)
-
-                            page += 1
-                            if page > max_pages:
-                                print(f"⏹ Careerjet: достигнут лимит страниц {max_pages} для term='{term}' [{loc}]")
-                                break
+                        collected_for_term, error = self.fetch_term_pages(
+                            term, loc, country_name, locale_code,
+                            user_ip=user_ip, user_agent=user_agent, page_url=page_url,
+                            cancel_check=cancel_check, progress_callback=progress_callback,
+                        )
+                        all_jobs.extend(collected_for_term)
 
                         # 2) кешируем ТОЛЬКО если что-то нашли
                         if collected_for_term:
@@ -315,6 +274,9 @@ class CareerjetAggregator(BaseJobAggregator):
                                 self.cache_manager.cache_term_result(cc, loc, term, collected_for_term)
                             except Exception:
                                 pass
+                            if not error:
+                                # оборванная (сбой/cooldown/отмена) выдача — не свежий срез
+                                store_slice('careerjet', cc, index_loc, term, collected_for_term)
 
         return self._deduplicate_jobs(all_jobs)
 
@@ -322,19 +284,108 @@ class CareerjetAggregator(BaseJobAggregator):
 
 
     
+    @staticmethod
+    def max_pages_per_term() -> int:
+        try:
+            max_pages = int(os.getenv("CAREERJET_MAX_PAGES_PER_TERM", "5"))
+        except Exception:
+            max_pages = 15
+        return min(max_pages, 10)
+
+    def last_request_error(self) -> Optional[str]:
+        """Почему последний _request_page этого потока вернул [] (None — выдача действительно пустая)"""
+        return getattr(self._request_state, 'error', None)
+
+    def fetch_term_pages(self, term: str, loc: str, country_name: str, locale_code: str, *,
+                         user_ip: str, user_agent: str, page_url: str,
+                         cancel_check=None, progress_callback=None) -> Tuple[List[JobVacancy], Optional[str]]:
+        """
+        Все страницы одного терма (до CAREERJET_MAX_PAGES_PER_TERM) — и для
+        обычного поиска, и для ingest, чтобы срез индекса был одной глубины.
+        Возвращает (вакансии, ошибка): ошибка — если выдача оборвалась на
+        429/cooldown, сбое запроса или отмене; такой результат срезом не сохраняем.
+        """
+        max_pages = self.max_pages_per_term()
+        page_size = int(os.getenv("CJ_PAGE_SIZE", "50"))
+        collected: List[JobVacancy] = []
+        seen_urls: set[str] = set()
+        page = 1
+        while True:
+            if cancel_check and cancel_check():
+                return collected, 'cancelled'
+
+            batch = self._request_page(
+                term=term,
+                location=loc,
+                country_name=country_name,
+                locale_code=locale_code,
+                page=page,
+                user_ip=user_ip,
+                user_agent=user_agent,
+                page_url=page_url
+            )
+
+            # None → 429/cooldown — прекращаем по этому term
+            if batch is None:
+                return collected, 'CAREERJET_COOLDOWN'
+
+            # пустая страница — конец пагинации (или сбой запроса)
+            if not batch:
+                error = self.last_request_error()
+                if error:
+                    return collected, error
+                if page == 1:
+                    print(f"    📄 Careerjet: {loc} term='{term}' page 1: +0")
+                return collected, None
+
+            # фильтрация дубликатов в рамках term
+            new_batch: List[JobVacancy] = []
+            for j in batch:
+                url_or_id = getattr(j, "apply_url", None) or getattr(j, "id", None)
+                if not url_or_id or url_or_id in seen_urls:
+                    continue
+                seen_urls.add(url_or_id)
+                new_batch.append(j)
+
+            if not new_batch:
+                print(f"🔁 Careerjet: {loc} term='{term}' page {page}: только дубликаты — стоп.")
+                return collected, None
+
+            # прогресс наружу
+            if progress_callback:
+                try:
+                    progress_callback(new_batch)
+                except Exception:
+                    pass
+            collected.extend(new_batch)
+
+            # неполная страница — дальше пусто, лишний запрос не нужен
+            if getattr(self._request_state, 'raw_count', 0) < page_size:
+                return collected, None
+            page += 1
+            if page > max_pages:
+                print(f"⏹ Careerjet: достигнут лимит страниц {max_pages} для term='{term}' [{loc}]")
+                return collected, None
+
+    def _page_failed(self, reason: str) -> List[JobVacancy]:
+        self._request_state.error = reason
+        return []
+
     def _request_page(self, term: str, location: str, country_name: str, locale_code: str, page: int,
                   *, user_ip: str, user_agent: str, page_url: str) -> Optional[List[JobVacancy]]:
         """
         Один запрос к Careerjet.
         Возвращает:
             - list[JobVacancy] — если страница содержит вакансии,
-            - [] — если вакансий нет/страниц больше нет,
+            - [] — если вакансий нет/страниц больше нет (или сбой — см. last_request_error),
             - None — если получен 429 и включён cooldown.
         """
+        self._request_state.error = None
+        self._request_state.raw_count = 0
         # глобальный кулдаун после 429
         now = time.time()
         if getattr(self, "cooldown_until", 0) > now:
-            return []
+            return self._page_failed('CAREERJET_COOLDOWN')
 
         params = {
             'locale_code': locale_code,
@@ -389,7 +440,7 @@ class CareerjetAggregator(BaseJobAggregator):
                         # if os.getenv("CJ_USE_OLD_HTTP") == "1":
                         #     return self._fallback_old_api(term, location, locale_code, page, user_ip, user_agent, page_url)
                         print(f"❌ Careerjet: SSL error page={page} [{location}] term='{term}': {e2}")
-                        return []
+                        return self._page_failed(f"SSL: {e2}")
 
             # 429 → кулдаун и повторить позже
             if r.status_code == 429:
@@ -403,7 +454,7 @@ class CareerjetAggregator(BaseJobAggregator):
                 # фолбэк на старый HTTP отключён
                 # if os.getenv("CJ_USE_OLD_HTTP") == "1":
                 #     return self._fallback_old_api(term, location, locale_code, page, user_ip, user_agent, page_url)
-                return []
+                return self._page_failed(f"HTTP {r.status_code}")
 
             data = r.json() or {}
 
@@ -420,12 +471,12 @@ class CareerjetAggregator(BaseJobAggregator):
                     # фолбэк на старый HTTP отключён
                     # if os.getenv("CJ_USE_OLD_HTTP") == "1":
                     #     return self._fallback_old_api(term, locs[0], locale_code, page, user_ip, user_agent, page_url)
-                    return []
+                    return self._page_failed("SSL")
                 if r.status_code != 200:
                     # фолбэк на старый HTTP отключён
                     # if os.getenv("CJ_USE_OLD_HTTP") == "1":
                     #     return self._fallback_old_api(term, locs[0], locale_code, page, user_ip, user_agent, page_url)
-                    return []
+                    return self._page_failed(f"HTTP {r.status_code}")
                 data = r.json() or {}
 
             # ←← ВАЖНО: вот здесь и только здесь делаем финальную проверку типа
@@ -433,9 +484,10 @@ class CareerjetAggregator(BaseJobAggregator):
                 # фолбэк на старый HTTP отключён
                 # if os.getenv("CJ_USE_OLD_HTTP") == "1":
                 #     return self._fallback_old_api(term, location, locale_code, page, user_ip, user_agent, page_url)
-                return []
+                return self._page_failed(f"unexpected response type {data.get('type')!r}")
 
             jobs_raw = data.get('jobs') or []
+            self._request_state.raw_count = len(jobs_raw)
             batch: List[JobVacancy] = []
             for raw in jobs_raw:
                 job = self._normalize_job_data(raw, country_name, term)
@@ -447,10 +499,10 @@ class CareerjetAggregator(BaseJobAggregator):
 
         except requests.Timeout:
             print(f"⚠️ Careerjet: таймаут page={page} [{location}] term='{term}'")
-            return []
+            return self._page_failed("timeout")
         except Exception as e:
             print(f"❌ Careerjet: ошибка page={page} [{location}] term='{term}': {e}")
-            return []
+            return self._page_failed(str(e))
 
 
 
@@ -619,6 +671,9 @@ class CareerjetAggregator(BaseJobAggregator):
             except (ValueError, TypeError):
                 posted_date = datetime.now().strftime('%Y-%m-%d')
 
+            full_text, description = ingest_description(f"careerjet_{job_id}", description)
+            language_req, refugee_friendly = self.classify_job(title, full_text, search_term)
+
             return JobVacancy(
                 id=f"careerjet_{job_id}",
                 title=title,
@@ -631,8 +686,8 @@ class CareerjetAggregator(BaseJobAggregator):
                 posted_date=posted_date,
                 country=country_name,
                 job_type=None,
-                language_requirement=self.determine_language_requirement(title, description),
-                refugee_friendly=self.is_refugee_friendly(title, description, search_term)
+                language_requirement=language_req,
+                refugee_friendly=refugee_friendly
             )
         except Exception as e:
             print(f"⚠️ {self.source_name}: Ошибка нормализации вакансии: {e}")
@@ -1,7 +1,10 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from datetime import datetime, timedelta
+from sqlalchemy import event, func, inspect, select, text
 import json
 
+from digest_schedule import next_slot_after
+
 db = SQLAlchemy()
 
 class Subscriber(db.Model):
@@ -21,16 +24,34 @@ class Subscriber(db.Model):
     # Настройки уведомлений
     frequency = db.Column(db.String(20), default='weekly')  # daily, weekly, monthly
     last_sent = db.Column(db.DateTime)
+    # Когда пора следующий дайджест: слот около last_sent + интервал частоты (см. compute_next_send_at).
+    # Поддерживается событиями ниже; планировщик выбирает по (is_active, next_send_at)
+    next_send_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_subscriber_active_next_send', 'is_active', 'next_send_at'),
+        # keyset-пагинация списка в админке (новые сверху)
+        db.Index('ix_subscriber_created_id', 'created_at', 'id'),
+    )
     
-    def get_selected_jobs(self):
-        """БЕЗОПАСНОЕ получение списка профессий"""
+    def _decoded(self, field):
+        """json.loads текста колонки с кешем на экземпляре (пересчёт, только если текст изменился)"""
+        raw = getattr(self, field)
+        cache = self.__dict__.setdefault('_decoded_cache', {})
+        hit = cache.get(field)
+        if hit is not None and hit[0] == raw:
+            return list(hit[1])
         try:
-            if self.selected_jobs:
-                return json.loads(self.selected_jobs)
-            return []
+            value = json.loads(raw) if raw else []
         except (json.JSONDecodeError, TypeError) as e:
-            print(f"❌ Ошибка парсинга selected_jobs для {self.email}: {e}")
+            print(f"❌ Ошибка парсинга {field} для {self.email}: {e}")
             return []
+        cache[field] = (raw, value)
+        return list(value)
+
+    def get_selected_jobs(self):
+        """БЕЗОПАСНОЕ получение списка профессий"""
+        return self._decoded('selected_jobs')
     
     def set_selected_jobs(self, jobs_list):
         """БЕЗОПАСНОЕ сохранение списка профессий"""
@@ -42,13 +63,7 @@ class Subscriber(db.Model):
     
     def get_countries(self):
         """БЕЗОПАСНОЕ получение списка стран"""
-        try:
-            if self.countries:
-                return json.loads(self.countries)
-            return []
-        except (json.JSONDecodeError, TypeError) as e:
-            print(f"❌ Ошибка парсинга countries для {self.email}: {e}")
-            return []
+        return self._decoded('countries')
     
     def set_countries(self, countries_list):
         """БЕЗОПАСНОЕ сохранение списка стран"""
@@ -61,6 +76,255 @@ class Subscriber(db.Model):
     def __repr__(self):
         return f'<Subscriber {self.email}>'
 
+
+
+# Нормализованные предпочтения: те же данные, что в JSON-колонках selected_jobs /
+# countries (они остаются источником для старого кода), но по ним можно
+# фильтровать и группировать в SQL по индексам. Синхронизируются событиями
+# маппера ниже; для bulk-вставок — sync_subscriber_preferences().
+class SubscriberJob(db.Model):
+    __tablename__ = 'subscriber_job'
+    subscriber_id = db.Column(db.Integer, db.ForeignKey('subscriber.id', ondelete='CASCADE'), primary_key=True)
+    job = db.Column(db.String(200), primary_key=True)
+
+    __table_args__ = (
+        db.Index('ix_subscriber_job_job', 'job', 'subscriber_id'),
+    )
+
+
+class SubscriberCountry(db.Model):
+    __tablename__ = 'subscriber_country'
+    subscriber_id = db.Column(db.Integer, db.ForeignKey('subscriber.id', ondelete='CASCADE'), primary_key=True)
+    country = db.Column(db.String(8), primary_key=True)
+
+    __table_args__ = (
+        db.Index('ix_subscriber_country_country', 'country', 'subscriber_id'),
+    )
+
+
+def _json_values(raw):
+    try:
+        value = json.loads(raw) if raw else []
+    except (TypeError, ValueError):
+        return []
+    return value if isinstance(value, list) else []
+
+
+def preference_rows(subscriber_id, selected_jobs, countries):
+    """Строки subscriber_job / subscriber_country из JSON-текста колонок"""
+    jobs = {str(j).strip()[:200] for j in _json_values(selected_jobs) if str(j).strip()}
+    codes = {str(c).strip().lower()[:8] for c in _json_values(countries) if str(c).strip()}
+    return ([{'subscriber_id': subscriber_id, 'job': j} for j in sorted(jobs)],
+            [{'subscriber_id': subscriber_id, 'country': c} for c in sorted(codes)])
+
+
+# Двойная запись включается, когда ensure_subscriber_preferences убедился, что
+# таблицы есть — иначе ошибка в событии маппера сломала бы саму подписку
+_preferences_ready = False
+
+
+def preferences_enabled():
+    return _preferences_ready
+
+
+def sync_subscriber_preferences(connection, rows, replace=True):
+    """
+    Переписать нормализованные предпочтения для rows = [(id, selected_jobs, countries), ...]
+    на переданном соединении (в текущей транзакции).
+    """
+    job_table = SubscriberJob.__table__
+    country_table = SubscriberCountry.__table__
+    ids, jobs, countries = [], [], []
+    for subscriber_id, selected_jobs, country_list in rows:
+        ids.append(subscriber_id)
+        j, c = preference_rows(subscriber_id, selected_jobs, country_list)
+        jobs.extend(j)
+        countries.extend(c)
+    if not ids:
+        return
+    if replace:
+        connection.execute(job_table.delete().where(job_table.c.subscriber_id.in_(ids)))
+        connection.execute(country_table.delete().where(country_table.c.subscriber_id.in_(ids)))
+    if jobs:
+        connection.execute(job_table.insert(), jobs)
+    if countries:
+        connection.execute(country_table.insert(), countries)
+
+
+def rebuild_subscriber_preferences(connection, chunk=1000):
+    """Полное заполнение таблиц предпочтений из JSON-колонок (пачками по chunk)"""
+    table = Subscriber.__table__
+    connection.execute(SubscriberJob.__table__.delete())
+    connection.execute(SubscriberCountry.__table__.delete())
+    total, last_id = 0, 0
+    while True:
+        rows = connection.execute(
+            select(table.c.id, table.c.selected_jobs, table.c.countries)
+            .where(table.c.id > last_id).order_by(table.c.id).limit(chunk)
+        ).fetchall()
+        if not rows:
+            return total
+        sync_subscriber_preferences(connection, rows, replace=False)
+        total += len(rows)
+        last_id = rows[-1][0]
+
+
+def preference_demand(kind='job', active_only=True, limit=20):
+    """[(профессия | страна, число подписчиков)] — GROUP BY по индексу таблицы предпочтений"""
+    model = SubscriberJob if kind == 'job' else SubscriberCountry
+    col = model.job if kind == 'job' else model.country
+    q = db.session.query(col, func.count(model.subscriber_id))
+    if active_only:
+        q = q.join(Subscriber, Subscriber.id == model.subscriber_id).filter(Subscriber.is_active.is_(True))
+    return q.group_by(col).order_by(func.count(model.subscriber_id).desc(), col).limit(limit).all()
+
+
+FREQUENCY_INTERVALS = {
+    'daily': timedelta(days=1),
+    'weekly': timedelta(days=7),
+    'monthly': timedelta(days=30),
+}
+
+
+def compute_next_send_at(frequency, last_sent, key=''):
+    """
+    Интервалы те же, что в should_send_notification (неизвестная частота —
+    никогда), но время выравнивается на слот подписчика в окнах рассылки
+    (digest_schedule); без last_sent — сразу (первый дайджест). key — email подписчика.
+    """
+    interval = FREQUENCY_INTERVALS.get(frequency or 'weekly')
+    if interval is None:
+        return None
+    return next_slot_after(key, last_sent, interval)
+
+
+@event.listens_for(Subscriber, 'before_insert')
+def _subscriber_next_send_on_insert(mapper, connection, target):
+    target.next_send_at = compute_next_send_at(target.frequency, target.last_sent, target.email)
+
+
+@event.listens_for(Subscriber, 'before_update')
+def _subscriber_next_send_on_update(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.last_sent.history.has_changes() or state.attrs.frequency.history.has_changes():
+        target.next_send_at = compute_next_send_at(target.frequency, target.last_sent, target.email)
+
+
+
+@event.listens_for(Subscriber, 'after_insert')
+def _subscriber_preferences_on_insert(mapper, connection, target):
+    if not _preferences_ready:
+        return
+    sync_subscriber_preferences(connection, [(target.id, target.selected_jobs, target.countries)], replace=False)
+
+
+@event.listens_for(Subscriber, 'after_update')
+def _subscriber_preferences_on_update(mapper, connection, target):
+    if not _preferences_ready:
+        return
+    state = inspect(target)
+    if state.attrs.selected_jobs.history.has_changes() or state.attrs.countries.history.has_changes():
+        sync_subscriber_preferences(connection, [(target.id, target.selected_jobs, target.countries)])
+
+
+@event.listens_for(Subscriber, 'before_delete')
+def _subscriber_preferences_on_delete(mapper, connection, target):
+    # SQLite без PRAGMA foreign_keys каскад не выполняет
+    if _preferences_ready:
+        sync_subscriber_preferences(connection, [(target.id, None, None)])
+
+
+def ensure_subscriber_schedule(app):
+    """
+    Колонка next_send_at и индексы для баз без миграции (dev/SQLite) и
+    заполнение пустых значений. В проде то же делает Alembic-миграция,
+    поэтому вне SQLite при старте ничего не трогаем.
+    """
+    try:
+        with app.app_context():
+            if db.engine.dialect.name != 'sqlite':
+                return
+            table = Subscriber.__table__
+            insp = inspect(db.engine)
+            if not insp.has_table(table.name):
+                return
+            cols = {c['name'] for c in insp.get_columns(table.name)}
+            with db.engine.begin() as conn:
+                if 'next_send_at' not in cols:
+                    col_type = table.c.next_send_at.type.compile(dialect=db.engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN next_send_at {col_type}"))
+                    print(f"🔧 Subscriber: добавлена колонка {table.name}.next_send_at")
+                conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_subscriber_active_next_send "
+                    f"ON {table.name} (is_active, next_send_at)"
+                ))
+                conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_subscriber_created_id "
+                    f"ON {table.name} (created_at, id)"
+                ))
+
+                rows = conn.execute(text(
+                    f"SELECT id, email, frequency, last_sent FROM {table.name} "
+                    f"WHERE next_send_at IS NULL AND is_active"
+                )).fetchall()
+                updates = []
+                for row in rows:
+                    last_sent = row.last_sent
+                    if isinstance(last_sent, str):   # SQLite отдаёт строкой
+                        last_sent = datetime.fromisoformat(last_sent)
+                    next_at = compute_next_send_at(row.frequency, last_sent, row.email)
+                    if next_at is not None:
+                        updates.append({'id': row.id, 'next_send_at': next_at})
+                if updates:
+                    conn.execute(text(f"UPDATE {table.name} SET next_send_at = :next_send_at WHERE id = :id"),
+                                 updates)
+                    print(f"🔧 Subscriber: next_send_at заполнен для {len(updates)} подписчиков")
+    except Exception as e:
+        print(f"⚠️ Subscriber: не удалось подготовить next_send_at: {e}")
+
+def ensure_subscriber_preferences(app):
+    """
+    Таблицы subscriber_job / subscriber_country для баз без миграции и
+    дозаполнение для подписчиков, у которых предпочтения есть только в JSON
+    (записаны до появления таблиц или bulk-вставкой без синхронизации).
+    Вне SQLite таблицы и дозаполнение — дело Alembic-миграции: при старте
+    только проверяем, что таблицы есть, и включаем двойную запись.
+    """
+    global _preferences_ready
+    try:
+        with app.app_context():
+            insp = inspect(db.engine)
+            if not insp.has_table(Subscriber.__tablename__):
+                return
+            if db.engine.dialect.name != 'sqlite':
+                _preferences_ready = (insp.has_table(SubscriberJob.__tablename__)
+                                      and insp.has_table(SubscriberCountry.__tablename__))
+                if not _preferences_ready:
+                    print("⚠️ Subscriber: таблицы предпочтений не найдены (миграция не применена), "
+                          "двойная запись выключена")
+                return
+            SubscriberJob.__table__.create(db.engine, checkfirst=True)
+            SubscriberCountry.__table__.create(db.engine, checkfirst=True)
+            table = Subscriber.__table__
+            job_table = SubscriberJob.__table__
+            country_table = SubscriberCountry.__table__
+            missing = select(table.c.id, table.c.selected_jobs, table.c.countries).where(
+                ((table.c.selected_jobs.isnot(None)) & ~select(job_table.c.subscriber_id)
+                 .where(job_table.c.subscriber_id == table.c.id).exists())
+                | ((table.c.countries.isnot(None)) & ~select(country_table.c.subscriber_id)
+                   .where(country_table.c.subscriber_id == table.c.id).exists())
+            )
+            with db.engine.begin() as conn:
+                rows = conn.execute(missing).fetchall()
+                for i in range(0, len(rows), 1000):
+                    sync_subscriber_preferences(conn, rows[i:i + 1000])
+            if rows:
+                print(f"🔧 Subscriber: предпочтения разложены по таблицам для {len(rows)} подписчиков")
+            _preferences_ready = True
+    except Exception as e:
+        print(f"⚠️ Subscriber: таблицы предпочтений недоступны, двойная запись выключена: {e}")
+
+
 class EmailLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     subscriber_id = db.Column(db.Integer, db.ForeignKey('subscriber.id'), nullable=True)  # Изменено на nullable=True
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Пакетная запись результатов рассылки.
+
+Вместо EmailLog через session.add + изменения subscriber.last_sent на
+каждого подписчика (и одной длинной транзакции на весь прогон или
+коммита на каждое письмо) копим строки в буфере и сбрасываем пачками по
+DIGEST_LOG_CHUNK: один bulk INSERT в email_log, один bulk UPDATE
+subscriber по первичному ключу, короткий коммит. Если процесс упадёт,
+теряется не больше одной пачки (повторных писем не будет — отправленные
+вакансии уже в digest_seen).
+"""
+
+import os
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert, update
+
+from database import db, Subscriber, EmailLog, compute_next_send_at
+
+DIGEST_LOG_CHUNK = int(os.getenv('DIGEST_LOG_CHUNK', '200'))
+
+
+class DigestLogBuffer:
+    """Буфер EmailLog + last_sent; использовать внутри app_context"""
+
+    def __init__(self, chunk_size: int = DIGEST_LOG_CHUNK):
+        self.chunk_size = max(1, chunk_size)
+        self._logs: List[Dict] = []
+        self._touched: Dict[int, Dict] = {}
+        self.flushed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+    def __len__(self):
+        return len(self._logs)
+
+    def add(self, subscriber, subject: str, jobs_count: int, status: str = 'sent',
+            sent_at: Optional[datetime] = None, error_message: Optional[str] = None):
+        # UTC: last_sent/next_send_at сравниваются с datetime.utcnow() (digest_schedule)
+        sent_at = sent_at or datetime.utcnow()
+        self._logs.append({
+            'subscriber_id': subscriber.id,
+            'email': subscriber.email,
+            'subject': subject,
+            'jobs_count': jobs_count,
+            'status': status,
+            'sent_at': sent_at,
+            'error_message': error_message,
+        })
+        if status == 'sent':
+            # bulk UPDATE не вызывает события маппера — next_send_at считаем здесь
+            self._touched[subscriber.id] = {
+                'id': subscriber.id,
+                'last_sent': sent_at,
+                'next_send_at': compute_next_send_at(subscriber.frequency, sent_at, subscriber.email),
+            }
+        if len(self._logs) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> int:
+        if not self._logs and not self._touched:
+            return 0
+        logs, self._logs = self._logs, []
+        touched, self._touched = list(self._touched.values()), {}
+        try:
+            if logs:
+                db.session.execute(insert(EmailLog), logs)
+            if touched:
+                db.session.execute(update(Subscriber), touched)
+            db.session.commit()
+            self.flushed += len(logs)
+            print(f"💾 DigestLog: записано {len(logs)} логов, обновлено {len(touched)} подписчиков")
+            return len(logs)
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ DigestLog: не удалось записать пачку из {len(logs)}: {e}")
+            return 0
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Выравнивание рассылки дайджестов по суткам.
+
+Раньше все ежедневные подписчики становились «готовы» примерно в один час
+(last_sent + сутки), и почасовой планировщик выгребал их одной пачкой —
+поиски Adzuna/Careerjet и SMTP попадали на часы пользовательского трафика.
+
+Теперь у каждого подписчика свой постоянный слот (час:минута) внутри
+непиковых окон DIGEST_SEND_HOURS (UTC) — по хэшу email, поэтому нагрузка
+распределяется по окнам равномерно. next_send_at выравнивается на ближайший
+такой слот. Почасовой лимит — не меньше DIGEST_HOURLY_CAPACITY, но растёт,
+если должников больше, чем окно успеет разослать (hourly_capacity: очередь
+делится на оставшиеся часы окна, в последний час берутся все) — иначе
+излишек копился бы день за днём. Первый дайджест нового подписчика не ждёт
+слота: он уходит при ближайшем запуске планировщика, даже вне окна.
+"""
+
+import hashlib
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+DIGEST_HOURLY_CAPACITY = int(os.getenv('DIGEST_HOURLY_CAPACITY', '300'))
+
+# Слот может наступить немного раньше, чем last_sent + интервал (не больше
+# чем на полинтервала и 12 часов) — иначе письмо, ушедшее с опозданием,
+# сдвигало бы подписчика на сутки вперёд
+_MAX_EARLY = timedelta(hours=12)
+
+
+def _parse_hours(spec: str) -> List[int]:
+    """'0-6,22-23' → [0..6, 22, 23]; диапазон через полночь ('22-3') тоже можно"""
+    hours = set()
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if '-' in part:
+                start, end = (int(x) % 24 for x in part.split('-', 1))
+                h = start
+                while True:
+                    hours.add(h)
+                    if h == end:
+                        break
+                    h = (h + 1) % 24
+            else:
+                hours.add(int(part) % 24)
+        except ValueError:
+            print(f"⚠️ DigestSchedule: не понял часы '{part}' в DIGEST_SEND_HOURS")
+    return sorted(hours) or list(range(24))
+
+
+SEND_HOURS = _parse_hours(os.getenv('DIGEST_SEND_HOURS', '0-6'))
+
+
+def slot_for(key: str) -> Tuple[int, int]:
+    """Постоянный (час, минута) подписчика внутри окон рассылки"""
+    h = int(hashlib.sha1(f"digest-slot:{(key or '').lower()}".encode('utf-8')).hexdigest()[:12], 16)
+    return SEND_HOURS[h % len(SEND_HOURS)], (h // len(SEND_HOURS)) % 60
+
+
+def align_to_slot(key: str, earliest: datetime) -> datetime:
+    """Первый слот подписчика не раньше earliest"""
+    hour, minute = slot_for(key)
+    candidate = earliest.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if candidate < earliest:
+        candidate += timedelta(days=1)
+    return candidate
+
+
+def next_slot_after(key: str, last_sent: Optional[datetime], interval: timedelta) -> datetime:
+    """Следующая отправка: слот около last_sent + interval; без last_sent — сразу"""
+    if not last_sent:
+        return datetime.utcnow().replace(microsecond=0)
+    early = min(interval / 2, _MAX_EARLY)
+    return align_to_slot(key, last_sent + interval - early)
+
+
+def in_send_window(now: Optional[datetime] = None) -> bool:
+    return (now or datetime.utcnow()).hour in SEND_HOURS
+
+
+def window_hours_left(now: Optional[datetime] = None) -> int:
+    """Сколько часов (включая текущий) осталось до закрытия текущего окна; вне окна — 0"""
+    hour = (now or datetime.utcnow()).hour
+    left = 0
+    while hour in SEND_HOURS and left < 24:
+        left += 1
+        hour = (hour + 1) % 24
+    return left
+
+
+def hourly_capacity(due_count: int, now: Optional[datetime] = None) -> int:
+    """
+    Лимит на текущий час: DIGEST_HOURLY_CAPACITY или больше — столько, чтобы
+    все due_count разошлись до конца окна. Рост лимита пишем в лог.
+    """
+    left = window_hours_left(now)
+    if not left:
+        # вне окна идут только первые дайджесты новых подписчиков — их не держим
+        return max(DIGEST_HOURLY_CAPACITY, due_count)
+    needed = -(-max(0, due_count) // left)
+    if needed > DIGEST_HOURLY_CAPACITY:
+        print(f"⚠️ DigestSchedule: к отправке {due_count}, до конца окна {left} ч — "
+              f"лимит поднят до {needed}/час (DIGEST_HOURLY_CAPACITY={DIGEST_HOURLY_CAPACITY})")
+        return needed
+    return DIGEST_HOURLY_CAPACITY
+
+
+_local_used: Dict[str, int] = {}
+_local_lock = threading.Lock()
+
+
+def reserve_capacity(r, wanted: int, now: Optional[datetime] = None, capacity: Optional[int] = None) -> int:
+    """
+    Сколько из wanted подписчиков можно взять в текущем часе (общий счётчик
+    в Redis для всех процессов планировщика; без Redis — в памяти).
+    capacity — лимит часа (hourly_capacity), по умолчанию DIGEST_HOURLY_CAPACITY.
+    """
+    if wanted <= 0:
+        return 0
+    capacity = DIGEST_HOURLY_CAPACITY if capacity is None else capacity
+    key = f"digest:hour:{(now or datetime.utcnow()):%Y%m%d%H}"
+    if r:
+        try:
+            used = r.incrby(key, wanted)
+            if used == wanted:
+                r.expire(key, 2 * 3600)
+            over = max(0, used - capacity)
+            granted = max(0, wanted - over)
+            if granted < wanted:
+                r.decrby(key, wanted - granted)
+            return granted
+        except Exception:
+            pass
+    with _local_lock:
+        if key not in _local_used:
+            _local_used.clear()   # новый час — старые счётчики не нужны
+        used = _local_used.get(key, 0)
+        granted = max(0, min(wanted, capacity - used))
+        _local_used[key] = used + granted
+        return granted
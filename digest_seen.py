@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Уже отправленные подписчику вакансии (seen-set) для дайджестов «только новое».
+
+Redis SET digest_seen:{subscriber_id} из компактных отпечатков вакансий
+(12 hex-символов) с TTL, который продлевается при каждой отправке.
+На каждую вакансию два отпечатка: по URL/id и по title|company|location —
+чтобы та же вакансия из другого источника тоже считалась виденной.
+Без Redis — словарь множеств в памяти процесса планировщика.
+"""
+
+import hashlib
+import os
+import threading
+from typing import Dict, Iterable, List, Set
+
+SEEN_TTL_DAYS = int(os.getenv('DIGEST_SEEN_TTL_DAYS', '60'))
+
+_local: Dict[int, Set[str]] = {}
+_local_lock = threading.Lock()
+
+
+def _key(subscriber_id) -> str:
+    return f"digest_seen:{subscriber_id}"
+
+
+def _short_hash(value: str) -> str:
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()[:12]
+
+
+def job_fingerprints(job) -> List[str]:
+    url = (getattr(job, 'apply_url', '') or getattr(job, 'id', '') or '').strip()
+    content = '|'.join(
+        (getattr(job, field, '') or '').strip().lower() for field in ('title', 'company', 'location')
+    )
+    return [_short_hash('u:' + url), _short_hash('c:' + content)]
+
+
+def filter_unseen(r, subscriber_id, jobs: Iterable) -> List:
+    """Вакансии, которые этому подписчику ещё не отправлялись (порядок сохраняется)"""
+    jobs = list(jobs)
+    if not jobs:
+        return []
+    prints = [job_fingerprints(j) for j in jobs]
+    flat = [fp for pair in prints for fp in pair]
+
+    seen: Set[str]
+    if r:
+        try:
+            flags = r.smismember(_key(subscriber_id), flat)
+            seen = {fp for fp, flag in zip(flat, flags) if flag}
+        except Exception:
+            seen = set()
+    else:
+        with _local_lock:
+            seen = set(_local.get(subscriber_id, ())) & set(flat)
+
+    return [job for job, pair in zip(jobs, prints) if not (pair[0] in seen or pair[1] in seen)]
+
+
+def mark_seen(r, subscriber_id, jobs: Iterable) -> None:
+    """Запомнить отправленные вакансии (и продлить TTL множества)"""
+    flat = [fp for j in jobs for fp in job_fingerprints(j)]
+    if not flat:
+        return
+    if r:
+        try:
+            pipe = r.pipeline(transaction=False)
+            pipe.sadd(_key(subscriber_id), *flat)
+            pipe.expire(_key(subscriber_id), SEEN_TTL_DAYS * 24 * 3600)
+            pipe.execute()
+            return
+        except Exception as e:
+            print(f"⚠️ digest_seen: Redis недоступен ({e}), запоминаем в памяти")
+    with _local_lock:
+        _local.setdefault(subscriber_id, set()).update(flat)
+
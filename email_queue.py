@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Надёжная очередь дайджестов на Redis Streams.
+
+Планировщик больше не рассылает сам: он кладёт в стрим email:digest по
+одному сообщению на подписчика, которому пора отправлять. Воркеры
+(email_worker.py, сколько угодно экземпляров) читают стрим через consumer
+group, отправляют и подтверждают (XACK) только после записи в БД.
+
+  • процесс упал посреди пачки — неподтверждённые сообщения через
+    EMAIL_QUEUE_CLAIM_IDLE_SEC забирает другой воркер (XAUTOCLAIM);
+  • ошибка отправки — сообщение не подтверждается и повторяется тем же
+    механизмом (таймаут простоя = пауза перед повтором);
+  • после EMAIL_QUEUE_MAX_DELIVERIES доставок — в email:digest:dead.
+
+Повторная обработка безопасна: уже отправленные вакансии отсекает
+digest_seen, и письмо без новых вакансий не уходит.
+"""
+
+import os
+import socket
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+
+from database import db, Subscriber
+from email_service import _redis_client, _run_grouped_digests
+
+STREAM = os.getenv('EMAIL_QUEUE_STREAM', 'email:digest')
+DEAD_STREAM = STREAM + ':dead'
+GROUP = os.getenv('EMAIL_QUEUE_GROUP', 'digest-workers')
+
+EMAIL_QUEUE_BATCH = int(os.getenv('EMAIL_QUEUE_BATCH', '50'))
+EMAIL_QUEUE_BLOCK_MS = int(os.getenv('EMAIL_QUEUE_BLOCK_MS', '5000'))
+EMAIL_QUEUE_CLAIM_IDLE_SEC = int(os.getenv('EMAIL_QUEUE_CLAIM_IDLE_SEC', '600'))
+EMAIL_QUEUE_MAX_DELIVERIES = int(os.getenv('EMAIL_QUEUE_MAX_DELIVERIES', '5'))
+EMAIL_QUEUE_MAXLEN = int(os.getenv('EMAIL_QUEUE_MAXLEN', '200000'))
+
+StreamEntry = Tuple[str, Dict[str, str]]   # (id сообщения, поля)
+
+
+def is_enabled(r) -> bool:
+    """Очередь работает только с Redis; EMAIL_QUEUE=0 — рассылать по-старому, в процессе"""
+    return bool(r) and os.getenv('EMAIL_QUEUE', '1') != '0'
+
+
+def ensure_group(r):
+    try:
+        r.xgroup_create(STREAM, GROUP, id='0', mkstream=True)
+    except Exception as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+def enqueue_digests(r, subscriber_ids: Iterable[int], kind: str = 'scheduled') -> int:
+    """Одно сообщение на подписчика (одним pipeline)"""
+    ids = list(subscriber_ids)
+    if not ids:
+        return 0
+    ensure_group(r)
+    now = datetime.utcnow().isoformat(timespec='seconds')
+    pipe = r.pipeline(transaction=False)
+    for sid in ids:
+        pipe.xadd(STREAM, {'subscriber_id': str(sid), 'kind': kind, 'enqueued_at': now},
+                  maxlen=EMAIL_QUEUE_MAXLEN, approximate=True)
+    pipe.execute()
+    print(f"📨 Очередь: поставлено {len(ids)} дайджестов ({kind})")
+    return len(ids)
+
+
+def _dead_letter(r, msg_id: str, fields: Dict[str, str], reason: str):
+    pipe = r.pipeline(transaction=True)
+    pipe.xadd(DEAD_STREAM, dict(fields, original_id=msg_id, reason=reason,
+                                failed_at=datetime.utcnow().isoformat(timespec='seconds')),
+              maxlen=EMAIL_QUEUE_MAXLEN, approximate=True)
+    pipe.xack(STREAM, GROUP, msg_id)
+    pipe.execute()
+    print(f"☠️ Очередь: {msg_id} (подписчик {fields.get('subscriber_id')}) → {DEAD_STREAM}: {reason}")
+
+
+def _claim_stale(r, consumer: str) -> List[StreamEntry]:
+    """Зависшие у упавших воркеров и неудавшиеся сообщения; «отравленные» — в dead-letter"""
+    try:
+        result = r.xautoclaim(STREAM, GROUP, consumer, EMAIL_QUEUE_CLAIM_IDLE_SEC * 1000,
+                              start_id='0-0', count=EMAIL_QUEUE_BATCH)
+    except Exception as e:
+        print(f"⚠️ Очередь: XAUTOCLAIM не удался: {e}")
+        return []
+    claimed = [(mid, fields) for mid, fields in result[1] if fields]
+    # удалённые из стрима (MAXLEN) записи приходят без полей — просто подтверждаем
+    for mid, fields in result[1]:
+        if not fields:
+            r.xack(STREAM, GROUP, mid)
+
+    fresh = []
+    for mid, fields in claimed:
+        try:
+            info = r.xpending_range(STREAM, GROUP, min=mid, max=mid, count=1)
+            deliveries = info[0]['times_delivered'] if info else 1
+        except Exception:
+            deliveries = 1
+        if deliveries > EMAIL_QUEUE_MAX_DELIVERIES:
+            _dead_letter(r, mid, fields, f"delivered {deliveries} times")
+        else:
+            fresh.append((mid, fields))
+    if fresh:
+        print(f"♻️ Очередь: подобрано {len(fresh)} неподтверждённых сообщений")
+    return fresh
+
+
+def _read_new(r, consumer: str) -> List[StreamEntry]:
+    result = r.xreadgroup(GROUP, consumer, {STREAM: '>'},
+                          count=EMAIL_QUEUE_BATCH, block=EMAIL_QUEUE_BLOCK_MS)
+    return [(mid, fields) for _stream, entries in (result or []) for mid, fields in entries]
+
+
+def process_batch(app, r, messages: List[StreamEntry], main_aggregator, additional_aggregators) -> Dict[str, int]:
+    """
+    Пачка сообщений → одна групповая рассылка (_run_grouped_digests).
+    Подтверждаем отправленные и пропущенные; неудачные остаются в PEL до повтора.
+    """
+    stats = {'sent': 0, 'skipped': 0, 'failed': 0}
+    by_subscriber: Dict[int, List[str]] = {}
+    to_ack: List[str] = []
+    for mid, fields in messages:
+        try:
+            by_subscriber.setdefault(int(fields['subscriber_id']), []).append(mid)
+        except (KeyError, ValueError):
+            _dead_letter(r, mid, fields, 'bad message')
+
+    if not by_subscriber:
+        return stats
+
+    with app.app_context():
+        subscribers = Subscriber.query.filter(Subscriber.id.in_(list(by_subscriber))).all()
+        active = [s for s in subscribers if s.is_active]
+        # отписался / удалён, пока сообщение ждало в очереди
+        for sid in set(by_subscriber) - {s.id for s in active}:
+            to_ack.extend(by_subscriber.pop(sid))
+            stats['skipped'] += 1
+
+        outcome = _run_grouped_digests(app, active, main_aggregator, additional_aggregators, r=r)
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Очередь: не удалось сохранить результаты пачки: {e}")
+
+    for sid, mids in by_subscriber.items():
+        status = outcome.get(sid, 'failed')
+        stats[status] += 1
+        if status != 'failed':
+            to_ack.extend(mids)
+    if to_ack:
+        r.xack(STREAM, GROUP, *to_ack)
+    return stats
+
+
+def consume_forever(app, main_aggregator, additional_aggregators, consumer: str = None):
+    """Основной цикл воркера: сначала зависшие сообщения, затем новые"""
+    r = _redis_client()
+    if not is_enabled(r):
+        # без Redis планировщик рассылает сам, в процессе (run_scheduled_notifications)
+        print("⚠️ Email worker: очередь недоступна (нет Redis или EMAIL_QUEUE=0)")
+        return
+    ensure_group(r)
+    consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+    print(f"📬 Email worker {consumer}: читаю {STREAM} (группа {GROUP})")
+
+    last_claim = 0.0
+    while True:
+        try:
+            messages = []
+            if time.time() - last_claim >= 30:
+                last_claim = time.time()
+                messages = _claim_stale(r, consumer)
+            if not messages:
+                messages = _read_new(r, consumer)
+            if not messages:
+                continue
+            stats = process_batch(app, r, messages, main_aggregator, additional_aggregators)
+            print(f"✅ Email worker: пачка {len(messages)} — отправлено {stats['sent']}, "
+                  f"пропущено {stats['skipped']}, ошибок {stats['failed']}")
+        except Exception as e:
+            print(f"❌ Email worker: {e}")
+            time.sleep(5)
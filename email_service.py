@@ -1,17 +1,25 @@
 # -*- coding: utf-8 -*-
 from flask_mail import Mail, Message
 from database import db, Subscriber, EmailLog
+from sqlalchemy import and_, or_
 from datetime import datetime, timedelta
 import os
-from threading import Thread
+from threading import Thread, Lock
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import time
 import json
 import hashlib
-from urllib.parse import urlparse
-try:
-    import redis
-except ImportError:
-    redis = None
+import queue
+import jinja2
+from markupsafe import Markup
+import smtplib
+from job_dedup import dedupe_jobs
+import digest_seen
+import digest_schedule
+from digest_log import DigestLogBuffer
+from redis_conn import connect_redis
+from job_text import flush_descriptions
 
 
 if os.getenv("FORCE_SMTP_IPV4") == "1":
@@ -23,6 +31,8 @@ if os.getenv("FORCE_SMTP_IPV4") == "1":
 
 _UI_DICT_CACHE = {}
 
+DIGEST_MAX_JOBS = int(os.getenv('DIGEST_MAX_JOBS', '20'))  # вакансий в одном письме
+
 def _front_tr(lang: str, s: str) -> str:
     """Переводит русскую фразу s с помощью фронтового словаря /static/i18n/<lang>.json.
        Если ключа нет — возвращает исходное s."""
@@ -340,17 +350,33 @@ def _remote_allowed_email(preferences: dict, specific_jobs_map: dict) -> bool:
 # Поиск/агрегация (ваш код — только слегка отрефакторен под lang)
 # -----------------------------------------------------------------------------
 
-def _search_all_sources(main_aggregator, additional_aggregators, preferences):
+def _search_all_sources(main_aggregator, additional_aggregators, preferences, stop_when=None):
     """
     Поиск по ВСЕМ источникам и дедупликация.
+    stop_when(jobs) -> True — хватит: Adzuna останавливается между термами
+    (через cancel_check), следующие источники не опрашиваем.
     """
     print(f"   🔍 Ищем вакансии через все доступные источники...")
     all_found_jobs = []
 
     # 1) Основной агрегатор (Adzuna)
     if main_aggregator:
+        found_so_far = []
+        verdict = {'n': -1, 'stop': False}
+
+        def enough_found():
+            # cancel_check дёргается часто (ожидание rate limiter) — пересчитываем, только если нашлось новое
+            if len(found_so_far) != verdict['n']:
+                verdict['n'] = len(found_so_far)
+                verdict['stop'] = bool(found_so_far) and bool(stop_when(found_so_far))
+            return verdict['stop']
+
         try:
-            adzuna_jobs = main_aggregator.search_specific_jobs(preferences)
+            adzuna_jobs = main_aggregator.search_specific_jobs(
+                preferences,
+                cancel_check=enough_found if stop_when else None,
+                jobs_callback=found_so_far.extend if stop_when else None,
+            )
             all_found_jobs.extend(adzuna_jobs)
             print(f"   ✅ Adzuna: найдено {len(adzuna_jobs)} вакансий")
         except Exception as e:
@@ -363,6 +389,9 @@ def _search_all_sources(main_aggregator, additional_aggregators, preferences):
     server_ua = "GlobalJobHunter/EmailScheduler (+https://www.globaljobhunter.vip)"
     server_url = "https://www.globaljobhunter.vip/results"
     for source_name, aggregator in additional_aggregators.items():
+        if stop_when and all_found_jobs and stop_when(all_found_jobs):
+            print(f"   ⏹ Достаточно новых вакансий — остальные источники не опрашиваем")
+            break
         # Скипаем remote-only источники при не-удалённых профессиях
         if source_name in ('remotive', 'jobicy') and not use_remote:
             print(f"   ⛔ Пропуск {source_name}: выбранные профессии не допускают удалёнку")
@@ -397,6 +426,9 @@ def _search_all_sources(main_aggregator, additional_aggregators, preferences):
             seen_urls.add(job.apply_url)
             final_jobs.append(job)
 
+    # 4) Почти-дубли между источниками (разные URL, чуть разные заголовки)
+    final_jobs = dedupe_jobs(final_jobs)
+
     print(f"   📊 Итого уникальных вакансий: {len(final_jobs)}")
     return final_jobs
 
@@ -405,44 +437,67 @@ def _search_all_sources(main_aggregator, additional_aggregators, preferences):
 # Отправка для одного подписчика
 # -----------------------------------------------------------------------------
 
-def _send_notification_for_subscriber(app, subscriber, main_aggregator, additional_aggregators):
+def _subscriber_preferences(subscriber):
+    return {
+        'is_refugee': subscriber.is_refugee,
+        'selected_jobs': subscriber.get_selected_jobs(),
+        'countries': subscriber.get_countries(),
+        'cities': [subscriber.city] if subscriber.city else []
+    }
+
+
+def _prepare_digest(subscriber, found_jobs, r=None):
     """
-    Ищет и отправляет уведомление для ОДНОГО подписчика.
+    Что отправить подписчику: только вакансии, которых ещё не было в его
+    прошлых письмах (digest_seen). None — новых нет.
     """
-    try:
-        preferences = {
-            'is_refugee': subscriber.is_refugee,
-            'selected_jobs': subscriber.get_selected_jobs(),
-            'countries': subscriber.get_countries(),
-            'cities': [subscriber.city] if subscriber.city else []
-        }
+    final_jobs = digest_seen.filter_unseen(r, subscriber.id, found_jobs)
+    if not final_jobs:
+        print(f"   ℹ️ Нет новых вакансий для {subscriber.email} - пропускаем отправку")
+        return None
+    return final_jobs[:DIGEST_MAX_JOBS], len(final_jobs)
 
-        if not preferences['selected_jobs'] or not preferences['countries']:
-            print(f"   ⚠️ У {subscriber.email} отсутствуют профессии или страны - пропускаем")
-            return False
 
-        final_jobs = _search_all_sources(main_aggregator, additional_aggregators, preferences)
-        if not final_jobs:
-            print(f"   ℹ️ Нет новых вакансий для {subscriber.email} - пропускаем отправку")
+def _record_digest(subscriber, jobs_sent, total_count, lang, r=None, log_buffer=None):
+    """
+    После успешной отправки: seen-set, EmailLog, last_sent (поток с сессией БД).
+    С log_buffer лог и last_sent уходят в БД пачкой (DigestLogBuffer).
+    """
+    digest_seen.mark_seen(r, subscriber.id, jobs_sent)
+    subject = _digest_subject(lang, total_count)
+    if log_buffer is not None:
+        log_buffer.add(subscriber, subject, total_count)
+        return
+    sent_at = datetime.utcnow()     # расписание (next_send_at) считается в UTC
+    log = EmailLog(
+        subscriber_id=subscriber.id,
+        email=subscriber.email,
+        subject=subject,
+        jobs_count=total_count,
+        status='sent',
+        sent_at=sent_at
+    )
+    db.session.add(log)
+    subscriber.last_sent = sent_at
+
+
+def _deliver_digest(app, subscriber, found_jobs, preferences, r=None):
+    """
+    Отправляет подписчику уже найденные вакансии — только те, которых ещё
+    не было в его прошлых письмах (digest_seen).
+    """
+    try:
+        prepared = _prepare_digest(subscriber, found_jobs, r=r)
+        if not prepared:
             return False
+        jobs_to_send, total_count = prepared
 
         lang = _get_lang(subscriber)
-
-        print(f"   📤 Отправляем email ({lang}) с {len(final_jobs)} вакансиями...")
-        success = send_job_email(app, subscriber, final_jobs[:20], preferences, lang=lang)  # лимит 20
+        print(f"   📤 Отправляем email ({lang}) с {len(jobs_to_send)} новыми вакансиями из {len(found_jobs)}...")
+        success = send_job_email(app, subscriber, jobs_to_send, preferences, lang=lang)
 
         if success:
-            subject = _digest_subject(lang, len(final_jobs))
-            log = EmailLog(
-                subscriber_id=subscriber.id,
-                email=subscriber.email,
-                subject=subject,
-                jobs_count=len(final_jobs),
-                status='sent',
-                sent_at=datetime.now()
-            )
-            db.session.add(log)
-            subscriber.last_sent = datetime.now()
+            _record_digest(subscriber, jobs_to_send, total_count, lang, r=r)
             print(f"   ✅ Email успешно отправлен на {subscriber.email}")
             return True
         else:
@@ -455,37 +510,139 @@ def _send_notification_for_subscriber(app, subscriber, main_aggregator, addition
         traceback.print_exc()
         return False
 
-def _redis_client():
-    if not redis:
-        return None
+
+def _send_notification_for_subscriber(app, subscriber, main_aggregator, additional_aggregators, r=None):
+    """
+    Ищет и отправляет уведомление для ОДНОГО подписчика.
+    """
+    preferences = _subscriber_preferences(subscriber)
+    if not preferences['selected_jobs'] or not preferences['countries']:
+        print(f"   ⚠️ У {subscriber.email} отсутствуют профессии или страны - пропускаем")
+        return False
+
+    def enough_new(jobs):
+        return len(digest_seen.filter_unseen(r, subscriber.id, jobs)) >= DIGEST_MAX_JOBS
+
     try:
-        url = os.getenv('REDIS_TLS_URL') or os.getenv('REDIS_URL')
-        print(f"ℹ️ Email: using {'REDIS_TLS_URL/REDIS_URL' if url else 'REDIS_HOST/PORT/DB'}")
-        if url:
-            u = urlparse(url)
-            r = redis.Redis(
-                host=u.hostname, port=u.port or 6379, password=u.password,
-                db=int((u.path or '/0').lstrip('/')),
-                ssl=(u.scheme == 'rediss'), ssl_cert_reqs=None,
-                decode_responses=True
-            )
-        else:
-            r = redis.Redis(
-                host=os.getenv('REDIS_HOST','localhost'),
-                port=int(os.getenv('REDIS_PORT',6379)),
-                db=int(os.getenv('REDIS_DB',0)),
-                decode_responses=True
-            )
+        found_jobs = _search_all_sources(main_aggregator, additional_aggregators, preferences,
+                                         stop_when=enough_new)
+    except Exception as e:
+        print(f"   ❌ Ошибка поиска для {subscriber.email}: {e}")
+        return False
+    return _deliver_digest(app, subscriber, found_jobs, preferences, r=r)
 
-        try:
-            kw = r.connection_pool.connection_kwargs
-            print(f"🔌 Email: target {kw.get('host')}:{kw.get('port')}")
-        except Exception:
-            pass    
-        r.ping()
-        return r
-    except Exception:
-        return None
+
+# -----------------------------------------------------------------------------
+# Группировка подписчиков с одинаковыми предпочтениями
+# -----------------------------------------------------------------------------
+
+DIGEST_SEARCH_CONCURRENCY = int(os.getenv('DIGEST_SEARCH_CONCURRENCY', '3'))
+
+
+def _preference_key(preferences):
+    """Канонический ключ поиска: одинаковые профессии+страны+город → один запрос"""
+    return (
+        tuple(sorted(set(preferences.get('selected_jobs') or []))),
+        tuple(sorted(set(c.lower() for c in (preferences.get('countries') or [])))),
+        tuple(c.strip().lower() for c in (preferences.get('cities') or []) if c and c.strip()),
+    )
+
+
+def _group_by_preferences(subscribers):
+    """{key: (preferences для поиска, [подписчики])}; без профессий/стран — мимо"""
+    groups = {}
+    for sub in subscribers:
+        prefs = _subscriber_preferences(sub)
+        if not prefs['selected_jobs'] or not prefs['countries']:
+            print(f"   ⚠️ У {sub.email} отсутствуют профессии или страны - пропускаем")
+            continue
+        key = _preference_key(prefs)
+        if key not in groups:
+            groups[key] = (prefs, [])
+        groups[key][1].append(sub)
+    return groups
+
+
+def _run_grouped_digests(app, subscribers, main_aggregator, additional_aggregators, r=None):
+    """
+    Один поиск на группу одинаковых предпочтений (параллельно, не более
+    DIGEST_SEARCH_CONCURRENCY), затем раздача результатов каждому в группе.
+    Письма уходят через пул постоянных SMTP-соединений (SMTPSendPool);
+    запись в БД — в текущем потоке (здесь живёт сессия), пачками через
+    DigestLogBuffer.
+
+    Возвращает {subscriber_id: 'sent' | 'skipped' | 'failed'}.
+    """
+    outcome = {sub.id: 'skipped' for sub in subscribers}
+    groups = _group_by_preferences(subscribers)
+    if not groups:
+        return outcome
+    print(f"🧩 {len(subscribers)} подписчиков → {len(groups)} уникальных поисков")
+
+    def search_group(prefs, ids):
+        def enough_new(jobs):
+            return all(len(digest_seen.filter_unseen(r, sid, jobs)) >= DIGEST_MAX_JOBS for sid in ids)
+
+        return _search_all_sources(main_aggregator, additional_aggregators, prefs, stop_when=enough_new)
+
+    def record(results):
+        for (subscriber, jobs_sent, total_count, lang), ok, error in results:
+            if not ok:
+                outcome[subscriber.id] = 'failed'
+                print(f"   ❌ Не удалось отправить email на {subscriber.email}: {error}")
+                continue
+            # письмо ушло — даже если лог не запишется, повторно не шлём
+            outcome[subscriber.id] = 'sent'
+            try:
+                _record_digest(subscriber, jobs_sent, total_count, lang, r=r, log_buffer=log_buffer)
+                print(f"   ✅ Email успешно отправлен на {subscriber.email}")
+            except Exception as e:
+                print(f"   ❌ Ошибка записи лога для {subscriber.email}: {e}")
+
+    with DigestLogBuffer() as log_buffer, SMTPSendPool(app, r=r) as sender, \
+            ThreadPoolExecutor(max_workers=max(1, DIGEST_SEARCH_CONCURRENCY)) as pool:
+        futures = {
+            pool.submit(search_group, prefs, [m.id for m in members]): key
+            for key, (prefs, members) in groups.items()
+        }
+        for future in as_completed(futures):
+            _, members = groups[futures[future]]
+            try:
+                found_jobs = future.result()
+            except Exception as e:
+                print(f"   ❌ Ошибка поиска для группы из {len(members)}: {e}")
+                for subscriber in members:
+                    outcome[subscriber.id] = 'failed'
+                continue
+
+            for subscriber in members:
+                try:
+                    prepared = _prepare_digest(subscriber, found_jobs, r=r)
+                    if not prepared:
+                        continue
+                    jobs_to_send, total_count = prepared
+                    lang = _get_lang(subscriber)
+                    msg = build_job_email(subscriber, jobs_to_send, _subscriber_preferences(subscriber), lang=lang)
+                    print(f"   📤 В очередь SMTP ({lang}): {subscriber.email}, {len(jobs_to_send)} вакансий")
+                    sender.submit(msg, (subscriber, jobs_to_send, total_count, lang))
+                except Exception as e:
+                    outcome[subscriber.id] = 'failed'
+                    print(f"   ❌ КРИТИЧЕСКАЯ ОШИБКА для {subscriber.email}: {e}")
+            record(sender.drain())
+
+        record(sender.close())
+    # полные описания, накопленные поисками групп, — в Redis одной пачкой
+    flush_descriptions()
+    return outcome
+
+
+def _send_grouped_digests(app, subscribers, main_aggregator, additional_aggregators, r=None):
+    """То же, что _run_grouped_digests, но возвращает число отправленных писем"""
+    outcome = _run_grouped_digests(app, subscribers, main_aggregator, additional_aggregators, r=r)
+    return sum(1 for status in outcome.values() if status == 'sent')
+
+def _redis_client():
+    return connect_redis(decode_responses=True, label='Email', verbose=True)
 
 
 class RedisLock:
@@ -538,6 +695,125 @@ def send_async_email(app, msg):
             return False
 
 
+# -----------------------------------------------------------------------------
+# Пул постоянных SMTP-соединений для пакетных рассылок
+# -----------------------------------------------------------------------------
+
+EMAIL_SMTP_CONNECTIONS = int(os.getenv('EMAIL_SMTP_CONNECTIONS', '3'))
+EMAIL_SEND_RETRIES = int(os.getenv('EMAIL_SEND_RETRIES', '2'))
+
+
+
+def _smtp_transient(e) -> bool:
+    """Обрыв соединения / сеть / 4xx от сервера — имеет смысл переподключиться и повторить"""
+    if isinstance(e, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, smtplib.SMTPHeloError)):
+        return True
+    if isinstance(e, smtplib.SMTPResponseException):
+        return 400 <= e.smtp_code < 500
+    # SMTPException — подкласс OSError, поэтому проверяем его раньше
+    return isinstance(e, OSError) and not isinstance(e, smtplib.SMTPException)
+
+
+class SMTPSendPool:
+    """
+    Несколько потоков, у каждого своё постоянное SMTP-соединение
+    (mail.connect(): TLS и логин — один раз на поток, а не на письмо).
+    Темп задаёт только общий бюджет EMAIL_RPM в Redis (smtp_allow_send).
+    Обрыв соединения — переподключение и повтор этого же письма (повтор тоже
+    берёт токен бюджета); ошибка одного письма на остальные не влияет.
+
+    submit(msg, context) → результаты (context, ok, error) забираются
+    drain()/close() в вызывающем потоке — там же пишем в БД.
+    """
+
+    def __init__(self, app, r=None, size: int = EMAIL_SMTP_CONNECTIONS,
+                 retries: int = EMAIL_SEND_RETRIES):
+        self.app = app
+        self.r = r
+        self.retries = max(0, retries)
+        self._tasks = queue.Queue(maxsize=max(1, size) * 4)
+        self._results = queue.Queue()
+        self._threads = [
+            Thread(target=self._worker, name=f"smtp-pool-{i}", daemon=True)
+            for i in range(max(1, size))
+        ]
+        for t in self._threads:
+            t.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def submit(self, msg, context=None):
+        self._tasks.put((msg, context))
+
+    def drain(self):
+        """Готовые результаты без ожидания"""
+        done = []
+        while True:
+            try:
+                done.append(self._results.get_nowait())
+            except queue.Empty:
+                return done
+
+    def close(self):
+        """Дождаться отправки всего поставленного и закрыть соединения"""
+        if self._threads:
+            for _ in self._threads:
+                self._tasks.put(None)
+            for t in self._threads:
+                t.join()
+            self._threads = []
+        return self.drain()
+
+    def _wait_for_token(self):
+        while not smtp_allow_send(self.r):
+            time.sleep(0.5)
+
+    @staticmethod
+    def _disconnect(conn):
+        if conn is None:
+            return
+        try:
+            if conn.host is not None:
+                conn.host.quit()
+        except Exception:
+            pass
+
+    def _worker(self):
+        with self.app.app_context():
+            conn = None
+            while True:
+                task = self._tasks.get()
+                if task is None:
+                    break
+                msg, context = task
+                error = None
+                for attempt in range(self.retries + 1):
+                    try:
+                        if conn is None:
+                            conn = mail.connect().__enter__()
+                        # токен EMAIL_RPM на каждую попытку, включая повторы после обрыва
+                        self._wait_for_token()
+                        conn.send(msg)
+                        error = None
+                        break
+                    except Exception as e:
+                        error = e
+                        if not _smtp_transient(e):
+                            # адрес отклонён, плохие заголовки — повторять бессмысленно
+                            break
+                        # соединение умерло (таймаут сервера, сеть) — новое и повтор
+                        self._disconnect(conn)
+                        conn = None
+                        if attempt < self.retries:
+                            time.sleep(min(2 ** attempt, 10))
+                self._results.put((context, error is None, error))
+            self._disconnect(conn)
+
+
 # -----------------------------------------------------------------------------
 # Пакетные отправки (ручной запуск / планировщик)
 # -----------------------------------------------------------------------------
@@ -563,24 +839,17 @@ def send_job_notifications(app, main_aggregator, additional_aggregators={}):
             if not subscribers:
                 return 0
 
-            sent_count = 0
-            for i, subscriber in enumerate(subscribers, 1):
-                print(f"\n🔄 ({i}/{len(subscribers)}) Обрабатываем {subscriber.email}...")
-
+            due = []
+            for subscriber in subscribers:
                 # идемпотентность: не шлём повторный дайджест этому подписчику в ту же дату
                 digest_src = f"{subscriber.email}:{datetime.utcnow().date().isoformat()}:manual"
                 digest = hashlib.sha1(digest_src.encode("utf-8")).hexdigest()
                 if r and not r.set(f"sent_digest:{subscriber.id}:{digest}", "1", nx=True, ex=72*3600):
                     print(f"↩️ Пропуск (уже отправлено сегодня): {subscriber.email}")
                     continue
+                due.append(subscriber)
 
-                # rate-limit SMTP
-                while not smtp_allow_send(r):
-                    time.sleep(1)
-
-                if _send_notification_for_subscriber(app, subscriber, main_aggregator, additional_aggregators):
-                    sent_count += 1
-                time.sleep(1)
+            sent_count = _send_grouped_digests(app, due, main_aggregator, additional_aggregators, r=r)
 
             db.session.commit()
             print("=" * 60)
@@ -610,41 +879,66 @@ def run_scheduled_notifications(app, main_aggregator, additional_aggregators):
             print("⛔ Уже идёт рассылка в другом процессе — выходим")
             return
         try:
-            subscribers_to_notify = []
-            all_active_subscribers = Subscriber.query.filter_by(is_active=True).all()
-
-            for sub in all_active_subscribers:
-                if should_send_notification(sub):
-                    subscribers_to_notify.append(sub)
+            # вне окон уходят только первые дайджесты новых подписчиков
+            first_only = not digest_schedule.in_send_window()
+            if first_only:
+                print(f"🌙 ПЛАНИРОВЩИК: вне окон рассылки (часы UTC {digest_schedule.SEND_HOURS}) — только первые дайджесты")
+            capacity = digest_schedule.hourly_capacity(count_due_subscribers(first_only=first_only))
+
+            import email_queue
+            use_queue = email_queue.is_enabled(r)
+            total_due = 0
+            sent_count = 0
 
-            if not subscribers_to_notify:
+            capacity_left = True
+            for batch in iter_due_subscribers(first_only=first_only):
+                due, due_keys = [], []
+                for subscriber in batch:
+                    # идемпотентность per-subscriber на сутки/частоту
+                    digest_src = f"{subscriber.id}:{subscriber.lang}:{subscriber.frequency}:{datetime.utcnow().date().isoformat()}"
+                    digest = hashlib.sha1(digest_src.encode("utf-8")).hexdigest()
+                    key = f"sent_digest:{subscriber.id}:{digest}"
+                    if r and not r.set(key, "1", nx=True, ex=72*3600):
+                        print(f"↩️ Пропуск (уже отправлено сегодня): {subscriber.email}")
+                        continue
+                    due.append(subscriber)
+                    due_keys.append(key)
+
+                # не больше capacity за час; остальные останутся due до следующего часа
+                granted = digest_schedule.reserve_capacity(r, len(due), capacity=capacity)
+                if granted < len(due):
+                    capacity_left = False
+                    if r:
+                        r.delete(*due_keys[granted:])
+                    due = due[:granted]
+                total_due += len(due)
+
+                if use_queue:
+                    # рассылают воркеры (email_worker.py) — здесь только постановка в очередь
+                    email_queue.enqueue_digests(r, [s.id for s in due], kind='scheduled')
+                else:
+                    sent_count += _send_grouped_digests(app, due, main_aggregator, additional_aggregators, r=r)
+                    db.session.commit()
+                db.session.expunge_all()
+                if not capacity_left:
+                    print(f"⏳ ПЛАНИРОВЩИК: лимит {capacity}/час исчерпан — остальные позже")
+                    break
+
+            if not use_queue and digest_schedule.window_hours_left() == 1:
+                # последний час окна: всё, что осталось, перейдёт в следующие сутки
+                left_over = count_due_subscribers()
+                if left_over:
+                    print(f"🚨 ПЛАНИРОВЩИК: окно закрывается, а {left_over} подписчиков так и не получили дайджест")
+
+            if not total_due:
                 print("ℹ️ ПЛАНИРОВЩИК: Нет подписчиков для отправки уведомлений.")
                 return
 
-            print(f"📬 ПЛАНИРОВЩИК: Найдено {len(subscribers_to_notify)} подписчиков для уведомления.")
-
-            sent_count = 0
-            for i, subscriber in enumerate(subscribers_to_notify, 1):
-                print(f"\n🔄 ({i}/{len(subscribers_to_notify)}) Отправка для {subscriber.email}...")
-
-                # идемпотентность per-subscriber на сутки/частоту
-                digest_src = f"{subscriber.id}:{subscriber.lang}:{subscriber.frequency}:{datetime.utcnow().date().isoformat()}"
-                digest = hashlib.sha1(digest_src.encode("utf-8")).hexdigest()
-                if r and not r.set(f"sent_digest:{subscriber.id}:{digest}", "1", nx=True, ex=72*3600):
-                    print(f"↩️ Пропуск (уже отправлено сегодня): {subscriber.email}")
-                    continue
-
-                # rate-limit SMTP
-                while not smtp_allow_send(r):
-                    time.sleep(1)
-
-                if _send_notification_for_subscriber(app, subscriber, main_aggregator, additional_aggregators):
-                    sent_count += 1
-                time.sleep(1)
-
-            db.session.commit()
             print("=" * 60)
-            print(f"🎉 ПЛАНИРОВЩИК ЗАВЕРШЕН: {sent_count}/{len(subscribers_to_notify)} писем отправлено")
+            if use_queue:
+                print(f"📨 ПЛАНИРОВЩИК: {total_due} подписчиков к отправке, дайджесты поставлены в очередь")
+            else:
+                print(f"🎉 ПЛАНИРОВЩИК ЗАВЕРШЕН: {sent_count}/{total_due} писем отправлено")
             print("=" * 60)
         finally:
             try:
@@ -693,6 +987,55 @@ def create_fallback_jobs(preferences):
 # Вспомогательные
 # -----------------------------------------------------------------------------
 
+DUE_BATCH_SIZE = int(os.getenv('DIGEST_DUE_BATCH_SIZE', '500'))
+
+
+def _due_query(frequency=None, now=None, first_only=False):
+    base = Subscriber.query.filter(
+        Subscriber.is_active.is_(True),
+        Subscriber.next_send_at.isnot(None),
+        Subscriber.next_send_at <= (now or datetime.utcnow()),
+    )
+    if frequency:
+        base = base.filter(Subscriber.frequency == frequency)
+    if first_only:
+        base = base.filter(Subscriber.last_sent.is_(None))
+    return base
+
+
+def count_due_subscribers(frequency=None, now=None, first_only=False):
+    """Сколько подписчиков ждут дайджест (для почасового лимита и контроля хвоста)"""
+    return _due_query(frequency, now, first_only).count()
+
+
+def iter_due_subscribers(frequency=None, now=None, batch_size=DUE_BATCH_SIZE, first_only=False):
+    """
+    Подписчики, которым пора слать дайджест (next_send_at <= now), пачками
+    с keyset-пагинацией по (next_send_at, id) — индекс ix_subscriber_active_next_send.
+    first_only — только ещё не получавшие ни одного письма.
+    Вызывать внутри app_context.
+    """
+    base = _due_query(frequency, now, first_only)
+
+    cursor = None
+    while True:
+        q = base
+        if cursor:
+            last_at, last_id = cursor
+            q = q.filter(or_(
+                Subscriber.next_send_at > last_at,
+                and_(Subscriber.next_send_at == last_at, Subscriber.id > last_id),
+            ))
+        batch = q.order_by(Subscriber.next_send_at, Subscriber.id).limit(batch_size).all()
+        if not batch:
+            return
+        # курсор запоминаем до обработки: после отправки next_send_at уедет в будущее
+        cursor = (batch[-1].next_send_at, batch[-1].id)
+        yield batch
+        if len(batch) < batch_size:
+            return
+
+
 def should_send_notification(subscriber):
     """Нужно ли отправлять уведомление по частоте."""
     if not subscriber.last_sent:
@@ -720,21 +1063,24 @@ def _digest_subject(lang, total_count):
 # Основные отправки (локализованные)
 # -----------------------------------------------------------------------------
 
+def build_job_email(subscriber, jobs, preferences, lang=None):
+    """Письмо-дайджест (Message) без отправки — для пакетной отправки через пул."""
+    lang = lang or _get_lang(subscriber)
+    return Message(
+        subject=_digest_subject(lang, len(jobs)),
+        sender=os.getenv('MAIL_DEFAULT_SENDER'),
+        recipients=[subscriber.email],
+        html=generate_email_html(subscriber, jobs, preferences, lang=lang)
+    )
+
+
 def send_job_email(app, subscriber, jobs, preferences, lang=None):
     """Отправка email с вакансиями (локализовано)."""
     try:
         lang = lang or _get_lang(subscriber)
         print(f"📤 Отправляем email на {subscriber.email} ({lang}) с {len(jobs)} вакансиями")
 
-        html_content = generate_email_html(subscriber, jobs, preferences, lang=lang)
-        subject = _digest_subject(lang, len(jobs))
-
-        msg = Message(
-            subject=subject,
-            sender=os.getenv('MAIL_DEFAULT_SENDER'),
-            recipients=[subscriber.email],
-            html=html_content
-        )
+        msg = build_job_email(subscriber, jobs, preferences, lang=lang)
 
         with app.app_context():
             mail.send(msg)
@@ -746,6 +1092,70 @@ def send_job_email(app, subscriber, jobs, preferences, lang=None):
         return False
 
 
+# -----------------------------------------------------------------------------
+# Рендер дайджеста: Jinja-шаблоны templates/email/ + кеш карточек вакансий
+# -----------------------------------------------------------------------------
+
+_EMAIL_ENV = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'email')),
+    autoescape=jinja2.select_autoescape(['html']),
+    auto_reload=False,      # шаблоны компилируются один раз на процесс
+)
+
+_EMAIL_LABEL_KEYS = (
+    'app_name', 'digest_intro', 'pref_professions', 'pref_countries', 'pref_city', 'digest_all_jobs',
+    'badge_refugee', 'badge_no_lang', 'btn_apply', 'auto_notice', 'manage', 'unsubscribe',
+)
+_EMAIL_LABELS = {}
+
+CARD_CACHE_SIZE = int(os.getenv('EMAIL_CARD_CACHE_SIZE', '5000'))
+_card_cache = OrderedDict()
+_card_lock = Lock()
+
+
+def _email_labels(lang):
+    labels = _EMAIL_LABELS.get(lang)
+    if labels is None:
+        labels = {key: _tr(lang, key) for key in _EMAIL_LABEL_KEYS}
+        _EMAIL_LABELS[lang] = labels
+    return labels
+
+
+def _render_job_card(job, lang):
+    """
+    HTML карточки вакансии. Одна и та же вакансия на одном языке приходит
+    многим подписчикам — рендерим её один раз и берём из кеша.
+    """
+    title = getattr(job, 'title', '')
+    company = getattr(job, 'company', '')
+    location = getattr(job, 'location', '')
+    apply_url = getattr(job, 'apply_url', '')
+    salary = getattr(job, 'salary', None)
+    refugee = bool(getattr(job, 'refugee_friendly', False))
+    no_lang = getattr(job, 'language_requirement', '') == 'no_language_required'
+
+    key = (lang, title, company, location, apply_url, salary, refugee, no_lang)
+    with _card_lock:
+        card = _card_cache.get(key)
+        if card is not None:
+            _card_cache.move_to_end(key)
+            return card
+
+    # Нормализуем/локализуем "Удаленно"
+    if location and ('Удаленно' in location or location.strip().lower().startswith('remote')):
+        location = f"Remote ({_front_tr(lang, 'Удаленно')})"
+
+    card = Markup(_EMAIL_ENV.get_template('job_card.html').render(
+        t=_email_labels(lang), title=title, company=company, location=location,
+        salary=salary, refugee=refugee, no_lang=no_lang, apply_url=apply_url,
+    ))
+    with _card_lock:
+        _card_cache[key] = card
+        while len(_card_cache) > CARD_CACHE_SIZE:
+            _card_cache.popitem(last=False)
+    return card
+
+
 def generate_email_html(subscriber, jobs, preferences, lang='ru'):
     """Генерация HTML (локализовано)."""
     total_jobs = len(jobs)
@@ -756,119 +1166,34 @@ def generate_email_html(subscriber, jobs, preferences, lang='ru'):
         country = getattr(job, 'country', getattr(job, 'location', '')) or ''
         jobs_by_country.setdefault(country, []).append(job)
 
-    vac_short = _vacancy_forms(lang, total_jobs, long=False)
-    jobs_title = _tr(lang, "digest_title", n=total_jobs, vac_short=vac_short)
+    country_blocks = [
+        {
+            'name': country,  # или _front_tr(lang, country), если сделаешь словарь стран
+            'count': len(country_jobs),
+            'vac_short': _vacancy_forms(lang, len(country_jobs), long=False),
+            'cards': [_render_job_card(job, lang) for job in country_jobs],
+        }
+        for country, country_jobs in jobs_by_country.items()
+    ]
 
+    vac_short = _vacancy_forms(lang, total_jobs, long=False)
     base_url = os.getenv('BASE_URL', 'http://localhost:5000')
-    manage_url = f"{base_url}/subscription/manage?email={subscriber.email}"
-    unsub_url = f"{base_url}/unsubscribe?email={subscriber.email}"
-
 
     # --- ЛОКАЛИЗАЦИЯ СПИСКА ПРОФЕССИЙ В ШАПКЕ ДАЙДЖЕСТА ---
     jobs_src = (preferences.get('selected_jobs') or [])
-    jobs_disp = ', '.join(_front_tr(lang, j) for j in jobs_src[:3])
-    li_prof  = f"<li><strong>{_tr(lang, 'pref_professions')}:</strong> {jobs_disp}{'...' if len(jobs_src) > 3 else ''}</li>"
-    # ------------------------------------------------------
-
-    # HTML
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="utf-8">
-        <title>{I18N[lang]['app_name']}</title>
-        <style>
-            body {{ font-family: Arial, sans-serif; margin: 0; padding: 20px; background-color: #f8f9fa; }}
-            .container {{ max-width: 680px; margin: 0 auto; background: white; border-radius: 12px; overflow: hidden; }}
-            .header {{ background: #0057B7; color: white; padding: 28px 20px; text-align: center; }}
-            .content {{ padding: 20px; }}
-            .job-card {{ border: 1px solid #e5e7eb; border-radius: 10px; padding: 14px; margin: 14px 0; }}
-            .job-title {{ font-weight: bold; color: #0d47a1; font-size: 16px; }}
-            .job-company {{ color: #6b7280; margin: 5px 0; }}
-            .job-location {{ color: #1b5e20; font-size: 14px; }}
-            .country-header {{ background: #eff6ff; padding: 12px 14px; margin: 20px 0 8px 0; border-radius: 8px; font-weight: bold; }}
-            .footer {{ background: #f8f9fa; padding: 18px; text-align: center; font-size: 12px; color: #6b7280; }}
-            .btn {{ background: #0057B7; color: white !important; padding: 10px 18px; text-decoration: none; border-radius: 6px; display: inline-block; }}
-            .badge {{ display:inline-block; margin-right:6px; padding:2px 8px; border-radius:10px; font-size:11px; color:#fff; }}
-            .bg-green {{ background:#28a745; }}
-            .bg-cyan {{ background:#17a2b8; }}
-            ul.inline li {{ margin-bottom: 4px; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1>🌍 {I18N[lang]['app_name']}</h1>
-                <p>📍 {jobs_title}</p>
-            </div>
-
-            <div class="content">
-                <p>{_tr(lang, "digest_intro")}</p>
-                <ul class="inline">
-                    {li_prof}
-                    <li><strong>{_tr(lang, "pref_countries")}:</strong> {', '.join(preferences['countries'])}</li>
-                    {f"<li><strong>{_tr(lang, 'pref_city')}:</strong> {preferences['cities'][0]}</li>" if preferences.get('cities') else ''}
-                </ul>
 
-
-                <h3>{_tr(lang, "digest_all_jobs")}</h3>
-    """
-
-    # Страны
-    for country, country_jobs in jobs_by_country.items():
-        vac_short_c = _vacancy_forms(lang, len(country_jobs), long=False)
-        country_disp = country  # или _front_tr(lang, country), если сделаешь словарь стран
-        html += f'<div class="country-header">{country_disp} ({len(country_jobs)} {vac_short_c})</div>'
-
-
-        for job in country_jobs:
-            title = getattr(job, 'title', '')
-            company = getattr(job, 'company', '')
-            location = getattr(job, 'location', '')
-            # Нормализуем/локализуем "Удаленно"
-            if location and ('Удаленно' in location or location.strip().lower().startswith('remote')):
-                location = f"Remote ({_front_tr(lang, 'Удаленно')})"
-
-            apply_url = getattr(job, 'apply_url', '')
-            salary = getattr(job, 'salary', None)
-            refugee = getattr(job, 'refugee_friendly', False)
-            no_lang = getattr(job, 'language_requirement', '') == 'no_language_required'
-
-            salary_html = f"<br><strong>💰 {salary}</strong>" if salary else ""
-            badges = ""
-            if refugee:
-                badges += f'<span class="badge bg-green">{_tr(lang, "badge_refugee")}</span>'
-            if no_lang:
-                badges += f'<span class="badge bg-cyan">{_tr(lang, "badge_no_lang")}</span>'
-
-            html += f"""
-            <div class="job-card">
-                <div class="job-title">{title}</div>
-                <div class="job-company">🏢 {company}</div>
-                <div class="job-location">📍 {location}</div>
-                {salary_html}
-                <div style="margin: 10px 0;">{badges}</div>
-                <a href="{apply_url}" class="btn" target="_blank" style="color: white !important; text-decoration: none;">{_tr(lang, "btn_apply")}</a>
-            </div>
-            """
-
-    year = datetime.now().year
-    html += f"""
-            </div>
-
-            <div class="footer">
-                <p>{_tr(lang, "auto_notice")}</p>
-                <p>
-                    <a href="{manage_url}">{_tr(lang, "manage")}</a> |
-                    <a href="{unsub_url}">{_tr(lang, "unsubscribe")}</a>
-                </p>
-                <p>{_tr(lang, "copyright", year=year)}</p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-    return html
+    return _EMAIL_ENV.get_template('digest.html').render(
+        t=_email_labels(lang),
+        jobs_title=_tr(lang, "digest_title", n=total_jobs, vac_short=vac_short),
+        professions=', '.join(_front_tr(lang, j) for j in jobs_src[:3]),
+        professions_more=len(jobs_src) > 3,
+        countries=', '.join(preferences['countries']),
+        city=(preferences.get('cities') or [None])[0],
+        country_blocks=country_blocks,
+        manage_url=f"{base_url}/subscription/manage?email={subscriber.email}",
+        unsub_url=f"{base_url}/unsubscribe?email={subscriber.email}",
+        copyright=_tr(lang, "copyright", year=datetime.now().year),
+    )
 
 
 def send_welcome_email(app, email, lang=None, *_, **__):
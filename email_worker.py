@@ -1,6 +1,17 @@
 # email_worker.py
+import sys
+from threading import Thread
+
 from app import app, aggregator, additional_aggregators, email_scheduler
+from email_queue import consume_forever
 
 if __name__ == '__main__':
-    print("⏰ Email worker: запускаю планировщик рассылки")
-    email_scheduler(app, aggregator, additional_aggregators)
+    # --no-scheduler: только обработка очереди (для дополнительных воркеров)
+    scheduler = None
+    if '--no-scheduler' not in sys.argv:
+        print("⏰ Email worker: запускаю планировщик рассылки")
+        scheduler = Thread(target=email_scheduler, args=(app, aggregator, additional_aggregators), daemon=True)
+        scheduler.start()
+    consume_forever(app, aggregator, additional_aggregators)
+    if scheduler:
+        scheduler.join()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Локальная геолокация IP для аналитики кликов.
+
+Раньше на каждый клик ходили в ipapi.co (до 1.8 с, без кеша). Теперь:
+  • база диапазонов IP грузится один раз в отсортированные массивы
+    (начала/концы диапазонов) — поиск бинарный (bisect), микросекунды;
+  • формат — CSV (в т.ч. .csv.gz) из GEOIP_DB_PATH: IP-адреса строками
+    или целыми числами, порядок колонок задаёт GEOIP_CSV_COLUMNS
+    (по умолчанию 'start,end,country'; для DB-IP City Lite —
+    'start,end,continent,country,region,city,lat,lon');
+    .mmdb читается через пакет maxminddb, если он установлен;
+  • сверху — LRU по IP; HTTP-сервис остаётся запасным вариантом
+    (GEOIP_HTTP_FALLBACK=1 по умолчанию, если локальной базы нет).
+"""
+
+import csv
+import gzip
+import ipaddress
+import os
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import maxminddb
+except ImportError:
+    maxminddb = None
+
+GEOIP_DB_PATH = os.getenv('GEOIP_DB_PATH', '')
+GEOIP_CSV_COLUMNS = [c.strip() for c in os.getenv('GEOIP_CSV_COLUMNS', 'start,end,country').split(',')]
+GEOIP_CACHE_SIZE = int(os.getenv('GEOIP_CACHE_SIZE', '20000'))
+_fallback_env = os.getenv('GEOIP_HTTP_FALLBACK')
+
+Geo = Dict[str, Optional[object]]
+
+
+def _to_int(value: str) -> Optional[Tuple[int, int]]:
+    """(версия IP, число) из '1.2.3.4' / '2001:db8::1' / '16909060'"""
+    value = (value or '').strip()
+    if not value:
+        return None
+    try:
+        if value.isdigit():
+            n = int(value)
+            return (4 if n < 2 ** 32 else 6), n
+        addr = ipaddress.ip_address(value)
+        return addr.version, int(addr)
+    except ValueError:
+        return None
+
+
+def _float(value) -> Optional[float]:
+    try:
+        return float(value) or None
+    except (TypeError, ValueError):
+        return None
+
+
+class RangeIndex:
+    """Непересекающиеся диапазоны [start, end] → запись; поиск bisect по началам"""
+
+    def __init__(self):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        self.values: List[int] = []          # индекс в self.records
+        self.records: List[Geo] = []
+
+    def build(self, rows: List[Tuple[int, int, Geo]]):
+        rows.sort(key=lambda item: item[0])
+        interned: Dict[tuple, int] = {}
+        for start, end, geo in rows:
+            key = (geo.get('country'), geo.get('city'), geo.get('lat'), geo.get('lon'))
+            idx = interned.get(key)
+            if idx is None:
+                idx = interned[key] = len(self.records)
+                self.records.append(geo)
+            self.starts.append(start)
+            self.ends.append(end)
+            self.values.append(idx)
+
+    def find(self, n: int) -> Optional[Geo]:
+        i = bisect_right(self.starts, n) - 1
+        if i >= 0 and n <= self.ends[i]:
+            return self.records[self.values[i]]
+        return None
+
+    def __len__(self):
+        return len(self.starts)
+
+
+class GeoIPResolver:
+    def __init__(self, path: str = GEOIP_DB_PATH, cache_size: int = GEOIP_CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        self._v4 = RangeIndex()
+        self._v6 = RangeIndex()
+        self._mmdb = None
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        self._cache: "OrderedDict[str, Optional[Geo]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    @property
+    def has_local_db(self) -> bool:
+        self._ensure_loaded()
+        return bool(self._mmdb or len(self._v4) or len(self._v6))
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            try:
+                if self.path and os.path.exists(self.path):
+                    if self.path.endswith('.mmdb'):
+                        self._load_mmdb()
+                    else:
+                        self._load_csv()
+                elif self.path:
+                    print(f"⚠️ GeoIP: файл {self.path} не найден")
+            except Exception as e:
+                print(f"⚠️ GeoIP: не удалось загрузить базу {self.path}: {e}")
+            self._loaded = True
+
+    def _load_mmdb(self):
+        if not maxminddb:
+            print("⚠️ GeoIP: для .mmdb нужен пакет maxminddb")
+            return
+        self._mmdb = maxminddb.open_database(self.path)
+        print(f"✅ GeoIP: MMDB {self.path}")
+
+    def _load_csv(self):
+        opener = gzip.open if self.path.endswith('.gz') else open
+        cols = {name: i for i, name in enumerate(GEOIP_CSV_COLUMNS)}
+        rows4, rows6 = [], []
+        with opener(self.path, 'rt', encoding='utf-8', newline='') as fh:
+            for row in csv.reader(fh):
+                try:
+                    start = _to_int(row[cols['start']])
+                    end = _to_int(row[cols['end']])
+                except (IndexError, KeyError):
+                    continue
+                if not start or not end or start[0] != end[0]:
+                    continue   # заголовок / битая строка
+
+                def col(name):
+                    i = cols.get(name)
+                    return row[i].strip() if i is not None and i < len(row) else None
+
+                country = (col('country') or '').upper()[:2] or None
+                if country == '-' or country == 'ZZ':
+                    country = None
+                geo = {'country': country, 'city': col('city') or None,
+                       'lat': _float(col('lat')), 'lon': _float(col('lon'))}
+                (rows4 if start[0] == 4 else rows6).append((start[1], end[1], geo))
+        self._v4.build(rows4)
+        self._v6.build(rows6)
+        print(f"✅ GeoIP: загружено диапазонов IPv4 {len(self._v4)}, IPv6 {len(self._v6)} из {self.path}")
+
+    def _local(self, addr) -> Optional[Geo]:
+        if self._mmdb:
+            rec = self._mmdb.get(str(addr)) or {}
+            country = ((rec.get('country') or {}).get('iso_code') or '').upper() or None
+            city = ((rec.get('city') or {}).get('names') or {}).get('en')
+            loc = rec.get('location') or {}
+            if not (country or city):
+                return None
+            return {'country': country, 'city': city,
+                    'lat': _float(loc.get('latitude')), 'lon': _float(loc.get('longitude'))}
+        index = self._v4 if addr.version == 4 else self._v6
+        return index.find(int(addr))
+
+    def lookup(self, ip: str, http_fallback: Optional[Callable[[str], Optional[Geo]]] = None) -> Optional[Geo]:
+        """{'country','city','lat','lon'} или None; приватные/локальные адреса — None"""
+        try:
+            addr = ipaddress.ip_address((ip or '').strip())
+        except ValueError:
+            return None
+        if not addr.is_global:
+            return None
+        key = str(addr)
+
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        self._ensure_loaded()
+        geo = self._local(addr)
+        use_http = (_fallback_env == '1') if _fallback_env is not None else not self.has_local_db
+        if geo is None and http_fallback and use_http:
+            geo = http_fallback(key)
+            if geo is None:
+                return None        # сбой сервиса не кешируем — попробуем в следующий раз
+
+        with self._cache_lock:
+            self._cache[key] = geo
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return geo
+
+
+resolver = GeoIPResolver()
+
+
+def lookup(ip: str, http_fallback: Optional[Callable[[str], Optional[Geo]]] = None) -> Optional[Geo]:
+    return resolver.lookup(ip, http_fallback=http_fallback)
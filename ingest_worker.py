@@ -0,0 +1,7 @@
+# ingest_worker.py
+from app import app, aggregator, additional_aggregators
+from job_ingest import ingestion_scheduler
+
+if __name__ == '__main__':
+    print("🕷 Ingest worker: запускаю фоновый обход срезов вакансий")
+    ingestion_scheduler(aggregator, additional_aggregators)
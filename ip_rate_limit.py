@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Скользящее окно лимита поисков по IP.
+
+Раньше check_rate_limit на каждый /search читал и переписывал целиком
+rate_limits.json (все IP, разбор каждой даты) — миллисекунды диска на
+запрос и гонки между воркерами. Теперь:
+  • Redis: на IP — sorted set с отметками времени запросов; очистка
+    старых, подсчёт, добавление и TTL делает один Lua-скрипт (один вызов);
+  • без Redis или при его сбое — то же окно в памяти процесса;
+  • RATE_LIMIT_BACKEND=redis|memory, RATE_LIMIT_ENFORCE=1 — отказывать
+    с 429 (по умолчанию только считаем: суточный лимит сейчас выключен);
+  • результат отдаётся заголовками X-RateLimit-Limit/Remaining/Reset.
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Deque, Dict, NamedTuple, Optional
+
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'redis').lower()
+RATE_LIMIT_ENFORCE = os.getenv('RATE_LIMIT_ENFORCE', '0') == '1'
+RATE_LIMIT_MEMORY_MAX_KEYS = int(os.getenv('RATE_LIMIT_MEMORY_MAX_KEYS', '50000'))
+
+# KEYS[1] — ключ IP; ARGV: сейчас (мс), окно (мс), лимит, id запроса, отказывать ли (1/0)
+_SLIDING_WINDOW_LUA = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+local count = redis.call('ZCARD', key)
+local allowed = 1
+if count >= limit and ARGV[5] == '1' then
+    allowed = 0
+else
+    redis.call('ZADD', key, now, ARGV[4])
+    count = count + 1
+end
+redis.call('PEXPIRE', key, window)
+local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+return {allowed, count, oldest[2] or tostring(now)}
+"""
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_at: int          # unix-время, когда освободится место в окне
+    count: int
+
+    def headers(self) -> Dict[str, str]:
+        out = {
+            'X-RateLimit-Limit': str(self.limit),
+            'X-RateLimit-Remaining': str(self.remaining),
+            'X-RateLimit-Reset': str(self.reset_at),
+        }
+        if not self.allowed:
+            out['Retry-After'] = str(max(1, self.reset_at - int(time.time())))
+        return out
+
+
+class SlidingWindowLimiter:
+    def __init__(self, redis_client=None, limit: int = 5, window_seconds: int = 86400,
+                 prefix: str = 'ratelimit:search', enforce: bool = RATE_LIMIT_ENFORCE,
+                 backend: str = RATE_LIMIT_BACKEND):
+        self.limit = limit
+        self.window_ms = window_seconds * 1000
+        self.prefix = prefix
+        self.enforce = enforce
+        self.redis = redis_client if backend == 'redis' else None
+        self._script = None
+        self._local: "OrderedDict[str, Deque[int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, ip: str) -> str:
+        return f"{self.prefix}:{ip}"
+
+    def _result(self, allowed: bool, count: int, oldest_ms: int) -> RateLimitResult:
+        return RateLimitResult(
+            allowed=allowed,
+            limit=self.limit,
+            remaining=max(0, self.limit - count),
+            reset_at=int((oldest_ms + self.window_ms) / 1000),
+            count=count,
+        )
+
+    def _hit_redis(self, ip: str, now_ms: int) -> RateLimitResult:
+        if self._script is None:
+            self._script = self.redis.register_script(_SLIDING_WINDOW_LUA)
+        # уникальный член: два запроса в одну миллисекунду не склеиваются
+        member = f"{now_ms}-{uuid.uuid4().hex[:8]}"
+        allowed, count, oldest = self._script(
+            keys=[self._key(ip)],
+            args=[now_ms, self.window_ms, self.limit, member, '1' if self.enforce else '0'],
+        )
+        return self._result(bool(int(allowed)), int(count), int(float(oldest)))
+
+    def _hit_memory(self, ip: str, now_ms: int) -> RateLimitResult:
+        with self._lock:
+            hits = self._local.get(ip)
+            if hits is None:
+                hits = self._local[ip] = deque()
+                while len(self._local) > RATE_LIMIT_MEMORY_MAX_KEYS:
+                    self._local.popitem(last=False)
+            else:
+                self._local.move_to_end(ip)
+            edge = now_ms - self.window_ms
+            while hits and hits[0] <= edge:
+                hits.popleft()
+            allowed = not (self.enforce and len(hits) >= self.limit)
+            if allowed:
+                hits.append(now_ms)
+            return self._result(allowed, len(hits), hits[0] if hits else now_ms)
+
+    def hit(self, ip: str, now: Optional[float] = None) -> RateLimitResult:
+        """Учесть запрос с этого IP и сказать, укладывается ли он в лимит"""
+        now_ms = int((now if now is not None else time.time()) * 1000)
+        ip = (ip or 'unknown').strip()
+        if self.redis is not None:
+            try:
+                return self._hit_redis(ip, now_ms)
+            except Exception as e:
+                print(f"⚠️ RateLimit: Redis недоступен ({e}), считаем в памяти")
+        return self._hit_memory(ip, now_ms)
+
+    def reset(self) -> int:
+        """Сбросить все счётчики (reset_limits.py); возвращает число удалённых ключей Redis"""
+        with self._lock:
+            self._local.clear()
+        deleted = 0
+        if self.redis is not None:
+            for key in self.redis.scan_iter(match=f"{self.prefix}:*", count=1000):
+                deleted += self.redis.delete(key)
+        return deleted
+
+
+def client_ip(request) -> str:
+    """
+    IP клиента. remote_addr уже исправлен ProxyFix (x_for=1 — адрес, добавленный
+    нашим прокси), в отличие от первого элемента X-Forwarded-For, который
+    клиент может подставить сам и обойти лимит.
+    """
+    return request.remote_addr or 'unknown'
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Единый классификатор вакансий: языковые требования + дружелюбность к беженцам.
+Один проход по тексту вакансии → оба флага сразу. Используется всеми агрегаторами.
+"""
+
+import re
+from typing import Tuple
+
+# Индикаторы «можно без языка» (ищем в title + description)
+NO_LANGUAGE_INDICATORS = (
+    'no language', 'без языка', 'physical', 'physical work', 'manual work',
+    'driver', 'delivery', 'warehouse', 'cleaning', 'kitchen',
+)
+
+# Индикаторы «для беженцев» (ищем в title + description + search_term)
+REFUGEE_INDICATORS = (
+    # Английский
+    'refugee', 'ukrainian', 'ukraine', 'asylum', 'integration',
+    'newcomer', 'immigrant', 'migration', 'no language required',
+    # Немецкий
+    'ukrainisch willkommen', 'flüchtling willkommen', 'ohne deutschkenntnisse', 'arbeit ohne sprache',
+    # Украинский / русский
+    'українським біженцям', 'українці вітаються', 'без знання мови',
+    'для беженцев', 'украинцам рады', 'без знания языка',
+    # Польский
+    'ukraińców mile widziane', 'bez znajomości języka',
+    # Чешский
+    'ukrajinci vítáni', 'bez znalosti jazyka',
+)
+
+_NO_LANGUAGE = 1
+_REFUGEE = 2
+_BOTH = _NO_LANGUAGE | _REFUGEE
+
+
+def _build_index():
+    """
+    Индикатор -> битовая маска категорий. Если один индикатор содержит другой
+    ('no language required' ⊃ 'no language'), маски объединяются — так
+    «самое длинное совпадение» в регулярке не теряет более короткую категорию.
+    """
+    masks = {}
+    for ind in NO_LANGUAGE_INDICATORS:
+        masks[ind] = masks.get(ind, 0) | _NO_LANGUAGE
+    for ind in REFUGEE_INDICATORS:
+        masks[ind] = masks.get(ind, 0) | _REFUGEE
+
+    merged = {}
+    for ind, mask in masks.items():
+        for other, other_mask in masks.items():
+            if other != ind and other in ind:
+                mask |= other_mask
+        merged[ind] = mask
+
+    # Длинные варианты первыми: альтернация в re — leftmost-first
+    alternatives = sorted(merged, key=len, reverse=True)
+    pattern = re.compile('|'.join(re.escape(a) for a in alternatives))
+    return pattern, merged
+
+
+_PATTERN, _MASKS = _build_index()
+
+
+def classify_job(title: str, description: str, search_term: str = '') -> Tuple[str, bool]:
+    """
+    Возвращает (language_requirement, refugee_friendly) за один проход по тексту.
+    search_term учитывается только для флага беженцев (как и раньше).
+    """
+    body = f"{title or ''} {description or ''}".lower()
+    text = f"{body} {search_term.lower()}" if search_term else body
+    body_len = len(body)
+
+    found = 0
+    for m in _PATTERN.finditer(text):
+        mask = _MASKS[m.group(0)]
+        if m.start() >= body_len:
+            # совпадение целиком в search_term → влияет только на «беженцев»
+            mask &= _REFUGEE
+        found |= mask
+        if found == _BOTH:
+            break
+
+    language = "no_language_required" if found & _NO_LANGUAGE else "unknown"
+    return language, bool(found & _REFUGEE)
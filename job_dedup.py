@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Межисточниковая дедупликация «почти одинаковых» вакансий.
+
+Одна и та же вакансия приходит через Adzuna и Careerjet с разными URL и
+чуть разными заголовками — дедуп по apply_url её не ловит. Здесь:
+  • 64-битный SimHash по нормализованным title / company / location / описанию (шинглы);
+  • LSH-индекс: отпечаток режется на (max_distance + 1) полос, по принципу
+    Дирихле хотя бы одна полоса у близких отпечатков совпадает точно → кандидаты
+    ищутся по словарям полос, без попарного сравнения со всеми;
+  • при совпадении оставляем лучшую запись и доливаем в неё недостающие поля.
+
+Работает и с JobVacancy, и с dict (снапшоты результатов).
+"""
+
+import hashlib
+import os
+import re
+from typing import Dict, Hashable, List, Optional
+
+MAX_DISTANCE = int(os.getenv('JOB_DEDUP_MAX_DISTANCE', '3'))
+DESCRIPTION_TOKENS = 200   # первых слов описания достаточно для отпечатка
+SHINGLE_SIZE = 3
+
+_TAG_RE = re.compile(r'<[^>]+>')
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _get(job, field, default=None):
+    if isinstance(job, dict):
+        return job.get(field, default)
+    return getattr(job, field, default)
+
+
+def _set(job, field, value):
+    if isinstance(job, dict):
+        job[field] = value
+    else:
+        setattr(job, field, value)
+
+
+def _tokens(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return _WORD_RE.findall(_TAG_RE.sub(' ', str(text)).lower())
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def fingerprint(job) -> int:
+    """64-битный SimHash вакансии (заголовок и компания весят больше описания)"""
+    weights: Dict[str, int] = {}
+
+    def add(feature: str, weight: int):
+        weights[feature] = weights.get(feature, 0) + weight
+
+    for tok in _tokens(_get(job, 'title')):
+        add('t:' + tok, 4)
+    for tok in _tokens(_get(job, 'company')):
+        add('c:' + tok, 3)
+    # Страну не сравниваем напрямую: источники пишут её по-разному
+    # («Германия» / «Germany»), локация входит в отпечаток
+    for tok in _tokens(_get(job, 'location')):
+        add('l:' + tok, 2)
+
+    words = _tokens(_get(job, 'description'))[:DESCRIPTION_TOKENS]
+    if len(words) >= SHINGLE_SIZE:
+        for i in range(len(words) - SHINGLE_SIZE + 1):
+            add('d:' + ' '.join(words[i:i + SHINGLE_SIZE]), 1)
+    else:
+        for tok in words:
+            add('d:' + tok, 1)
+
+    if not weights:
+        return 0
+
+    # Взвешенное голосование по битам: каждый хэш как строка из 64 бит,
+    # повторённая weight раз; столбцы считаем через zip (быстро, на стороне C)
+    rows = []
+    for feature, weight in weights.items():
+        rows.extend([format(_feature_hash(feature), '064b')] * weight)
+    half = len(rows) / 2
+
+    fp = 0
+    for column in zip(*rows):
+        fp = (fp << 1) | (1 if column.count('1') > half else 0)
+    return fp
+
+
+def _quality(job):
+    """Чем больше — тем «лучше» запись: зарплата, длина описания, флаги"""
+    return (
+        1 if _get(job, 'salary') else 0,
+        len(_get(job, 'description') or ''),
+        1 if _get(job, 'refugee_friendly') else 0,
+        1 if _get(job, 'language_requirement') == 'no_language_required' else 0,
+    )
+
+
+def merge_into(primary, other):
+    """Доливает в primary то, чего в нём нет, из дубля other"""
+    if not _get(primary, 'salary') and _get(other, 'salary'):
+        _set(primary, 'salary', _get(other, 'salary'))
+    if len(_get(other, 'description') or '') > len(_get(primary, 'description') or ''):
+        _set(primary, 'description', _get(other, 'description'))
+    if _get(other, 'refugee_friendly') and not _get(primary, 'refugee_friendly'):
+        _set(primary, 'refugee_friendly', True)
+    if (_get(other, 'language_requirement') == 'no_language_required'
+            and _get(primary, 'language_requirement') != 'no_language_required'):
+        _set(primary, 'language_requirement', 'no_language_required')
+    if not _get(primary, 'job_type') and _get(other, 'job_type'):
+        _set(primary, 'job_type', _get(other, 'job_type'))
+    return primary
+
+
+class NearDuplicateIndex:
+    """LSH-индекс SimHash-отпечатков: key -> fingerprint"""
+
+    def __init__(self, max_distance: int = MAX_DISTANCE):
+        self.max_distance = max(0, max_distance)
+        self.bands = self.max_distance + 1
+        self.band_bits = 64 // self.bands
+        self._mask = (1 << self.band_bits) - 1
+        self._buckets: List[Dict[int, List[Hashable]]] = [{} for _ in range(self.bands)]
+        self._entries: Dict[Hashable, int] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _band_values(self, fp: int):
+        for b in range(self.bands):
+            yield b, (fp >> (b * self.band_bits)) & self._mask
+
+    def find(self, job, fp: Optional[int] = None) -> Optional[Hashable]:
+        """Ключ уже проиндексированного дубля или None"""
+        if fp is None:
+            fp = fingerprint(job)
+        checked = set()
+        for b, value in self._band_values(fp):
+            for key in self._buckets[b].get(value, ()):
+                if key in checked:
+                    continue
+                checked.add(key)
+                if bin(fp ^ self._entries[key]).count('1') <= self.max_distance:
+                    return key
+        return None
+
+    def add(self, key: Hashable, job, fp: Optional[int] = None):
+        if fp is None:
+            fp = fingerprint(job)
+        self._entries[key] = fp
+        for b, value in self._band_values(fp):
+            self._buckets[b].setdefault(value, []).append(key)
+
+
+def dedupe_jobs(jobs: List, max_distance: int = MAX_DISTANCE) -> List:
+    """Схлопывает почти-дубли в списке, сохраняя порядок первого появления"""
+    index = NearDuplicateIndex(max_distance)
+    kept: List = []
+    for job in jobs:
+        fp = fingerprint(job)
+        slot = index.find(job, fp)
+        if slot is None:
+            index.add(len(kept), job, fp)
+            kept.append(job)
+            continue
+        current = kept[slot]
+        if _quality(job) > _quality(current):
+            kept[slot] = merge_into(job, current)
+        else:
+            merge_into(current, job)
+    return kept
+
+
+def add_to_job_map(job_map: Dict[str, dict], index: NearDuplicateIndex, job: dict) -> Optional[str]:
+    """
+    Потоковое добавление в снапшот {id: job_dict}. Дубль вливается в уже
+    сохранённую запись (ключ не меняется). Возвращает ключ записи, которая
+    добавлена или изменена; None — если вакансия уже была.
+    """
+    jid = job.get('id')
+    if not jid or jid in job_map:
+        return None
+    fp = fingerprint(job)
+    existing = index.find(job, fp)
+    if existing is not None and existing in job_map:
+        merge_into(job_map[existing], job)
+        return existing
+    job_map[jid] = job
+    index.add(jid, job, fp)
+    return jid
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Локальный индекс вакансий поверх общего SQLAlchemy `db`.
+
+Агрегаторы складывают сюда всё, что получили от партнёрских API, а поиск
+сначала отвечает из индекса и ходит в API только за «протухшими» срезами
+(source, страна, город, терм). Свежий срез отдаёт ровно те вакансии и в том
+порядке, что пришли из API при его обновлении (job_index_slice_job).
+
+Полнотекстового индекса нет: поиск читает срез по точному ключу, а
+поддерживать tsvector/FTS5 на каждой записи без читателя незачем.
+
+Пока не вызван init_job_index(app), все функции — безопасные no-op.
+"""
+
+import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import inspect, text
+
+from base_aggregator import JobVacancy
+from database import db
+
+JOB_INDEX_ENABLED = os.getenv('JOB_INDEX_ENABLED', '1') == '1'
+SLICE_TTL_HOURS = int(os.getenv('JOB_INDEX_SLICE_TTL_HOURS', os.getenv('CACHE_TTL_HOURS', '24')))
+KEEP_HOURS = int(os.getenv('JOB_INDEX_KEEP_HOURS', '72'))       # старше — не отдаём из индекса
+
+_app = None
+
+
+# --- МОДЕЛИ ------------------------------------------------------------------
+
+class IndexedJob(db.Model):
+    __tablename__ = "indexed_job"
+    id = db.Column(db.String(160), primary_key=True)        # JobVacancy.id
+    source = db.Column(db.String(32), nullable=False)
+    country_code = db.Column(db.String(8), nullable=False)
+    country = db.Column(db.String(64))
+    title = db.Column(db.String(512))
+    company = db.Column(db.String(256))
+    location = db.Column(db.String(256))
+    salary = db.Column(db.String(128))
+    description = db.Column(db.Text)                         # сниппет (см. job_text)
+    apply_url = db.Column(db.Text)
+    posted_date = db.Column(db.String(64))
+    job_type = db.Column(db.String(64))
+    language_requirement = db.Column(db.String(32))
+    refugee_friendly = db.Column(db.Boolean, default=False)
+
+    # Через какие термы/города вакансия приходила: '|driver|fahrer|'
+    search_terms = db.Column(db.Text)
+    search_locations = db.Column(db.Text)
+
+    first_seen = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    last_seen = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    vanished_at = db.Column(db.DateTime, index=True)         # давно не встречалась ни в одном срезе
+
+    __table_args__ = (
+        db.Index('ix_indexed_job_scope', 'source', 'country_code'),
+        db.Index('ix_indexed_job_source_url', 'source', 'apply_url'),
+    )
+
+    def to_job(self) -> JobVacancy:
+        return JobVacancy(
+            id=self.id,
+            title=self.title or '',
+            company=self.company or '',
+            location=self.location or '',
+            salary=self.salary,
+            description=self.description or '',
+            apply_url=self.apply_url or '',
+            source=self.source,
+            posted_date=self.posted_date or '',
+            country=self.country or '',
+            job_type=self.job_type,
+            language_requirement=self.language_requirement or 'unknown',
+            refugee_friendly=bool(self.refugee_friendly),
+        )
+
+
+class JobIndexSlice(db.Model):
+    """Свежесть среза: когда (source, страна, город, терм) последний раз брали из API"""
+    __tablename__ = "job_index_slice"
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(32), nullable=False)
+    country_code = db.Column(db.String(8), nullable=False)
+    location = db.Column(db.String(128), nullable=False, default='')
+    term = db.Column(db.String(256), nullable=False)
+    refreshed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    jobs_count = db.Column(db.Integer, default=0)
+    new_count = db.Column(db.Integer, default=0)       # впервые увиденных при последнем обновлении
+    runs = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.String(256))
+
+    __table_args__ = (
+        db.UniqueConstraint('source', 'country_code', 'location', 'term', name='uq_job_index_slice'),
+    )
+
+
+class JobIndexSliceJob(db.Model):
+    """Состав среза: какие вакансии (и в каком порядке) вернул API при последнем обновлении"""
+    __tablename__ = "job_index_slice_job"
+    slice_id = db.Column(db.Integer, db.ForeignKey('job_index_slice.id', ondelete='CASCADE'), primary_key=True)
+    job_id = db.Column(db.String(160), primary_key=True)
+    position = db.Column(db.Integer, nullable=False, default=0)
+
+
+# --- ИНИЦИАЛИЗАЦИЯ -----------------------------------------------------------
+
+def init_job_index(app):
+    """Создаёт таблицы (если нет)"""
+    global _app
+    if not JOB_INDEX_ENABLED:
+        print("ℹ️ JobIndex: отключён (JOB_INDEX_ENABLED=0)")
+        return
+    try:
+        with app.app_context():
+            IndexedJob.__table__.create(db.engine, checkfirst=True)
+            JobIndexSlice.__table__.create(db.engine, checkfirst=True)
+            JobIndexSliceJob.__table__.create(db.engine, checkfirst=True)
+
+            if db.engine.dialect.name == 'sqlite':
+                # dev-база без миграций; на Postgres колонки добавляет alembic (8b1e4d2c9a07)
+                _ensure_columns(IndexedJob.__table__)
+                _ensure_columns(JobIndexSlice.__table__)
+                with db.engine.begin() as conn:
+                    conn.execute(text("DROP TABLE IF EXISTS indexed_job_fts"))   # прежний FTS5
+        _app = app
+        print(f"✅ JobIndex: готов (TTL среза {SLICE_TTL_HOURS}ч)")
+    except Exception as e:
+        print(f"⚠️ JobIndex: инициализация не удалась: {e}")
+        _app = None
+
+
+def _ensure_columns(table):
+    """Докинуть новые nullable-колонки в уже существующую таблицу (только dev/SQLite без миграций)"""
+    existing = {c['name'] for c in inspect(db.engine).get_columns(table.name)}
+    missing = [c for c in table.columns if c.name not in existing]
+    if not missing:
+        return
+    with db.engine.begin() as conn:
+        for col in missing:
+            col_type = col.type.compile(dialect=db.engine.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col_type}"))
+            print(f"🔧 JobIndex: добавлена колонка {table.name}.{col.name}")
+
+
+def is_ready() -> bool:
+    return _app is not None
+
+
+@contextmanager
+def _context():
+    with _app.app_context():
+        yield
+
+
+def _norm(value: Optional[str]) -> str:
+    return (value or '').strip().lower()
+
+
+def _add_token(tokens: Optional[str], token: str) -> str:
+    tokens = tokens or '|'
+    if token and f"|{token}|" not in tokens:
+        tokens = f"{tokens}{token}|"
+    return tokens
+
+
+# --- ЧТЕНИЕ ------------------------------------------------------------------
+
+def _slice_filter(source: str, country_code: str, location: str, term: str):
+    return JobIndexSlice.query.filter_by(
+        source=source, country_code=country_code, location=location, term=term
+    )
+
+
+def slice_jobs(slice_id: int) -> List[JobVacancy]:
+    """Вакансии, записанные за срезом при последнем обновлении, в порядке выдачи API"""
+    rows = (IndexedJob.query
+            .join(JobIndexSliceJob, JobIndexSliceJob.job_id == IndexedJob.id)
+            .filter(JobIndexSliceJob.slice_id == slice_id)
+            .order_by(JobIndexSliceJob.position)
+            .all())
+    return [row.to_job() for row in rows]
+
+
+def query_slice(source: str, country_code: str, location: str, term: str,
+                max_age_hours: Optional[int] = None) -> Optional[List[JobVacancy]]:
+    """
+    list — срез свежий, ответ из индекса (может быть пустым);
+    None — среза нет/протух/индекс не готов → нужен живой запрос в API.
+    """
+    if not _app:
+        return None
+    ttl = SLICE_TTL_HOURS if max_age_hours is None else max_age_hours
+    try:
+        with _context():
+            sl = _slice_filter(source, country_code, _norm(location), _norm(term)).first()
+            if not sl or not sl.refreshed_at or sl.last_error:
+                # последнее обновление сорвалось — ответ индекса мог бы быть пустым/неполным
+                return None
+            if sl.refreshed_at < datetime.utcnow() - timedelta(hours=ttl):
+                return None
+            jobs = slice_jobs(sl.id)
+            if sl.jobs_count and not jobs:
+                # срез обновлён до появления job_index_slice_job — состав неизвестен
+                return None
+            return jobs
+    except Exception as e:
+        print(f"⚠️ JobIndex: ошибка чтения среза {source}/{country_code}/{term}: {e}")
+        return None
+
+
+# --- ЗАПИСЬ ------------------------------------------------------------------
+
+_COPY_FIELDS = ('title', 'company', 'location', 'salary', 'description', 'apply_url',
+                'posted_date', 'job_type', 'language_requirement', 'refugee_friendly', 'country')
+
+
+def _upsert_jobs(source: str, country_code: str, location: str, term: str,
+                 jobs: Iterable[JobVacancy], now: datetime) -> Tuple[List[IndexedJob], int]:
+    """Upsert по id источника, затем по apply_url. Возвращает (строки, число новых)"""
+    unique: Dict[str, JobVacancy] = {}
+    for j in jobs:
+        if getattr(j, 'id', None):
+            unique.setdefault(j.id, j)
+    if not unique:
+        return [], 0
+
+    by_id: Dict[str, IndexedJob] = {
+        row.id: row for row in IndexedJob.query.filter(IndexedJob.id.in_(list(unique))).all()
+    }
+    urls = [j.apply_url for jid, j in unique.items() if jid not in by_id and j.apply_url]
+    by_url: Dict[str, IndexedJob] = {}
+    if urls:
+        by_url = {
+            row.apply_url: row for row in IndexedJob.query.filter(
+                IndexedJob.source == source, IndexedJob.apply_url.in_(urls)
+            ).all()
+        }
+
+    touched: List[IndexedJob] = []
+    touched_ids = set()
+    created = 0
+    for jid, job in unique.items():
+        row = by_id.get(jid) or by_url.get(job.apply_url)
+        if row is None:
+            row = IndexedJob(id=jid, source=source, country_code=country_code, first_seen=now)
+            db.session.add(row)
+            created += 1
+        elif row.id in touched_ids:
+            continue
+        touched_ids.add(row.id)
+        for field in _COPY_FIELDS:
+            setattr(row, field, getattr(job, field))
+        row.search_terms = _add_token(row.search_terms, term)
+        row.search_locations = _add_token(row.search_locations, location)
+        row.last_seen = now
+        row.vanished_at = None
+        touched.append(row)
+    return touched, created
+
+
+def store_slice(source: str, country_code: str, location: str, term: str,
+                jobs: List[JobVacancy], error: Optional[str] = None) -> Optional[Dict[str, int]]:
+    """
+    Upsert вакансий среза + отметка свежести среза. Возвращает {'seen', 'new'}.
+    error — выдача оборвалась (сбой API, cooldown, отмена): вакансии всё равно
+    upsert-ятся, но состав и refreshed_at среза не меняются, пишется только
+    last_error — такой срез query_slice не отдаёт.
+    """
+    if not _app:
+        return None
+    location, term = _norm(location), _norm(term)
+    now = datetime.utcnow()
+    try:
+        with _context():
+            rows, created = _upsert_jobs(source, country_code, location, term, jobs or [], now)
+            db.session.flush()
+
+            sl = _slice_filter(source, country_code, location, term).first()
+            if error:
+                if sl is not None:
+                    sl.last_error = error[:256]
+                db.session.commit()
+                return {'seen': len(rows), 'new': created}
+            if sl is None:
+                sl = JobIndexSlice(source=source, country_code=country_code, location=location, term=term)
+                db.session.add(sl)
+            else:
+                JobIndexSliceJob.query.filter_by(slice_id=sl.id).delete(synchronize_session=False)
+            db.session.flush()
+            if rows:
+                db.session.execute(
+                    JobIndexSliceJob.__table__.insert(),
+                    [{'slice_id': sl.id, 'job_id': row.id, 'position': pos} for pos, row in enumerate(rows)]
+                )
+            sl.refreshed_at = now
+            sl.jobs_count = len(rows)
+            sl.new_count = created
+            sl.runs = (sl.runs or 0) + 1
+            sl.last_error = None
+            db.session.commit()
+            return {'seen': len(rows), 'new': created}
+    except Exception as e:
+        # сессия откатится при закрытии app context
+        print(f"⚠️ JobIndex: ошибка записи среза {source}/{country_code}/{term}: {e}")
+        return None
+
+
+def slice_freshness(sources: Iterable[str]) -> Dict[Tuple[str, str, str, str], Optional[datetime]]:
+    """(source, country, location, term) -> refreshed_at — для выбора самых «старых» срезов"""
+    if not _app:
+        return {}
+    with _context():
+        rows = JobIndexSlice.query.filter(JobIndexSlice.source.in_(list(sources))).all()
+        return {(r.source, r.country_code, r.location, r.term): r.refreshed_at for r in rows}
+
+
+def mark_vanished(older_than_hours: int = KEEP_HOURS) -> int:
+    """
+    Вакансии, которых не было ни в одном срезе дольше older_than_hours,
+    помечаем исчезнувшими (Adzuna отдаёт только верх выдачи, поэтому
+    отсутствие в одном обновлении среза ещё ничего не значит).
+    """
+    if not _app:
+        return 0
+    cutoff = datetime.utcnow() - timedelta(hours=older_than_hours)
+    with _context():
+        count = IndexedJob.query.filter(
+            IndexedJob.vanished_at.is_(None), IndexedJob.last_seen < cutoff
+        ).update({IndexedJob.vanished_at: datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        return count
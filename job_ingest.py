@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Фоновый инкрементальный краулер вакансий в локальный индекс (job_index).
+
+Вместо всплесков запросов, привязанных к пользовательским поискам, по
+расписанию обходим срезы (source, страна, терм) из specific_jobs — сначала
+самые давно обновлённые — в пределах бюджета API-запросов на цикл.
+Каждый срез upsert-ится в индекс (first_seen/last_seen), давно не
+встречавшиеся вакансии помечаются исчезнувшими.
+"""
+
+import os
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import schedule
+
+import job_index
+from job_text import flush_descriptions
+from adzuna_aggregator import RateLimitedError
+
+INGEST_INTERVAL_MINUTES = int(os.getenv('INGEST_INTERVAL_MINUTES', '30'))
+INGEST_BUDGET_PER_CYCLE = int(os.getenv('INGEST_BUDGET_PER_CYCLE', '40'))    # API-запросов за цикл
+INGEST_REFRESH_HOURS = int(os.getenv('INGEST_REFRESH_HOURS', '12'))          # свежее — не трогаем
+INGEST_ADZUNA_RESULTS = int(os.getenv('INGEST_ADZUNA_RESULTS', '50'))
+INGEST_COUNTRIES = [c.strip() for c in os.getenv('INGEST_COUNTRIES', '').split(',') if c.strip()]
+INGEST_SOURCES = [s.strip() for s in os.getenv('INGEST_SOURCES', 'adzuna,careerjet').split(',') if s.strip()]
+
+SERVER_IP = "127.0.0.1"
+SERVER_UA = "GlobalJobHunter/Ingest (+https://www.globaljobhunter.vip)"
+SERVER_URL = "https://www.globaljobhunter.vip/results"
+
+Slice = Tuple[str, str, str]   # (source, country_code, term)
+
+
+def iter_slices(aggregator, careerjet=None, countries: Optional[List[str]] = None) -> Iterator[Slice]:
+    """Все срезы из карты профессий; термы — те же, что уходят в API при обычном поиске"""
+    countries = countries or INGEST_COUNTRIES or list(aggregator.countries.keys())
+    seen = set()
+    for _category, ru_map in aggregator.specific_jobs.items():
+        for ru_title, terms in ru_map.items():
+            for cc in countries:
+                if 'adzuna' in INGEST_SOURCES and cc in aggregator.countries:
+                    for term in aggregator._get_localized_terms(terms, cc):
+                        key = ('adzuna', cc, term.strip().lower())
+                        if key not in seen:
+                            seen.add(key)
+                            yield key
+                if careerjet and 'careerjet' in INGEST_SOURCES and cc in careerjet.country_map:
+                    for term in careerjet._terms_from_ru(ru_title):
+                        key = ('careerjet', cc, term.strip().lower())
+                        if key not in seen:
+                            seen.add(key)
+                            yield key
+
+
+def plan_cycle(slices: List[Slice], budget: int) -> List[Slice]:
+    """Самые старые (или ни разу не обновлённые) срезы первыми, в пределах бюджета"""
+    freshness = job_index.slice_freshness({s[0] for s in slices})
+    now = datetime.utcnow()
+    stale = []
+    for source, cc, term in slices:
+        refreshed_at = freshness.get((source, cc, '', term))
+        if refreshed_at and (now - refreshed_at).total_seconds() < INGEST_REFRESH_HOURS * 3600:
+            continue
+        stale.append((refreshed_at or datetime.min, (source, cc, term)))
+    stale.sort(key=lambda item: item[0])
+    return [s for _, s in stale[:budget]]
+
+
+def _fetch_adzuna(aggregator, cc: str, term: str):
+    """(вакансии, ошибка) — ошибка, если API ответил сбоем, а не пустой выдачей"""
+    jobs = aggregator._search_single_term(term, cc, '', INGEST_ADZUNA_RESULTS)
+    return jobs, aggregator.last_request_error()
+
+
+def _fetch_careerjet(careerjet, cc: str, term: str):
+    """Те же страницы, что у обычного поиска (fetch_term_pages) — срез той же глубины"""
+    country_name = careerjet.country_map.get(cc)
+    jobs, error = careerjet.fetch_term_pages(
+        term, country_name, country_name, careerjet._get_locale_code(cc),
+        user_ip=SERVER_IP, user_agent=SERVER_UA, page_url=SERVER_URL,
+    )
+    if error == 'CAREERJET_COOLDOWN':
+        raise RateLimitedError(error)
+    return jobs, error
+
+
+def run_ingest_cycle(aggregator, additional_aggregators: Optional[Dict] = None,
+                     budget: int = INGEST_BUDGET_PER_CYCLE) -> Dict[str, int]:
+    """Один цикл обхода. Возвращает статистику цикла"""
+    stats = {'slices': 0, 'seen': 0, 'new': 0, 'errors': 0, 'vanished': 0}
+    if not aggregator or not job_index.is_ready():
+        print("⚠️ Ingest: агрегатор или индекс не готовы — пропускаем цикл")
+        return stats
+
+    careerjet = (additional_aggregators or {}).get('careerjet')
+    plan = plan_cycle(list(iter_slices(aggregator, careerjet)), budget)
+    print(f"🕷 Ingest: цикл {datetime.utcnow():%Y-%m-%d %H:%M}, срезов к обновлению: {len(plan)}")
+
+    blocked = set()   # источники, упёршиеся в 429/cooldown в этом цикле
+    for source, cc, term in plan:
+        if source in blocked:
+            continue
+        try:
+            if source == 'adzuna':
+                jobs, error = _fetch_adzuna(aggregator, cc, term)
+            else:
+                jobs, error = _fetch_careerjet(careerjet, cc, term)
+        except RateLimitedError:
+            print(f"⛔ Ingest: {source} упёрся в лимит — до следующего цикла")
+            blocked.add(source)
+            continue
+        except Exception as e:
+            error = str(e)
+            jobs = []
+        if error:
+            stats['errors'] += 1
+
+        # с error срез не считается обновлённым: store_slice запишет только last_error
+        result = job_index.store_slice(source, cc, '', term, jobs or [], error=error)
+        stats['slices'] += 1
+        if result:
+            stats['seen'] += result['seen']
+            stats['new'] += result['new']
+
+    flush_descriptions()
+    stats['vanished'] = job_index.mark_vanished()
+    print(f"✅ Ingest: срезов {stats['slices']}, вакансий {stats['seen']}, новых {stats['new']}, "
+          f"исчезло {stats['vanished']}, ошибок {stats['errors']}")
+    return stats
+
+
+def ingestion_scheduler(aggregator, additional_aggregators: Optional[Dict] = None):
+    """Бесконечный цикл для отдельного воркера (см. ingest_worker.py)"""
+    print(f"⏰ Ingest: каждые {INGEST_INTERVAL_MINUTES} мин, бюджет {INGEST_BUDGET_PER_CYCLE} запросов/цикл")
+    schedule.every(INGEST_INTERVAL_MINUTES).minutes.do(run_ingest_cycle, aggregator, additional_aggregators)
+    run_ingest_cycle(aggregator, additional_aggregators)
+    while True:
+        schedule.run_pending()
+        time.sleep(30)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Ранжирование результатов поиска.
+
+Порядок тот же, что был у sort_key в /results: страна → для беженцев →
+без языка → с зарплатой → дата. Но числовой скор считается ОДИН раз при
+добавлении вакансии (дата парсится, наличие зарплаты нормализуется) и
+хранится в самой записи (rank_score), а вакансии раскладываются по кучам
+стран. Это даёт инкрементальную вставку во время живого поиска и дешёвую
+выдачу страницы (top-k по нужным странам вместо полной сортировки).
+"""
+
+import heapq
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from itertools import count
+from typing import Dict, Iterable, List, Optional, Tuple
+
+PRIORITY_STEP = 1e11          # > любого unix-timestamp → приоритет доминирует над датой
+UNKNOWN_DATE_TS = 9.9e10      # нераспознанная дата — в конец своей группы (как раньше 'Unknown' > '2024-…')
+
+
+def parse_posted_date(value) -> Optional[datetime]:
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        text = str(value).strip()
+        try:
+            dt = datetime.fromisoformat(text)
+        except ValueError:
+            try:
+                dt = parsedate_to_datetime(text)
+            except (TypeError, ValueError, IndexError):
+                return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def rank_score(job: dict) -> float:
+    """Меньше — выше в выдаче (внутри страны)"""
+    priority = 0
+    if not job.get('refugee_friendly'):
+        priority += 4
+    if job.get('language_requirement') != 'no_language_required':
+        priority += 2
+    if not job.get('salary'):
+        priority += 1
+
+    dt = parse_posted_date(job.get('posted_date'))
+    ts = dt.timestamp() if dt else UNKNOWN_DATE_TS
+    return priority * PRIORITY_STEP + ts
+
+
+def ensure_score(job: dict) -> float:
+    score = job.get('rank_score')
+    if score is None:
+        score = job['rank_score'] = rank_score(job)
+    return score
+
+
+class JobRanking:
+    """
+    Кучи по странам: country -> [(score, seq, job_id)].
+    Изменённые записи (слияние дублей) перекладываются лениво: старый
+    элемент кучи становится «протухшим» и пропускается при чтении.
+    """
+
+    def __init__(self):
+        self._heaps: Dict[str, list] = {}
+        self._jobs: Dict[str, dict] = {}
+        self._live: Dict[str, int] = {}     # job_id -> seq актуального элемента
+        self._stale: Dict[str, int] = {}    # country -> число протухших элементов
+        self._seq = count()
+        # живой поиск пополняет ранжирование из фонового потока, а /search/stop читает
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def _push(self, job: dict):
+        seq = next(self._seq)
+        country = job.get('country') or ''
+        self._live[job['id']] = seq
+        heapq.heappush(self._heaps.setdefault(country, []), (job['rank_score'], seq, job['id']))
+
+    def add(self, job: dict):
+        """Добавить вакансию; повторное добавление пересчитывает её скор"""
+        jid = job.get('id')
+        if not jid:
+            return
+        with self._lock:
+            if jid in self._jobs:
+                self._update(job)
+                return
+            ensure_score(job)
+            self._jobs[jid] = job
+            self._push(job)
+
+    def update(self, job: dict):
+        """Пересчитать скор после изменения записи (например, слияния дубля)"""
+        self.add(job)
+
+    def _update(self, job: dict):
+        jid = job['id']
+        new_score = rank_score(job)
+        if new_score == job.get('rank_score'):
+            return
+        job['rank_score'] = new_score
+        self._jobs[jid] = job
+        country = job.get('country') or ''
+        self._stale[country] = self._stale.get(country, 0) + 1
+        self._push(job)
+
+    def _is_live(self, entry) -> bool:
+        return self._live.get(entry[2]) == entry[1]
+
+    def _country_sizes(self) -> List[Tuple[str, int]]:
+        return [(c, len(h) - self._stale.get(c, 0)) for c, h in sorted(self._heaps.items())]
+
+    def _country_top(self, country: str, k: int) -> List[dict]:
+        heap = self._heaps[country]
+        entries = heapq.nsmallest(k + self._stale.get(country, 0), heap)
+        return [self._jobs[e[2]] for e in entries if self._is_live(e)][:k]
+
+    def slice(self, start: int, stop: int) -> List[dict]:
+        """Вакансии [start:stop] в порядке выдачи — сортируем только задетые страны"""
+        with self._lock:
+            return self._slice(start, stop)
+
+    def _slice(self, start: int, stop: int) -> List[dict]:
+        out: List[dict] = []
+        offset = 0
+        for country, size in self._country_sizes():
+            if offset >= stop:
+                break
+            if offset + size > start:
+                lo = max(0, start - offset)
+                hi = min(size, stop - offset)
+                out.extend(self._country_top(country, hi)[lo:])
+            offset += size
+        return out
+
+    def top(self, k: int) -> List[dict]:
+        return self.slice(0, k)
+
+    def ordered(self) -> List[dict]:
+        return self.slice(0, len(self._jobs))
+
+    def ordered_map(self) -> Dict[str, dict]:
+        """Снапшот {id: job} в порядке выдачи (порядок ключей переживает JSON)"""
+        return {job['id']: job for job in self.ordered()}
+
+    @classmethod
+    def from_jobs(cls, jobs: Iterable[dict]) -> 'JobRanking':
+        ranking = cls()
+        for job in jobs:
+            ranking.add(job)
+        return ranking
+
+
+def _is_ranked(jobs: List[dict]) -> bool:
+    prev = None
+    for job in jobs:
+        score = job.get('rank_score')
+        if score is None:
+            return False
+        key = (job.get('country') or '', score)
+        if prev is not None and key < prev:
+            return False
+        prev = key
+    return True
+
+
+def ranked_page(job_map: Dict[str, dict], start: int, stop: int) -> List[dict]:
+    """
+    Страница выдачи из снапшота. Снапшоты пишутся уже упорядоченными —
+    тогда это просто срез; старые/неупорядоченные ранжируются через кучи.
+    """
+    jobs = list(job_map.values())
+    if _is_ranked(jobs):
+        return jobs[start:stop]
+    return JobRanking.from_jobs(jobs).slice(start, stop)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Текстовая стадия при приёме вакансии.
+
+Описания (Remotive — целиком HTML, Adzuna/Careerjet — длинный текст) раньше
+хранились как есть: в каждой записи суб-кеша, в каждом снапшоте results:{id}
+и в рендере. Показываем же мы сниппет. Поэтому на входе:
+  • вычищаем разметку (теги, script/style, HTML-сущности, лишние пробелы);
+  • в JobVacancy.description кладём короткий сниппет;
+  • полный очищенный текст — только в хранилище описаний (Redis job_desc:{id},
+    zlib, с TTL; плюс небольшой LRU в памяти процесса) для детального просмотра.
+"""
+
+import html
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from redis_conn import LazyRedis
+
+SNIPPET_CHARS = int(os.getenv('DESCRIPTION_SNIPPET_CHARS', '400'))
+JOB_DESC_TTL = int(os.getenv('JOB_DESC_TTL', str(3 * 24 * 3600)))
+LOCAL_CACHE_SIZE = int(os.getenv('JOB_DESC_LOCAL_CACHE', '2000'))
+FLUSH_BATCH = 50
+
+_DROP_BLOCKS_RE = re.compile(r'<(script|style)\b[^>]*>.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_BREAK_TAGS_RE = re.compile(r'<\s*(br|/p|/div|/li|/h[1-6]|/tr)\b[^>]*>', re.IGNORECASE)
+_TAG_RE = re.compile(r'<[^>]+>')
+_SPACES_RE = re.compile(r'[ \t\r\f\v\xa0]+')
+_NEWLINES_RE = re.compile(r'\s*\n\s*')
+
+
+def strip_html(text: Optional[str]) -> str:
+    """HTML → плоский текст (переносы строк на месте блоков)"""
+    if not text:
+        return ''
+    text = str(text)
+    if '<' in text:
+        text = _DROP_BLOCKS_RE.sub(' ', text)
+        text = _BREAK_TAGS_RE.sub('\n', text)
+        text = _TAG_RE.sub(' ', text)
+    if '&' in text:
+        text = html.unescape(text)
+    text = _SPACES_RE.sub(' ', text)
+    text = _NEWLINES_RE.sub('\n', text)
+    return text.strip()
+
+
+def make_snippet(text: str, limit: int = SNIPPET_CHARS) -> str:
+    """Обрезка по границе слова с многоточием"""
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    space = cut.rfind(' ')
+    if space > limit * 0.6:
+        cut = cut[:space]
+    return cut.rstrip(' ,.;:-\n') + '…'
+
+
+class DescriptionStore:
+    """Полные описания: LRU в памяти + Redis (пакетная запись через pipeline)"""
+
+    def __init__(self, capacity: int = LOCAL_CACHE_SIZE, ttl: int = JOB_DESC_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._local: "OrderedDict[str, str]" = OrderedDict()
+        self._pending: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+        # бинарные значения (zlib) — без decode_responses; при сбое Redis повторяем позже
+        self._redis = LazyRedis(decode_responses=False, label='JobText')
+
+    def _client(self):
+        return self._redis.get()
+
+    @staticmethod
+    def _key(job_id: str) -> str:
+        return f"job_desc:{job_id}"
+
+    def put(self, job_id: str, text: str):
+        if not job_id or not text:
+            return
+        with self._lock:
+            self._local[job_id] = text
+            self._local.move_to_end(job_id)
+            while len(self._local) > self.capacity:
+                self._local.popitem(last=False)
+            self._pending[job_id] = zlib.compress(text.encode('utf-8'))
+            should_flush = len(self._pending) >= FLUSH_BATCH
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        r = self._client()
+        if not r:
+            return
+        try:
+            pipe = r.pipeline(transaction=False)
+            for job_id, blob in pending.items():
+                pipe.setex(self._key(job_id), self.ttl, blob)
+            pipe.execute()
+        except Exception as e:
+            print(f"⚠️ JobText: не удалось сохранить описания в Redis: {e}")
+
+    def get(self, job_id: str) -> Optional[str]:
+        with self._lock:
+            text = self._local.get(job_id)
+            if text is not None:
+                self._local.move_to_end(job_id)
+                return text
+        r = self._client()
+        if not r:
+            return None
+        try:
+            blob = r.get(self._key(job_id))
+            return zlib.decompress(blob).decode('utf-8') if blob else None
+        except Exception:
+            return None
+
+
+description_store = DescriptionStore()
+
+
+def ingest_description(job_id: str, raw_description: Optional[str]) -> Tuple[str, str]:
+    """
+    (полный очищенный текст, сниппет). Полный текст уходит в хранилище,
+    только если он длиннее сниппета.
+    """
+    full_text = strip_html(raw_description)
+    snippet = make_snippet(full_text)
+    if snippet != full_text:
+        description_store.put(job_id, full_text)
+    return full_text, snippet
+
+
+def get_full_description(job_id: str) -> Optional[str]:
+    return description_store.get(job_id)
+
+
+def flush_descriptions():
+    """Дописать накопленные описания в Redis (конец поиска/пачки)"""
+    description_store.flush()
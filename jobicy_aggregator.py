@@ -12,6 +12,8 @@ from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional
 from dataclasses import dataclass
 from adzuna_aggregator import JobVacancy, CacheManager
+from job_classifier import classify_job
+from job_text import ingest_description
 
 
 class JobicyAggregator:
@@ -218,9 +220,12 @@ class JobicyAggregator:
             job_id = str(raw_job.get('id', '') or '')
             title = raw_job.get('jobTitle', '') or 'No title'
             company = raw_job.get('companyName', '') or 'No company'
-            description = raw_job.get('jobExcerpt', '') or ''
+            # полный текст (jobDescription, HTML) — в хранилище, в запись — сниппет
+            raw_description = raw_job.get('jobDescription') or raw_job.get('jobExcerpt', '') or ''
+            full_text, description = ingest_description(f"jobicy_{job_id}", raw_description)
             apply_url = raw_job.get('url', '') or ''
             posted_date = raw_job.get('pubDate', '') or 'Unknown'
+            language_req, refugee_friendly = classify_job(title, full_text)
 
             return JobVacancy(
                 id=f"jobicy_{job_id}",
@@ -234,8 +239,8 @@ class JobicyAggregator:
                 posted_date=posted_date,
                 country="Remote",
                 job_type="Remote",
-                language_requirement="unknown",
-                refugee_friendly=False
+                language_requirement=language_req,
+                refugee_friendly=refugee_friendly
             )
         except Exception as e:
             print(f"❌ {self.source_name}: ошибка нормализации: {e}")
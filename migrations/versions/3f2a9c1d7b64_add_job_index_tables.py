@@ -0,0 +1,66 @@
+"""Create local job index tables (idempotent): indexed_job, job_index_slice"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic identifiers
+revision = '3f2a9c1d7b64'
+down_revision = '7c7d3a0c8f1b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # --- indexed_job (создать, если нет) ---
+    op.execute("""
+    CREATE TABLE IF NOT EXISTS indexed_job (
+        id VARCHAR(160) PRIMARY KEY,
+        source VARCHAR(32) NOT NULL,
+        country_code VARCHAR(8) NOT NULL,
+        country VARCHAR(64),
+        title VARCHAR(512),
+        company VARCHAR(256),
+        location VARCHAR(256),
+        salary VARCHAR(128),
+        description TEXT,
+        apply_url TEXT,
+        posted_date VARCHAR(64),
+        job_type VARCHAR(64),
+        language_requirement VARCHAR(32),
+        refugee_friendly BOOLEAN DEFAULT FALSE,
+        search_terms TEXT,
+        search_locations TEXT,
+        first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_indexed_job_scope ON indexed_job (source, country_code)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_indexed_job_last_seen ON indexed_job (last_seen)")
+    # Полнотекст (удалён в c8a4d1e6f297 — читателей не было)
+    op.execute("""
+    CREATE INDEX IF NOT EXISTS ix_indexed_job_fts ON indexed_job USING GIN (
+        to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, '') || ' ' || coalesce(search_terms, ''))
+    )
+    """)
+
+    # --- job_index_slice (создать, если нет) ---
+    op.execute("""
+    CREATE TABLE IF NOT EXISTS job_index_slice (
+        id SERIAL PRIMARY KEY,
+        source VARCHAR(32) NOT NULL,
+        country_code VARCHAR(8) NOT NULL,
+        location VARCHAR(128) NOT NULL DEFAULT '',
+        term VARCHAR(256) NOT NULL,
+        refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        jobs_count INTEGER DEFAULT 0,
+        CONSTRAINT uq_job_index_slice UNIQUE (source, country_code, location, term)
+    )
+    """)
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS job_index_slice")
+    op.execute("DROP INDEX IF EXISTS ix_indexed_job_fts")
+    op.execute("DROP INDEX IF EXISTS ix_indexed_job_last_seen")
+    op.execute("DROP INDEX IF EXISTS ix_indexed_job_scope")
+    op.execute("DROP TABLE IF EXISTS indexed_job")
@@ -0,0 +1,31 @@
+"""Subscriber.next_send_at for SQL-side due selection (idempotent, with backfill)"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic identifiers
+revision = '5d0c7e3a91f2'
+down_revision = '8b1e4d2c9a07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("ALTER TABLE subscriber ADD COLUMN IF NOT EXISTS next_send_at TIMESTAMP")
+    # Интервалы совпадают с database.FREQUENCY_INTERVALS; без last_sent — к отправке сразу
+    op.execute("""
+    UPDATE subscriber SET next_send_at = CASE
+        WHEN frequency NOT IN ('daily', 'weekly', 'monthly') AND frequency IS NOT NULL THEN NULL
+        WHEN last_sent IS NULL THEN (now() AT TIME ZONE 'utc')
+        WHEN frequency = 'daily' THEN last_sent + INTERVAL '1 day'
+        WHEN frequency = 'monthly' THEN last_sent + INTERVAL '30 days'
+        ELSE last_sent + INTERVAL '7 days'
+    END
+    WHERE next_send_at IS NULL
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_subscriber_active_next_send ON subscriber (is_active, next_send_at)")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_subscriber_active_next_send")
+    op.execute("ALTER TABLE subscriber DROP COLUMN IF EXISTS next_send_at")
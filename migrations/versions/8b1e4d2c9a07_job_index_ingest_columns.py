@@ -0,0 +1,31 @@
+"""Job index: first_seen/vanished_at tracking and per-slice ingest stats (idempotent)"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic identifiers
+revision = '8b1e4d2c9a07'
+down_revision = '3f2a9c1d7b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("ALTER TABLE indexed_job ADD COLUMN IF NOT EXISTS vanished_at TIMESTAMP")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_indexed_job_vanished_at ON indexed_job (vanished_at)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_indexed_job_first_seen ON indexed_job (first_seen)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_indexed_job_source_url ON indexed_job (source, apply_url)")
+
+    op.execute("ALTER TABLE job_index_slice ADD COLUMN IF NOT EXISTS new_count INTEGER DEFAULT 0")
+    op.execute("ALTER TABLE job_index_slice ADD COLUMN IF NOT EXISTS runs INTEGER DEFAULT 0")
+    op.execute("ALTER TABLE job_index_slice ADD COLUMN IF NOT EXISTS last_error VARCHAR(256)")
+
+
+def downgrade():
+    op.execute("ALTER TABLE job_index_slice DROP COLUMN IF EXISTS last_error")
+    op.execute("ALTER TABLE job_index_slice DROP COLUMN IF EXISTS runs")
+    op.execute("ALTER TABLE job_index_slice DROP COLUMN IF EXISTS new_count")
+    op.execute("DROP INDEX IF EXISTS ix_indexed_job_source_url")
+    op.execute("DROP INDEX IF EXISTS ix_indexed_job_first_seen")
+    op.execute("DROP INDEX IF EXISTS ix_indexed_job_vanished_at")
+    op.execute("ALTER TABLE indexed_job DROP COLUMN IF EXISTS vanished_at")
@@ -0,0 +1,32 @@
+"""Create analytics_rollup (hourly/daily pre-aggregates for admin dashboards, idempotent)"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic identifiers
+revision = 'a41f6b2e8c53'
+down_revision = '5d0c7e3a91f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Заполнение по истории — analytics.rebuild_rollups при первом старте: посуточно, каждые
+    # сутки — DELETE + пересчёт под advisory-блокировкой суток, затем отметка grain='meta' (см. init_rollups)
+    op.execute("""
+    CREATE TABLE IF NOT EXISTS analytics_rollup (
+        id SERIAL PRIMARY KEY,
+        grain VARCHAR(4) NOT NULL,
+        bucket TIMESTAMP NOT NULL,
+        metric VARCHAR(32) NOT NULL,
+        dim VARCHAR(256) NOT NULL DEFAULT '',
+        count INTEGER NOT NULL DEFAULT 0,
+        CONSTRAINT uq_analytics_rollup UNIQUE (grain, bucket, metric, dim)
+    )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_analytics_rollup_metric ON analytics_rollup (metric, grain, bucket)")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_analytics_rollup_metric")
+    op.execute("DROP TABLE IF EXISTS analytics_rollup")
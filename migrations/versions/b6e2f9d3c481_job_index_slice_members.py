@@ -0,0 +1,27 @@
+"""Job index: per-slice membership so a fresh slice returns exactly what the API returned (idempotent)"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic identifiers
+revision = 'b6e2f9d3c481'
+down_revision = 'd5e1a9c4b702'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+    CREATE TABLE IF NOT EXISTS job_index_slice_job (
+        slice_id INTEGER NOT NULL REFERENCES job_index_slice (id) ON DELETE CASCADE,
+        job_id VARCHAR(160) NOT NULL,
+        position INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (slice_id, job_id)
+    )
+    """)
+    # Состав старых срезов неизвестен — пусть обновятся из API при первом запросе
+    op.execute("UPDATE job_index_slice SET refreshed_at = NULL WHERE jobs_count > 0")
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS job_index_slice_job")
@@ -0,0 +1,18 @@
+"""Index subscriber (created_at, id) for keyset pagination in admin (idempotent)"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic identifiers
+revision = 'c2d94f7a1e36'
+down_revision = 'a41f6b2e8c53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE INDEX IF NOT EXISTS ix_subscriber_created_id ON subscriber (created_at, id)")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_subscriber_created_id")
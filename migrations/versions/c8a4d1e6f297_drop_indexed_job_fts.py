@@ -0,0 +1,23 @@
+"""Job index: drop the unused full-text GIN index on indexed_job (idempotent)"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic identifiers
+revision = 'c8a4d1e6f297'
+down_revision = 'b6e2f9d3c481'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Свежий срез читается по job_index_slice_job; tsvector никто не запрашивает
+    op.execute("DROP INDEX IF EXISTS ix_indexed_job_fts")
+
+
+def downgrade():
+    op.execute("""
+    CREATE INDEX IF NOT EXISTS ix_indexed_job_fts ON indexed_job USING GIN (
+        to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, '') || ' ' || coalesce(search_terms, ''))
+    )
+    """)
@@ -0,0 +1,108 @@
+"""Monthly range partitioning of search_click / partner_click on created_at (idempotent)"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic identifiers
+revision = 'd5e1a9c4b702'
+down_revision = 'f7a3b81c5e20'
+branch_labels = None
+depends_on = None
+
+
+# Таблица пересоздаётся секционированной (PK включает ключ секционирования),
+# данные переносятся, секции — с месяца самой старой строки до +3 месяцев
+# вперёд и DEFAULT. Дальше секции создаёт analytics_partitions.ensure_partitions.
+PARTITION_SQL = """
+DO $$
+DECLARE
+    t text;
+    seq text;
+    pk text;
+    first_month date;
+    m date;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['search_click', 'partner_click'] LOOP
+        CONTINUE WHEN to_regclass(t) IS NULL;
+        CONTINUE WHEN EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(t));
+
+        EXECUTE format('ALTER TABLE %I RENAME TO %I', t, t || '_unpartitioned');
+        SELECT conname INTO pk FROM pg_constraint
+         WHERE conrelid = to_regclass(t || '_unpartitioned') AND contype = 'p';
+        IF pk IS NOT NULL THEN
+            EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', t || '_unpartitioned', pk);
+        END IF;
+        EXECUTE format('DROP INDEX IF EXISTS %I, %I, %I',
+                       'ix_' || t || '_created_at', 'ix_' || t || '_ip', 'ix_' || t || '_partner');
+
+        -- последовательность id переживает удаление старой таблицы
+        seq := pg_get_serial_sequence(t || '_unpartitioned', 'id');
+        IF seq IS NOT NULL THEN
+            EXECUTE format('ALTER SEQUENCE %s OWNED BY NONE', seq);
+        END IF;
+
+        EXECUTE format('UPDATE %I SET created_at = %L WHERE created_at IS NULL', t || '_unpartitioned', '1970-01-01');
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)',
+                       t, t || '_unpartitioned');
+        EXECUTE format('ALTER TABLE %I ALTER COLUMN created_at SET NOT NULL', t);
+        EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (id, created_at)', t);
+        EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', t || '_default', t);
+
+        EXECUTE format('SELECT date_trunc(''month'', min(created_at))::date FROM %I', t || '_unpartitioned')
+           INTO first_month;
+        m := least(coalesce(first_month, date_trunc('month', now())::date), date_trunc('month', now())::date);
+        WHILE m <= (date_trunc('month', now()) + interval '3 months')::date LOOP
+            EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                           t || '_y' || to_char(m, 'YYYY') || 'm' || to_char(m, 'MM'), t,
+                           m, (m + interval '1 month')::date);
+            m := (m + interval '1 month')::date;
+        END LOOP;
+
+        EXECUTE format('INSERT INTO %I SELECT * FROM %I', t, t || '_unpartitioned');
+        EXECUTE format('DROP TABLE %I', t || '_unpartitioned');
+        IF seq IS NOT NULL THEN
+            EXECUTE format('ALTER SEQUENCE %s OWNED BY %I.id', seq, t);
+        END IF;
+    END LOOP;
+END $$;
+"""
+
+
+def upgrade():
+    op.execute(PARTITION_SQL)
+    # индексы на родителе — создаются в каждой секции
+    op.execute("CREATE INDEX IF NOT EXISTS ix_search_click_created_at ON search_click (created_at)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_search_click_ip ON search_click (ip, created_at)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_partner_click_created_at ON partner_click (created_at)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_partner_click_partner ON partner_click (partner, created_at)")
+
+
+def downgrade():
+    # обратно в обычные таблицы (данные сохраняются)
+    op.execute("""
+    DO $$
+    DECLARE
+        t text;
+        seq text;
+    BEGIN
+        FOREACH t IN ARRAY ARRAY['search_click', 'partner_click'] LOOP
+            CONTINUE WHEN NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(t));
+            seq := pg_get_serial_sequence(t, 'id');
+            IF seq IS NOT NULL THEN
+                EXECUTE format('ALTER SEQUENCE %s OWNED BY NONE', seq);
+            END IF;
+            EXECUTE format('ALTER TABLE %I RENAME TO %I', t, t || '_partitioned');
+            EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS)', t, t || '_partitioned');
+            EXECUTE format('INSERT INTO %I SELECT * FROM %I', t, t || '_partitioned');
+            EXECUTE format('DROP TABLE %I CASCADE', t || '_partitioned');
+            EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (id)', t);
+            IF seq IS NOT NULL THEN
+                EXECUTE format('ALTER SEQUENCE %s OWNED BY %I.id', seq, t);
+            END IF;
+        END LOOP;
+    END $$;
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_search_click_created_at ON search_click (created_at)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_search_click_ip ON search_click (ip)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_partner_click_created_at ON partner_click (created_at)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_partner_click_partner ON partner_click (partner)")
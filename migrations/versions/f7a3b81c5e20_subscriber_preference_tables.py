@@ -0,0 +1,56 @@
+"""Normalized subscriber_job / subscriber_country tables, backfilled from JSON columns (idempotent)"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# Alembic identifiers
+revision = 'f7a3b81c5e20'
+down_revision = 'c2d94f7a1e36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+    CREATE TABLE IF NOT EXISTS subscriber_job (
+        subscriber_id INTEGER NOT NULL REFERENCES subscriber (id) ON DELETE CASCADE,
+        job VARCHAR(200) NOT NULL,
+        PRIMARY KEY (subscriber_id, job)
+    )
+    """)
+    op.execute("""
+    CREATE TABLE IF NOT EXISTS subscriber_country (
+        subscriber_id INTEGER NOT NULL REFERENCES subscriber (id) ON DELETE CASCADE,
+        country VARCHAR(8) NOT NULL,
+        PRIMARY KEY (subscriber_id, country)
+    )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_subscriber_job_job ON subscriber_job (job, subscriber_id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_subscriber_country_country ON subscriber_country (country, subscriber_id)")
+
+    # Перенос из JSON-текста; строки, которые не массив, пропускаем
+    op.execute("""
+    INSERT INTO subscriber_job (subscriber_id, job)
+    SELECT DISTINCT s.id, left(btrim(j.value), 200)
+    FROM subscriber s
+    CROSS JOIN LATERAL json_array_elements_text(
+        CASE WHEN s.selected_jobs ~ '^\\s*\\[' THEN s.selected_jobs::json ELSE '[]'::json END
+    ) AS j(value)
+    WHERE btrim(j.value) <> ''
+    ON CONFLICT DO NOTHING
+    """)
+    op.execute("""
+    INSERT INTO subscriber_country (subscriber_id, country)
+    SELECT DISTINCT s.id, left(lower(btrim(c.value)), 8)
+    FROM subscriber s
+    CROSS JOIN LATERAL json_array_elements_text(
+        CASE WHEN s.countries ~ '^\\s*\\[' THEN s.countries::json ELSE '[]'::json END
+    ) AS c(value)
+    WHERE btrim(c.value) <> ''
+    ON CONFLICT DO NOTHING
+    """)
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS subscriber_country")
+    op.execute("DROP TABLE IF EXISTS subscriber_job")
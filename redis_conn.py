@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Единая фабрика подключения к Redis для фоновых модулей (рассылка, очередь,
+хранилище описаний).
+
+Адрес — REDIS_TLS_URL / REDIS_URL (rediss:// — TLS), иначе REDIS_HOST/PORT/DB.
+connect_redis возвращает клиент после успешного PING или None.
+LazyRedis — для долгоживущих объектов: если Redis не ответил, повторяет
+попытку не чаще раза в REDIS_RETRY_SECONDS, а не отключает его до рестарта.
+"""
+
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+REDIS_RETRY_SECONDS = int(os.getenv('REDIS_RETRY_SECONDS', '30'))
+
+
+def connect_redis(decode_responses: bool = True, label: str = 'Redis', verbose: bool = False):
+    """Клиент Redis или None; decode_responses=False — для бинарных значений"""
+    if not redis:
+        return None
+    try:
+        url = os.getenv('REDIS_TLS_URL') or os.getenv('REDIS_URL')
+        if verbose:
+            print(f"ℹ️ {label}: using {'REDIS_TLS_URL/REDIS_URL' if url else 'REDIS_HOST/PORT/DB'}")
+        if url:
+            u = urlparse(url)
+            r = redis.Redis(
+                host=u.hostname, port=u.port or 6379, password=u.password,
+                db=int((u.path or '/0').lstrip('/')),
+                ssl=(u.scheme == 'rediss'), ssl_cert_reqs=None,
+                decode_responses=decode_responses,
+            )
+        else:
+            r = redis.Redis(
+                host=os.getenv('REDIS_HOST', 'localhost'),
+                port=int(os.getenv('REDIS_PORT', 6379)),
+                db=int(os.getenv('REDIS_DB', 0)),
+                decode_responses=decode_responses,
+            )
+        if verbose:
+            try:
+                kw = r.connection_pool.connection_kwargs
+                print(f"🔌 {label}: target {kw.get('host')}:{kw.get('port')}")
+            except Exception:
+                pass
+        r.ping()
+        return r
+    except Exception as e:
+        if verbose:
+            print(f"⚠️ {label}: Redis недоступен ({e})")
+        return None
+
+
+class LazyRedis:
+    """Подключение по первому требованию с повтором после сбоя"""
+
+    def __init__(self, decode_responses: bool = True, label: str = 'Redis',
+                 retry_seconds: int = REDIS_RETRY_SECONDS):
+        self.decode_responses = decode_responses
+        self.label = label
+        self.retry_seconds = retry_seconds
+        self._client = None
+        self._next_try = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._client is not None:
+            return self._client
+        now = time.monotonic()
+        if now < self._next_try:
+            return None
+        with self._lock:
+            if self._client is None and now >= self._next_try:
+                self._client = connect_redis(self.decode_responses, self.label)
+                if self._client is None:
+                    self._next_try = now + self.retry_seconds
+                    print(f"⚠️ {self.label}: Redis недоступен, повтор через {self.retry_seconds} с")
+            return self._client
+
@@ -14,6 +14,7 @@ import re
 
 # --- Переиспользуемые компоненты из adzuna_aggregator ---
 from adzuna_aggregator import JobVacancy, CacheManager, RateLimiter
+from job_text import ingest_description
 
 # --- Базовый класс для соблюдения архитектуры ---
 from base_aggregator import BaseJobAggregator
@@ -379,6 +380,10 @@ class RemotiveAggregator(BaseJobAggregator):
             except (ValueError, TypeError):
                 posted_date = datetime.now().strftime('%Y-%m-%d')
 
+            # description у Remotive — полный HTML
+            full_text, description = ingest_description(f"remotive_{job_id}", description)
+            language_req, refugee_friendly = self.classify_job(title, full_text, search_term)
+
             return JobVacancy(
                 id=f"remotive_{job_id}",
                 title=title,
@@ -391,8 +396,8 @@ class RemotiveAggregator(BaseJobAggregator):
                 posted_date=posted_date,
                 country='Remote',
                 job_type=raw_job.get('job_type'),
-                language_requirement=self.determine_language_requirement(title, description),
-                refugee_friendly=self.is_refugee_friendly(title, description, search_term)
+                language_requirement=language_req,
+                refugee_friendly=refugee_friendly
             )
         except Exception as e:
             print(f"⚠️ {self.source_name}: Ошибка нормализации вакансии: {e}")
@@ -1,11 +1,14 @@
-import json
 import os
 
-# Проверяем существует ли файл
-if os.path.exists('rate_limits.json'):
-    # Очищаем лимиты
-    with open('rate_limits.json', 'w') as f:
-        json.dump({}, f)
-    print("✅ Rate limits сброшены!")
+import redis
+
+from ip_rate_limit import SlidingWindowLimiter
+
+# Лимиты поисков теперь в Redis (ключи ratelimit:search:*), а не в rate_limits.json
+REDIS_URL = os.getenv("REDIS_URL")
+if REDIS_URL:
+    limiter = SlidingWindowLimiter(redis.Redis.from_url(REDIS_URL, decode_responses=True), backend='redis')
+    deleted = limiter.reset()
+    print(f"✅ Rate limits сброшены! Удалено ключей: {deleted}")
 else:
-    print("ℹ️ Файл rate_limits.json не найден - лимиты уже сброшены")
\ No newline at end of file
+    print("ℹ️ REDIS_URL не задан - лимиты хранятся в памяти процесса и сбрасываются при перезапуске")
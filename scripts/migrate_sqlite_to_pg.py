@@ -1,9 +1,18 @@
 # scripts/migrate_sqlite_to_pg.py
-import os, sqlite3, json
+#
+#   python -m scripts.migrate_sqlite_to_pg            — построчно (как раньше)
+#   python -m scripts.migrate_sqlite_to_pg --bulk     — пачками: keyset-чтение SQLite,
+#       одна проверка существующих строк на пачку, загрузка COPY (psycopg2) или
+#       executemany, чекпоинт после каждой пачки (повторный запуск продолжит)
+import os, sqlite3, json, argparse, io, time
 from datetime import datetime
+from sqlalchemy import insert, select, text
 from app import app, db, Subscriber, EmailLog  # модели из твоего app.py
+from database import compute_next_send_at, preferences_enabled, sync_subscriber_preferences
 
 SQLITE_PATH = os.path.join("instance", "globaljobhunter.db")
+CHECKPOINT_PATH = os.path.join("instance", "migrate_sqlite_to_pg.checkpoint.json")
+BULK_CHUNK = int(os.getenv("MIGRATE_CHUNK", "5000"))
 
 def row_exists(model, pk_val):
     return db.session.get(model, pk_val) is not None
@@ -23,12 +32,12 @@ def load_json(x):
     except:
         return None
 
-def migrate():
-    if not os.path.exists(SQLITE_PATH):
-        print(f"SQLite file not found: {SQLITE_PATH}")
+def migrate(sqlite_path=SQLITE_PATH):
+    if not os.path.exists(sqlite_path):
+        print(f"SQLite file not found: {sqlite_path}")
         return
 
-    con = sqlite3.connect(SQLITE_PATH)
+    con = sqlite3.connect(sqlite_path)
     con.row_factory = sqlite3.Row
     cur = con.cursor()
 
@@ -116,5 +125,220 @@ def migrate():
     con.close()
     print("DONE.")
 
+# --- BULK --------------------------------------------------------------------
+
+def _parse_dt(x):
+    if x is None or x == '' or isinstance(x, datetime):
+        return x or None
+    try:
+        return datetime.fromisoformat(str(x))
+    except ValueError:
+        return None
+
+
+def _load_checkpoint(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_checkpoint(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)   # атомарно: оборванная запись не портит чекпоинт
+
+
+def _sqlite_table(con, *names):
+    for name in names:
+        if con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone():
+            return name
+    return None
+
+
+def _convert(table, data):
+    """Строка SQLite → значения колонок целевой таблицы (JSON-текст переносим как есть)"""
+    row = {}
+    for col in table.c:
+        if col.name not in data:
+            continue
+        value = data[col.name]
+        try:
+            py_type = col.type.python_type
+        except NotImplementedError:
+            py_type = None
+        if py_type is bool:
+            value = None if value is None else as_bool(value)
+        elif py_type is datetime:
+            value = _parse_dt(value)
+        row[col.name] = value
+    return row
+
+
+def _copy_rows(table, rows):
+    """COPY ... FROM STDIN (CSV) через psycopg2; False — если COPY недоступен"""
+    if db.engine.dialect.name != "postgresql":
+        return False
+    raw = db.session.connection().connection.dbapi_connection
+    cursor = raw.cursor()
+    if not hasattr(cursor, "copy_expert"):
+        return False
+    cols = list(rows[0].keys())
+    buf = io.StringIO()
+    for row in rows:
+        fields = []
+        for c in cols:
+            v = row.get(c)
+            if v is None:
+                fields.append("")          # без кавычек — NULL
+            elif isinstance(v, bool):
+                fields.append("t" if v else "f")
+            else:
+                v = v.isoformat() if isinstance(v, datetime) else str(v)
+                fields.append('"' + v.replace('"', '""') + '"')
+        buf.write(",".join(fields) + "\n")
+    buf.seek(0)
+    cursor.copy_expert(f"COPY {table.name} ({', '.join(cols)}) FROM STDIN WITH (FORMAT csv)", buf)
+    return True
+
+
+def _load(table, rows, use_copy):
+    if use_copy and _copy_rows(table, rows):
+        return
+    db.session.execute(insert(table), rows)
+
+
+def _reset_sequence(table):
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {table.name}), 1))"
+        ))
+        db.session.commit()
+
+
+def _bulk_table(con, src, table, chunk, state, checkpoint, use_copy, prepare):
+    total = con.execute(f"SELECT COUNT(*) FROM {src}").fetchone()[0]
+    last_id = state.get(table.name, 0)
+    done = con.execute(f"SELECT COUNT(*) FROM {src} WHERE id <= ?", (last_id,)).fetchone()[0]
+    inserted = skipped = 0
+    started = time.time()
+    if last_id:
+        print(f"↪️ {table.name}: продолжаем с id > {last_id} ({done}/{total})")
+
+    while True:
+        batch = [dict(r) for r in con.execute(
+            f"SELECT * FROM {src} WHERE id > ? ORDER BY id LIMIT ?", (last_id, chunk))]
+        if not batch:
+            break
+        rows = [_convert(table, data) for data in batch]
+        rows = prepare(rows)      # одна проверка существующих строк на всю пачку
+        if rows:
+            _load(table, rows, use_copy)
+            if table is Subscriber.__table__ and preferences_enabled():
+                sync_subscriber_preferences(db.session.connection(),
+                                            [(r["id"], r.get("selected_jobs"), r.get("countries")) for r in rows],
+                                            replace=False)
+        db.session.commit()
+
+        last_id = batch[-1]["id"]
+        state[table.name] = last_id
+        _save_checkpoint(checkpoint, state)
+        done += len(batch)
+        inserted += len(rows)
+        skipped += len(batch) - len(rows)
+        rate = done / max(time.time() - started, 1e-6)
+        print(f"📦 {table.name}: {done}/{total} (добавлено {inserted}, уже были {skipped}, {rate:.0f} строк/с)")
+
+    _reset_sequence(table)
+    print(f"✅ {table.name}: готово — добавлено {inserted}, пропущено {skipped}")
+
+
+def _prepare_subscribers(rows):
+    table = Subscriber.__table__
+    rows = [r for r in rows if r.get("email")]
+    ids = [r["id"] for r in rows]
+    emails = [r["email"] for r in rows]
+    existing = db.session.execute(
+        select(table.c.id, table.c.email).where(table.c.id.in_(ids) | table.c.email.in_(emails))
+    ).fetchall()
+    taken_ids = {row.id for row in existing}
+    taken_emails = {row.email for row in existing}
+    fresh = []
+    for r in rows:
+        if r["id"] in taken_ids or r["email"] in taken_emails:
+            continue
+        taken_emails.add(r["email"])
+        r.setdefault("is_active", True)
+        r["frequency"] = r.get("frequency") or "weekly"
+        r["lang"] = r.get("lang") or "ru"
+        if not r.get("next_send_at"):
+            # bulk-вставка не вызывает события маппера; у всех строк пачки одинаковый набор ключей
+            r["next_send_at"] = (compute_next_send_at(r["frequency"], r.get("last_sent"), r["email"])
+                                 if r["is_active"] else None)
+        fresh.append(r)
+    return fresh
+
+
+def _prepare_email_logs(rows):
+    table = EmailLog.__table__
+    ids = [r["id"] for r in rows]
+    taken = {row.id for row in db.session.execute(select(table.c.id).where(table.c.id.in_(ids)))}
+    fresh = [r for r in rows if r["id"] not in taken]
+    # ссылки на подписчиков, которых в Postgres нет (дубликат email) — обнуляем
+    sub_ids = {r["subscriber_id"] for r in fresh if r.get("subscriber_id")}
+    if sub_ids:
+        sub_table = Subscriber.__table__
+        known = {row.id for row in db.session.execute(select(sub_table.c.id).where(sub_table.c.id.in_(sub_ids)))}
+        for r in fresh:
+            if r.get("subscriber_id") and r["subscriber_id"] not in known:
+                r["subscriber_id"] = None
+    for r in fresh:
+        r["jobs_count"] = r.get("jobs_count") or 0
+        r["status"] = r.get("status") or "sent"
+    return fresh
+
+
+def migrate_bulk(sqlite_path=SQLITE_PATH, chunk=BULK_CHUNK, checkpoint=CHECKPOINT_PATH,
+                 reset=False, use_copy=True):
+    if not os.path.exists(sqlite_path):
+        print(f"SQLite file not found: {sqlite_path}")
+        return
+
+    state = {} if reset else _load_checkpoint(checkpoint)
+    con = sqlite3.connect(sqlite_path)
+    con.row_factory = sqlite3.Row
+    started = time.time()
+    try:
+        with app.app_context():
+            src = _sqlite_table(con, "subscriber", "Subscriber")
+            if src:
+                _bulk_table(con, src, Subscriber.__table__, chunk, state, checkpoint, use_copy, _prepare_subscribers)
+            src = _sqlite_table(con, "email_log", "EmailLog")
+            if src:
+                _bulk_table(con, src, EmailLog.__table__, chunk, state, checkpoint, use_copy, _prepare_email_logs)
+    finally:
+        con.close()
+    print(f"DONE за {time.time() - started:.1f} с. Чекпоинт: {checkpoint}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос подписчиков и email-логов из SQLite в текущую БД")
+    parser.add_argument("--bulk", action="store_true", help="пачками, с чекпоинтом")
+    parser.add_argument("--sqlite", default=SQLITE_PATH, help="путь к SQLite-файлу")
+    parser.add_argument("--chunk", type=int, default=BULK_CHUNK, help="строк в пачке")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="файл чекпоинта")
+    parser.add_argument("--reset", action="store_true", help="начать заново, игнорируя чекпоинт")
+    parser.add_argument("--no-copy", action="store_true", help="executemany вместо COPY")
+    args = parser.parse_args()
+
+    if args.bulk:
+        migrate_bulk(args.sqlite, max(1, args.chunk), args.checkpoint, args.reset, not args.no_copy)
+    else:
+        migrate(args.sqlite)
+
+
 if __name__ == "__main__":
-    migrate()
+    main()
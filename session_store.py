@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Сессии на стороне сервера и компактные предпочтения поиска.
+
+Flask по умолчанию кладёт всю сессию (last_search_preferences, results_id,
+search_time) в подписанную cookie: она уходит с каждым запросом — опросы
+прогресса раз в 700 мс, статика под доменом .globaljobhunter.vip — и на
+каждом запросе проверяется подпись.
+
+SESSION_BACKEND=redis включает RedisSessionInterface: в cookie остаётся
+только случайный id, данные — в Redis (session:<id>, TTL SESSION_REDIS_TTL),
+запись — только если сессия изменилась. Для /static Redis не читается.
+Без Redis — обычные cookie-сессии Flask.
+
+Предпочтения в сессии хранятся сжато (compact_preferences): короткие ключи,
+без пустых значений и без city, совпадающего с первым из cities.
+"""
+
+import json
+import os
+import secrets
+from typing import Dict, Optional
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'cookie').lower()
+SESSION_REDIS_TTL = int(os.getenv('SESSION_REDIS_TTL', str(7 * 24 * 3600)))
+SESSION_KEY_PREFIX = 'session:'
+
+
+class RedisSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid: Optional[str] = None, new: bool = False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class RedisSessionInterface(SessionInterface):
+    """В cookie — только непрозрачный id; содержимое — компактный JSON в Redis"""
+
+    def __init__(self, redis_client, ttl: int = SESSION_REDIS_TTL, prefix: str = SESSION_KEY_PREFIX):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @staticmethod
+    def _new_sid() -> str:
+        return secrets.token_urlsafe(24)
+
+    def _expiry(self, app) -> int:
+        return min(self.ttl, int(app.permanent_session_lifetime.total_seconds())) or self.ttl
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if app.static_url_path and request.path.startswith(app.static_url_path + '/'):
+            # статике сессия не нужна — не ходим в Redis
+            return RedisSession(sid=sid)
+        if not sid:
+            return RedisSession(sid=self._new_sid(), new=True)
+        try:
+            raw = self.redis.get(self.prefix + sid)
+        except Exception as e:
+            print(f"⚠️ Session: Redis недоступен ({e}), сессия пустая")
+            return RedisSession(sid=sid)
+        if raw is None:
+            # неизвестный/истёкший id — выдаём новый, чужой id не принимаем
+            return RedisSession(sid=self._new_sid(), new=True)
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            data = {}
+        return RedisSession(data, sid=sid)
+
+    def save_session(self, app, session, response):
+        if not session.modified:
+            return
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            try:
+                self.redis.delete(self.prefix + session.sid)
+            except Exception:
+                pass
+            if not session.new:
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app))
+            return
+        try:
+            self.redis.setex(self.prefix + session.sid, self._expiry(app),
+                             json.dumps(dict(session), ensure_ascii=False, separators=(',', ':'), default=str))
+        except Exception as e:
+            print(f"⚠️ Session: не удалось сохранить сессию в Redis: {e}")
+            return
+        response.vary.add('Cookie')
+        response.set_cookie(
+            name, session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain, path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def init_session_store(app, redis_client) -> bool:
+    """Подключить Redis-сессии, если SESSION_BACKEND=redis и Redis отвечает"""
+    if SESSION_BACKEND != 'redis':
+        return False
+    if not redis_client:
+        print("⚠️ Session: SESSION_BACKEND=redis, но Redis не настроен — остаются cookie-сессии")
+        return False
+    try:
+        redis_client.ping()
+    except Exception as e:
+        print(f"⚠️ Session: Redis недоступен ({e}) — остаются cookie-сессии")
+        return False
+    app.session_interface = RedisSessionInterface(redis_client)
+    print("✅ Session: сессии хранятся в Redis")
+    return True
+
+
+# --- КОМПАКТНЫЕ ПРЕДПОЧТЕНИЯ -------------------------------------------------
+
+_SHORT_KEYS = {
+    'selected_jobs': 'j',
+    'countries': 'c',
+    'cities': 'y',
+    'city': 't',
+    'is_refugee': 'r',
+}
+_LONG_KEYS = {v: k for k, v in _SHORT_KEYS.items()}
+_LIST_KEYS = ('selected_jobs', 'countries', 'cities')
+
+
+def compact_preferences(preferences: Optional[Dict]) -> Dict:
+    """Предпочтения поиска → короткий dict для сессии (v — версия формата)"""
+    out = {'v': 1}
+    prefs = dict(preferences or {})
+    cities = prefs.get('cities') or []
+    if prefs.get('city') and cities and prefs['city'] == cities[0]:
+        prefs.pop('city')
+    for key, value in prefs.items():
+        if value is None or value == '' or value == [] or key == 'v':
+            continue
+        if key == 'is_refugee' and not value:
+            continue                                 # False — значение по умолчанию
+        if key in _LIST_KEYS and isinstance(value, (list, tuple)):
+            value = list(dict.fromkeys(value))      # без дублей, порядок сохраняется
+        out[_SHORT_KEYS.get(key, key)] = value
+    return out
+
+
+def expand_preferences(stored: Optional[Dict]) -> Dict:
+    """Обратно в полный вид (старые сессии без 'v' возвращаются как есть)"""
+    if not stored:
+        return {}
+    if 'v' not in stored:
+        return dict(stored)
+    prefs = {_LONG_KEYS.get(k, k): v for k, v in stored.items() if k != 'v'}
+    for key in _LIST_KEYS:
+        prefs.setdefault(key, [])
+    prefs.setdefault('is_refugee', False)
+    prefs.setdefault('city', prefs['cities'][0] if prefs['cities'] else None)
+    return prefs
@@ -8,6 +8,7 @@ import requests
 import time
 from typing import List, Dict, Optional
 from base_aggregator import BaseJobAggregator, JobVacancy
+from job_text import ingest_description
 
 class USAJobsAggregator(BaseJobAggregator):
     def __init__(self, api_key: str = None):
@@ -107,8 +108,8 @@ class USAJobsAggregator(BaseJobAggregator):
             
             posted_date = raw_job.get('PublicationStartDate', 'Unknown date')
             
-            language_req = self.determine_language_requirement(title, description)
-            refugee_friendly = self.is_refugee_friendly(title, description, search_term)
+            full_text, description = ingest_description(f"usajobs_{job_id}", description)
+            language_req, refugee_friendly = self.classify_job(title, full_text, search_term)
             
             return JobVacancy(
                 id=f"usajobs_{job_id}",